@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import RamenLog
+from .models import RamenLog, Shop
 
 @admin.register(RamenLog)
 class RamenLogAdmin(admin.ModelAdmin):
@@ -9,3 +9,9 @@ class RamenLogAdmin(admin.ModelAdmin):
     list_display = ('shop_name', 'user', 'visited_at', 'rating')
     list_filter = ('user', 'visited_at', 'rating')
     search_fields = ('shop_name', 'user__username', 'ordered_item')
+
+@admin.register(Shop)
+class ShopAdmin(admin.ModelAdmin):
+    list_display = ('name', 'name_key', 'visit_count', 'latitude', 'longitude', 'created_at')
+    readonly_fields = ('visit_count',)
+    search_fields = ('name', 'name_key')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RamenLogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ramen_log'
+
+    def ready(self):
+        # リードレプリカの振り分けのシステムチェックを登録する
+        from ramen_project import db_router  # noqa: F401
@@ -0,0 +1,16 @@
+# ramen_log/async_views.py
+"""ASGI で使う、ラーメンログ一覧の非同期版 (users/async_views.py を参照)"""
+from users.async_views import AsyncAPIView
+
+from .serializers import RAMEN_LOG_LIST_VALUES, serialize_ramen_log_rows
+from .views import RamenLogListCreateAPIView
+
+
+class AsyncRamenLogListCreateView(AsyncAPIView):
+    """RamenLogListCreateAPIView の GET (一覧) を非同期で返す。POST (作成) は同期版で処理する"""
+    sync_view = RamenLogListCreateAPIView
+
+    async def get(self, request, view, *args, **kwargs):
+        queryset = view.filter_queryset(view.get_queryset()).values(*RAMEN_LOG_LIST_VALUES)
+        page = await view.paginator.apaginate_queryset(queryset, request, view)
+        return view.get_paginated_response(serialize_ramen_log_rows(page))
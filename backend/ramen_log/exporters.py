@@ -0,0 +1,115 @@
+# ramen_log/exporters.py
+"""
+ラーメンログのストリーミングエクスポート (CSV / NDJSON)。
+
+サーバーサイドカーソル (QuerySet.iterator) で少しずつ読み出し、
+書き出した内容を一定サイズごとに返すため、履歴の件数に関係なくメモリ使用量は一定になる。
+出力の列はインポート (importers.py) と同じなので、そのまま再インポートできる。
+
+ASGI では aiter_chunks() で非同期イテレーターにして返す (Django 4.2 の ASGI は、同期のイテレーターの
+StreamingHttpResponse を全体を list にしてから送るため、ストリーミングにならずメモリにも全件載ってしまう)。
+"""
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from rest_framework import serializers
+
+from .models import RamenLog
+
+FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = ('id', 'shop_name', 'ordered_item', 'noodle_hardness', 'toppings', 'rating', 'visited_at')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+DEFAULT_CHUNK_SIZE = 2000
+# この大きさまで出力をまとめてから返す
+FLUSH_BYTES = 64 * 1024
+
+_datetime_field = serializers.DateTimeField()
+
+
+def export_rows(user, chunk_size=DEFAULT_CHUNK_SIZE):
+    """user のログを id 順に EXPORT_FIELDS のタプルで返す (サーバーサイドカーソルを使う)"""
+    return RamenLog.objects.filter(user=user).order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def _format_row(row):
+    values = dict(zip(EXPORT_FIELDS, row))
+    if values['rating'] is not None:
+        values['rating'] = str(values['rating'])
+    if values['visited_at'] is not None:
+        values['visited_at'] = _datetime_field.to_representation(values['visited_at'])
+    return values
+
+
+class _LineBuffer:
+    """csv.writer の出力先。書き込まれた文字列をそのまま返す"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        values = _format_row(row)
+        yield writer.writerow(['' if values[name] is None else values[name] for name in EXPORT_FIELDS])
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(_format_row(row), ensure_ascii=False) + '\n'
+
+
+def _buffered(lines):
+    """行を FLUSH_BYTES ごとにまとめた bytes にする"""
+    parts = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip 形式
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(user, file_format, gzip=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """エクスポートの内容を bytes のチャンクとして順に返す"""
+    rows = export_rows(user, chunk_size=chunk_size)
+    lines = iter_csv(rows) if file_format == 'csv' else iter_ndjson(rows)
+    chunks = _buffered(lines)
+    return _gzipped(chunks) if gzip else chunks
+
+
+async def aiter_chunks(chunks):
+    """
+    stream_export() のチャンクを1つずつ返す非同期イテレーター (ASGI 用)。
+    next() をリクエストのスレッド (thread_sensitive) で1回ずつ呼び、サーバーサイドカーソルを同じ接続で読み進める。
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # 途中で切断されたときもカーソルを閉じる
+        await sync_to_async(chunks.close, thread_sensitive=True)()
@@ -0,0 +1,272 @@
+# ramen_log/importers.py
+"""
+ラーメンログの一括インポート (CSV / NDJSON)。
+
+アップロードされたファイルは1行ずつ読み込み (全体をメモリに載せない)、
+batch_size 行ごとにバリデーションして bulk_create でまとめて書き込む。
+各チャンクは1トランザクションで書き込み、失敗した行は行番号付きのエラーとして返す。
+インポートしたログはフォロワーのタイムラインにログごとには展開せず、最後に最近の分だけを追加する
+(timeline.backfill_followers())。
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users import versions
+
+from . import shops, stats, timeline, visit_calendar
+from .models import RamenLog, RamenLogSyncCounter
+from .toppings import parse_toppings
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+# エラーレポートに含める最大件数 (これを超えた分は件数だけ数える)
+MAX_REPORTED_ERRORS = 1000
+# 受け付ける文字コードと、デコードに使うコーデック (UTF-8 は BOM 付きも読む。Shift_JIS は Excel の出力に合わせて cp932)
+ENCODINGS = {'utf-8': 'utf-8-sig', 'shift_jis': 'cp932'}
+DEFAULT_ENCODING = 'utf-8'
+
+
+class ImportFileError(ValueError):
+    """ファイル全体を読み込めない (ヘッダー行が読めないなど)"""
+
+
+def guess_format(filename, content_type=''):
+    """ファイル名や Content-Type から形式を推測する"""
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in (content_type or ''):
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in (content_type or ''):
+        return 'csv'
+    return None
+
+
+def _decoded_lines(binary_stream, encoding, bad_lines):
+    """
+    バイナリストリームを1行ずつデコードして返す。デコードできない行は置換文字に置き換え、
+    その行番号 (1始まりの物理行) を bad_lines に加える。
+    """
+    codec = ENCODINGS[encoding]
+    for line_number, raw in enumerate(binary_stream, start=1):
+        try:
+            yield raw.decode(codec)
+        except UnicodeDecodeError:
+            bad_lines.add(line_number)
+            yield raw.decode(codec, errors='replace')
+
+
+def iter_records(binary_stream, file_format, encoding=DEFAULT_ENCODING):
+    """
+    バイナリストリームを1行ずつ読み、(行番号, 行の辞書 or None, パースエラー or None) を返す。
+    行番号はデータ行の1始まりの番号 (CSV のヘッダー行は数えない)。
+    encoding でデコードできない行や CSV として読めない行も、その行のエラーとして返す
+    (それまでのチャンクは書き込み済みのため、途中で例外にしない)。ヘッダー行を読めない場合だけ ImportFileError。
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f'unsupported encoding: {encoding}')
+    decode_error = f'{encoding} として読み込めません。'
+    bad_lines = set()
+    lines = _decoded_lines(binary_stream, encoding, bad_lines)
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        try:
+            reader.fieldnames
+        except csv.Error as exc:
+            raise ImportFileError(f'ヘッダー行を CSV として読み込めません: {exc}')
+        if bad_lines:
+            raise ImportFileError(f'ヘッダー行を {encoding} として読み込めません。')
+        number = 0
+        while True:
+            # 1件のレコードが複数の物理行にまたがることもあるため、読んだ行にデコードできない行があったかで判定する
+            try:
+                record = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as exc:
+                record, parse_error = None, f'CSV として解釈できません: {exc}'
+            else:
+                parse_error = None
+            number += 1
+            if bad_lines:
+                record, parse_error = None, decode_error
+                bad_lines.clear()
+            elif record is not None and None in record:
+                record, parse_error = None, '列の数がヘッダーと一致しません。'
+            yield number, record, parse_error
+    elif file_format == 'ndjson':
+        number = 0
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            number += 1
+            if line_number in bad_lines:
+                yield number, None, decode_error
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, None, 'JSON として解釈できません。'
+                continue
+            if not isinstance(record, dict):
+                yield number, None, 'JSON オブジェクトではありません。'
+                continue
+            yield number, record, None
+    else:
+        raise ValueError(f'unsupported format: {file_format}')
+
+
+class ImportReport:
+    """インポート結果 (作成件数と行ごとのエラー)"""
+
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class RowValidator:
+    """
+    インポート行のバリデーション。
+    大量の行を扱うため、行ごとに RamenLogSerializer を通さず、
+    RamenLog のフィールド定義 (max_length, 桁数など) に基づいて直接検証・変換する。
+    エラーはシリアライザと同じく {フィールド名: [メッセージ]} の形で返す。
+    """
+
+    def __init__(self):
+        meta = RamenLog._meta
+        self.required = ('shop_name',)
+        self.char_fields = {
+            name: meta.get_field(name).max_length
+            for name in ('shop_name', 'ordered_item', 'noodle_hardness', 'toppings')
+        }
+        rating = meta.get_field('rating')
+        self.rating_places = rating.decimal_places
+        self.rating_whole_digits = rating.max_digits - rating.decimal_places
+        self.default_timezone = timezone.get_current_timezone()
+
+    def validate(self, record):
+        """(RamenLog に渡す値の辞書, エラーの辞書) を返す"""
+        values = {}
+        errors = {}
+        for name, max_length in self.char_fields.items():
+            value = record.get(name)
+            if value is None:
+                continue
+            value = str(value).strip()
+            if not value:
+                continue
+            if len(value) > max_length:
+                errors[name] = [f'{max_length} 文字以下にしてください。']
+            else:
+                values[name] = value
+        for name in self.required:
+            if name not in values and name not in errors:
+                errors[name] = ['この項目は必須です。']
+
+        rating = record.get('rating')
+        if rating not in (None, ''):
+            try:
+                rating = Decimal(str(rating).strip())
+                if not rating.is_finite():
+                    raise InvalidOperation
+            except InvalidOperation:
+                errors['rating'] = ['有効な数値を入力してください。']
+            else:
+                _, digits, exponent = rating.as_tuple()
+                places = max(0, -exponent)
+                whole_digits = max(0, len(digits) + exponent)
+                if places > self.rating_places or whole_digits > self.rating_whole_digits:
+                    errors['rating'] = [
+                        f'整数部 {self.rating_whole_digits} 桁・小数部 {self.rating_places} 桁以内で入力してください。'
+                    ]
+                else:
+                    values['rating'] = rating
+
+        visited_at = record.get('visited_at')
+        if visited_at not in (None, ''):
+            try:
+                parsed = parse_datetime(str(visited_at).strip())
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                errors['visited_at'] = ['日時の形式が正しくありません (ISO 8601 形式で入力してください)。']
+            else:
+                if timezone.is_naive(parsed):
+                    parsed = timezone.make_aware(parsed, self.default_timezone)
+                values['visited_at'] = parsed
+        return values, errors
+
+
+def import_logs(user, records, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    iter_records() が返す行を batch_size 件ずつバリデーションし、user のログとして書き込む。
+    ImportReport を返す。
+    """
+    report = ImportReport()
+    validator = RowValidator()
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            break
+        rows = []
+        for number, record, parse_error in chunk:
+            if parse_error is not None:
+                report.add_error(number, {'non_field_errors': [parse_error]})
+                continue
+            values, errors = validator.validate(record)
+            if errors:
+                report.add_error(number, errors)
+                continue
+            rows.append(values)
+        if rows:
+            report.created += len(create_logs(user, rows, batch_size=batch_size))
+    if report.created:
+        timeline.backfill_followers(user)
+    return report
+
+
+def create_logs(user, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    バリデーション済みの値 (RowValidator.validate() の結果) の一覧から user のログをまとめて作成し、
+    作成したログを返す。統計などの集計も同じトランザクションで更新する
+    (フォロワーのタイムラインへの展開は呼び出し側で行う)。
+    """
+    shop_ids = shops.resolve_shop_ids({values['shop_name'] for values in rows})
+    # bulk_create では save() が呼ばれないため、topping_tags と変更番号はここで設定する
+    logs = [
+        RamenLog(
+            user_id=user.id, shop_id=shop_ids.get(values['shop_name']),
+            topping_tags=parse_toppings(values.get('toppings')), **values
+        )
+        for values in rows
+    ]
+    with transaction.atomic():
+        first_version = RamenLogSyncCounter.objects.reserve(user.id, len(logs))
+        for offset, log in enumerate(logs):
+            log.sync_version = first_version + offset
+        RamenLog.objects.bulk_create(logs, batch_size=batch_size)
+        stats.record_created(user.id, logs)
+        visit_calendar.invalidate(user.id, logs)
+        shops.record_visits([log.shop_id for log in logs])
+        versions.bump(user.id, versions.Resource.RAMEN_LOGS)
+    return logs
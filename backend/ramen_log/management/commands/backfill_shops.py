@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ramen_log.models import RamenLog, Shop
+from ramen_log.shops import backfill_shops
+
+
+class Command(BaseCommand):
+    help = '店 (Shop) が未設定のラーメンログに、正規化した店名から Shop を割り当てる'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='一度に処理するログの件数')
+
+    def handle(self, *args, **options):
+        done = backfill_shops(RamenLog, Shop, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{done} 件のログを処理しました (店の数: {Shop.objects.count()})'))
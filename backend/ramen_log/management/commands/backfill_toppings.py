@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ramen_log.models import RamenLog
+from ramen_log.toppings import backfill_topping_tags
+
+
+class Command(BaseCommand):
+    help = (
+        'ラーメンログのトッピング (toppings) を分解して、検索用のタグ (topping_tags) を作り直す '
+        '(トッピングの回数の統計は rebuild_ramen_stats で数え直す)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='一度に処理するログの件数')
+
+    def handle(self, *args, **options):
+        done = backfill_topping_tags(RamenLog, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{done} 件のログを処理しました'))
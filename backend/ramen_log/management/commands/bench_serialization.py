@@ -0,0 +1,109 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ramen_project.renderers import JSONRenderer, MessagePackRenderer
+from ramen_log.models import RamenLog
+from ramen_log.serializers import RamenLogSerializer, RAMEN_LOG_LIST_VALUES, serialize_ramen_log_rows
+from user_relationships.models import UserRelationship
+from user_relationships.serializers import (
+    UserRelationshipSerializer, RELATIONSHIP_LIST_VALUES, serialize_relationship_rows,
+)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        '一覧APIのシリアライズ処理 (ModelSerializer と軽量パス) のクエリ数と1000行あたりの時間、'
+        'レスポンスの形式 (JSON / MessagePack、users=ref の有無) ごとのサイズとエンコード時間を計測する (データはロールバックされる)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='一覧の行数')
+        parser.add_argument('--repeat', type=int, default=5, help='計測の繰り返し回数 (最良値を採用)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            owner = self._seed(rows)
+            results = [
+                ('ramenlog (ModelSerializer)', lambda: RamenLogSerializer(
+                    RamenLog.objects.filter(user=owner).order_by('-visited_at'), many=True).data),
+                ('ramenlog (lean)', lambda: serialize_ramen_log_rows(
+                    RamenLog.objects.filter(user=owner).order_by('-visited_at').values(*RAMEN_LOG_LIST_VALUES))),
+                ('followers (ModelSerializer)', lambda: UserRelationshipSerializer(
+                    UserRelationship.objects.filter(followed=owner).select_related('follower'), many=True).data),
+                ('followers (lean)', lambda: serialize_relationship_rows(
+                    UserRelationship.objects.filter(followed=owner).values(*RELATIONSHIP_LIST_VALUES))),
+            ]
+            self.stdout.write('path\tqueries\tms/1k rows')
+            for name, run in results:
+                queries, elapsed = self._measure(run, options['repeat'])
+                self.stdout.write('%s\t%d\t%.2f' % (name, queries, elapsed * 1000 / rows * 1000))
+
+            lists = [
+                ('ramenlog', serialize_ramen_log_rows(
+                    RamenLog.objects.filter(user=owner).order_by('-visited_at').values(*RAMEN_LOG_LIST_VALUES))),
+                ('followers', serialize_relationship_rows(
+                    UserRelationship.objects.filter(followed=owner).values(*RELATIONSHIP_LIST_VALUES))),
+            ]
+            formats = [
+                ('json', JSONRenderer(), 'application/json'),
+                ('json users=ref', JSONRenderer(), 'application/json; users=ref'),
+                ('msgpack', MessagePackRenderer(), 'application/msgpack'),
+                ('msgpack users=ref', MessagePackRenderer(), 'application/msgpack; users=ref'),
+            ]
+            self.stdout.write('\nlist\tformat\tbytes\tvs json\tms/1k rows')
+            for list_name, data in lists:
+                json_size = None
+                for format_name, renderer, media_type in formats:
+                    body = renderer.render(data, media_type)
+                    json_size = json_size or len(body)
+                    _, elapsed = self._measure(lambda: renderer.render(data, media_type), options['repeat'])
+                    self.stdout.write('%s\t%s\t%d\t%.0f%%\t%.2f' % (
+                        list_name, format_name, len(body), len(body) * 100 / json_size, elapsed * 1000 / rows * 1000))
+            transaction.set_rollback(True)
+
+    def _seed(self, rows):
+        owner = User.objects.create_user(username='bench_serialization_owner')
+        now = timezone.now()
+        RamenLog.objects.bulk_create([
+            RamenLog(
+                user=owner, shop_name=f'shop{i % 300}', ordered_item='醤油ラーメン',
+                noodle_hardness='かため', toppings='味玉,チャーシュー',
+                rating=Decimal(random.randint(10, 50)) / 10,
+                visited_at=now - timedelta(hours=i),
+            )
+            for i in range(rows)
+        ], batch_size=5000)
+        followers = User.objects.bulk_create(
+            [User(username=f'bench_serialization_{i}') for i in range(rows)], batch_size=5000)
+        UserRelationship.objects.bulk_create([
+            UserRelationship(follower=f, followed=owner, status=UserRelationship.STATUS_APPROVED)
+            for f in followers
+        ], batch_size=5000)
+        return owner
+
+    def _measure(self, run, repeat):
+        best = None
+        executed = []
+
+        def count_queries(execute, sql, params, many, context):
+            executed.append(sql)
+            return execute(sql, params, many, context)
+
+        for _ in range(repeat):
+            executed.clear()
+            with connection.execute_wrapper(count_queries):
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return len(executed), best
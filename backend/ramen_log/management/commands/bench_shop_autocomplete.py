@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ramen_log import shops
+from ramen_log.models import Shop
+from ramen_log.shops import normalize_shop_name, shop_ngrams
+
+User = get_user_model()
+
+# 店名の生成に使う部品 (実際の店名のように、よく使われる語を多くの店が共有する)
+BRANDS = ['ラーメン', '中華そば', '麺屋', 'らぁ麺', 'つけ麺', '拉麺', 'らーめん', '麺処', '煮干しそば', '家系ラーメン']
+WORDS = [
+    '一蘭', '二郎', '天下一品', '蒙古タンメン', '中本', '一風堂', '武蔵', '大勝軒', '青葉', '満来',
+    '凪', '斑鳩', '鬼金棒', '蔦', '風雲児', 'AFURI', 'いち', 'まる', 'たけ', 'さくら', '龍', '虎', '鶏',
+]
+PLACES = [
+    '渋谷', '新宿', '池袋', '上野', '秋葉原', '神田', '高田馬場', '荻窪', '中野', '吉祥寺',
+    '横浜', '川崎', '大宮', '千葉', '立川', '町田', '品川', '五反田', '恵比寿', '目黒',
+]
+
+
+class Command(BaseCommand):
+    help = '店名オートコンプリートAPIの1打鍵ごとのレイテンシを計測する (データはロールバックされる)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=100000, help='店の数')
+        parser.add_argument('--visits', type=int, default=5000000, help='全店の訪問回数の合計 (人気の偏りを Zipf 分布で付ける)')
+        parser.add_argument('--words', type=int, default=200, help='打鍵を再現する店名の数')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            names = self._seed(options, rng)
+            queries = self._queries(names, options, rng)
+            results = [('api', self._measure_api(queries)), ('search', self._measure_search(queries))]
+            transaction.set_rollback(True)
+        self.stdout.write(f"shops={options['shops']} keystrokes={len(queries)}")
+        self.stdout.write('path\tp50(ms)\tp95(ms)\tp99(ms)\tmax(ms)\tslowest')
+        for name, timings in results:
+            slowest = sorted(timings, reverse=True)[:3]
+            timings = sorted(ms for ms, _ in timings)
+            self.stdout.write('%s\t%.2f\t%.2f\t%.2f\t%.2f\t%s' % (
+                name,
+                statistics.median(timings),
+                timings[int(len(timings) * 0.95) - 1],
+                timings[int(len(timings) * 0.99) - 1],
+                timings[-1],
+                ', '.join(q for _, q in slowest),
+            ))
+
+    def _seed(self, options, rng):
+        names = {}
+        while len(names) < options['shops']:
+            name = f'{rng.choice(BRANDS)} {rng.choice(WORDS)}{rng.randint(1, 999)} {rng.choice(PLACES)}店'
+            names.setdefault(normalize_shop_name(name), name)
+        # i 番目に人気の店の訪問回数が 1/(i+1) に比例するように配分する
+        weights = [1 / (i + 1) for i in range(len(names))]
+        scale = options['visits'] / sum(weights)
+        Shop.objects.bulk_create(
+            [
+                Shop(name=name, name_key=key, name_grams=shop_ngrams(key), visit_count=max(1, int(weights[i] * scale)))
+                for i, (key, name) in enumerate(names.items())
+            ],
+            batch_size=5000,
+        )
+        with connection.cursor() as cursor:
+            # 本番では autovacuum が行う、GIN の保留リストの取り込みを済ませておく
+            cursor.execute("SELECT gin_clean_pending_list('shop_name_grams_gin')")
+            cursor.execute('ANALYZE')
+        return list(names.values())
+
+    def _queries(self, names, options, rng):
+        """店名を1文字ずつ入力したときのクエリ (よく使われる語だけの入力も含める)"""
+        queries = ['ラ', 'ラー', 'ラーメ', 'ラーメン', '麺', '麺屋', 'そば', '店']
+        for name in rng.sample(names, min(options['words'], len(names))):
+            queries.extend(name[:n] for n in range(1, len(name) + 1))
+        return queries
+
+    def _timed(self, queries, run):
+        for query in queries[:10]:  # ウォームアップ
+            run(query)
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            timings.append(((time.perf_counter() - start) * 1000, query))
+        return timings
+
+    def _measure_api(self, queries):
+        """APIとしての1リクエストの時間 (認証やシリアライズを含む)"""
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user=User.objects.create_user(username='bench_shop_autocomplete'))
+        url = reverse('shop-autocomplete')
+
+        def run(query):
+            response = client.get(url, {'q': query})
+            assert response.status_code == 200, response.content
+        return self._timed(queries, run)
+
+    def _measure_search(self, queries):
+        """検索 (shops.autocomplete) だけの時間"""
+        return self._timed(queries, shops.autocomplete)
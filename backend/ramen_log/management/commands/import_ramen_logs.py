@@ -0,0 +1,47 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ramen_log import importers
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'CSV / NDJSON ファイルからラーメンログを一括インポートする'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='ログを登録するユーザー名')
+        parser.add_argument('path', help='インポートするファイルのパス')
+        parser.add_argument('--format', dest='file_format', choices=importers.FORMATS, help='ファイル形式 (省略時は拡張子から判定)')
+        parser.add_argument('--encoding', choices=importers.ENCODINGS, default=importers.DEFAULT_ENCODING, help='ファイルの文字コード')
+        parser.add_argument('--batch-size', type=int, default=importers.DEFAULT_BATCH_SIZE, help='1回の書き込み件数')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"ユーザー {options['username']} が見つかりません。")
+        file_format = options['file_format'] or importers.guess_format(options['path'])
+        if file_format is None:
+            raise CommandError('ファイル形式を判定できません。--format を指定してください。')
+        batch_size = options['batch_size']
+        if not 1 <= batch_size <= importers.MAX_BATCH_SIZE:
+            raise CommandError(f'--batch-size は 1 から {importers.MAX_BATCH_SIZE} の範囲で指定してください。')
+
+        start = time.perf_counter()
+        with open(options['path'], 'rb') as stream:
+            try:
+                report = importers.import_logs(
+                    user, importers.iter_records(stream, file_format, options['encoding']), batch_size=batch_size)
+            except importers.ImportFileError as exc:
+                raise CommandError(str(exc))
+        elapsed = time.perf_counter() - start
+
+        for error in report.errors:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f'{report.created} 件を登録しました ({report.failed} 件失敗, {elapsed:.1f} 秒)'
+        ))
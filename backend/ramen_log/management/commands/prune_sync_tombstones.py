@@ -0,0 +1,25 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ramen_log import sync
+
+
+class Command(BaseCommand):
+    help = (
+        '差分同期用の削除済みログの墓標のうち、古いものを少しずつ削除する (cron などで1日1回実行する。'
+        'これより前のトークンで同期したクライアントには全件を取り直させる)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='この日数より前に削除されたログの墓標を消す')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の DELETE で削除する件数')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        deleted = sync.prune_tombstones(timezone.now() - timedelta(days=options['days']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'削除済みログの墓標を {deleted} 件削除しました ({time.perf_counter() - start:.1f} 秒)'
+        ))
@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ramen_log import stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'ユーザーごとのラーメン統計を RamenLog から作り直す (--verify で差分の確認のみ)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='書き込まずに、保存されている統計との差分だけを表示する')
+        parser.add_argument('--user', help='対象ユーザー名 (省略時は全ユーザー)')
+        parser.add_argument('--batch-size', type=int, default=500, help='一度に読み込むユーザー数')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f"ユーザー {options['user']} が見つかりません。")
+
+        checked = 0
+        mismatched = 0
+        last_id = 0
+        while True:
+            # id によるキーセットでユーザーを batch_size 件ずつ処理する
+            user_ids = list(users.filter(id__gt=last_id).values_list('id', flat=True)[:options['batch_size']])
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                checked += 1
+                if options['verify']:
+                    expected, expected_counters = stats.compute_user(user_id)
+                    actual, actual_counters = stats.stored_user(user_id)
+                    if not stats.same_stats(expected, actual) or expected_counters != actual_counters:
+                        mismatched += 1
+                        self.stdout.write(f'user_id={user_id}: 統計が一致しません')
+                else:
+                    stats.rebuild_user(user_id)
+            last_id = user_ids[-1]
+
+        if options['verify']:
+            style = self.style.SUCCESS if not mismatched else self.style.ERROR
+            self.stdout.write(style(f'{checked} 人を確認しました ({mismatched} 人が不一致)'))
+            if mismatched:
+                raise CommandError('統計が一致しないユーザーがいます。--verify を外して再実行すると作り直せます。')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{checked} 人の統計を作り直しました'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ramen_log.models import RamenLog, Shop
+from ramen_log.shops import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = '店名オートコンプリート用の n-gram (name_grams) と、店ごとの訪問回数を作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='一度に処理する店の数')
+
+    def handle(self, *args, **options):
+        done = rebuild_search_index(RamenLog, Shop, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{done} 店の検索インデックスを作り直しました'))
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ramen_log', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='ramenlog',
+            name='user_name',
+        ),
+        migrations.AddField(
+            model_name='ramenlog',
+            name='user',
+            field=models.ForeignKey(default=None, on_delete=django.db.models.deletion.CASCADE, related_name='ramen_logs', to=settings.AUTH_USER_MODEL),
+            preserve_default=False,
+        ),
+    ]
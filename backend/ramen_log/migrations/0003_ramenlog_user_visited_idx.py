@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0002_remove_ramenlog_user_name_ramenlog_user'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=models.Index(models.F('user'), models.OrderBy(models.F('visited_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='ramenlog_user_visited_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ramen_log', '0004_timeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RamenStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ramen_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('shop_count', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RamenStatsCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('shop', '店'), ('item', '注文'), ('hardness', '麺の硬さ')], max_length=10)),
+                ('value', models.CharField(max_length=200)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'kind', '-count', 'value'], name='ramen_stats_counter_top_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ramenstatscounter',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'value'), name='unique_ramen_stats_counter'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# ramen_log.shops の名寄せ (このマイグレーションを作った時点のもの) を写したもの。
+# アプリのコードが変わっても結果が変わらないよう、マイグレーションからは import しない
+BATCH_SIZE = 2000
+_WHITESPACE = re.compile(r'\s+')
+_SHOP_SUFFIX = '店'
+
+
+def normalize_shop_name(name):
+    if not name:
+        return ''
+    key = unicodedata.normalize('NFKC', str(name)).casefold()
+    key = _WHITESPACE.sub('', key)
+    if key.endswith(_SHOP_SUFFIX) and len(key) > len(_SHOP_SUFFIX):
+        key = key[:-len(_SHOP_SUFFIX)]
+    return key
+
+
+def forwards(apps, schema_editor):
+    RamenLog = apps.get_model('ramen_log', 'RamenLog')
+    Shop = apps.get_model('ramen_log', 'Shop')
+    last_id = 0
+    while True:
+        logs = list(
+            RamenLog.objects.filter(id__gt=last_id, shop__isnull=True).order_by('id').only('id', 'shop_name')[:BATCH_SIZE]
+        )
+        if not logs:
+            return
+        keys = {}
+        for log in logs:
+            key = normalize_shop_name(log.shop_name)
+            if key:
+                keys.setdefault(key, str(log.shop_name).strip())
+        found = dict(Shop.objects.filter(name_key__in=keys).values_list('name_key', 'id'))
+        Shop.objects.bulk_create(
+            [Shop(name=display[:100], name_key=key) for key, display in keys.items() if key not in found],
+            ignore_conflicts=True,
+        )
+        found = dict(Shop.objects.filter(name_key__in=keys).values_list('name_key', 'id'))
+        for log in logs:
+            log.shop_id = found.get(normalize_shop_name(log.shop_name))
+        RamenLog.objects.bulk_update(logs, ['shop'], batch_size=BATCH_SIZE)
+        last_id = logs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0006_shop'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:12
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+from django.db.models import Count
+
+# ramen_log.shops の検索用の n-gram と訪問回数の作り直し (このマイグレーションを作った時点のもの) を写したもの。
+# アプリのコードが変わっても結果が変わらないよう、マイグレーションからは import しない
+BATCH_SIZE = 2000
+
+
+def shop_ngrams(key):
+    grams = set(key)
+    grams.update(key[i:i + 2] for i in range(len(key) - 1))
+    return sorted(grams)
+
+
+def forwards(apps, schema_editor):
+    RamenLog = apps.get_model('ramen_log', 'RamenLog')
+    Shop = apps.get_model('ramen_log', 'Shop')
+    last_id = 0
+    while True:
+        shops = list(Shop.objects.filter(id__gt=last_id).order_by('id').only('id', 'name_key')[:BATCH_SIZE])
+        if not shops:
+            return
+        ids = [shop.id for shop in shops]
+        counts = dict(RamenLog.objects.filter(shop_id__in=ids).values_list('shop_id').annotate(n=Count('id')).order_by())
+        for shop in shops:
+            shop.name_grams = shop_ngrams(shop.name_key)
+            shop.visit_count = counts.get(shop.id, 0)
+        Shop.objects.bulk_update(shops, ['name_grams', 'visit_count'], batch_size=BATCH_SIZE)
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0007_backfill_shops'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='name_grams',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=3), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='visit_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name_grams'], name='shop_name_grams_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['-visit_count', 'id'], name='shop_popularity_idx'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:39
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# ramen_log.toppings のタグへの分解 (このマイグレーションを作った時点のもの) を写したもの。
+# アプリのコードが変わっても結果が変わらないよう、マイグレーションからは import しない
+BATCH_SIZE = 2000
+MAX_TAG_LENGTH = 50
+_SEPARATORS = re.compile(r'[,、，/／・･\s]+')
+
+
+def parse_toppings(text):
+    if not text:
+        return []
+    tags = []
+    for part in _SEPARATORS.split(unicodedata.normalize('NFKC', text)):
+        tag = unicodedata.normalize('NFKC', part).lower().strip()[:MAX_TAG_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def forwards(apps, schema_editor):
+    # トッピングの回数 (RamenStatsCounter) は 0013 で topping_tags から数える
+    RamenLog = apps.get_model('ramen_log', 'RamenLog')
+    last_id = 0
+    while True:
+        logs = list(
+            RamenLog.objects.filter(id__gt=last_id, toppings__isnull=False).order_by('id').only('id', 'toppings')[:BATCH_SIZE]
+        )
+        if not logs:
+            return
+        for log in logs:
+            log.topping_tags = parse_toppings(log.toppings)
+        RamenLog.objects.bulk_update(logs, ['topping_tags'], batch_size=BATCH_SIZE)
+        last_id = logs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0008_shop_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ramenlog',
+            name='topping_tags',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.AlterField(
+            model_name='ramenstatscounter',
+            name='kind',
+            field=models.CharField(choices=[('shop', '店'), ('item', '注文'), ('hardness', '麺の硬さ'), ('topping', 'トッピング')], max_length=10),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['topping_tags'], name='ramenlog_topping_tags_gin'),
+        ),
+    ]
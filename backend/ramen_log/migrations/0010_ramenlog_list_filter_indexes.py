@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0009_ramenlog_topping_tags'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=models.Index(models.F('user'), models.OrderBy(models.F('visited_at'), nulls_last=True), models.OrderBy(models.F('id')), name='ramenlog_user_visited_asc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=models.Index(models.F('user'), models.OrderBy(models.F('rating'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='ramenlog_user_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=models.Index(models.F('user'), models.F('shop'), models.OrderBy(models.F('visited_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='ramenlog_user_shop_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=models.Index(models.F('user'), models.F('noodle_hardness'), models.OrderBy(models.F('visited_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='ramenlog_user_hardness_idx'),
+        ),
+    ]
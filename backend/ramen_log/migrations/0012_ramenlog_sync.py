@@ -0,0 +1,81 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# 既存のログに、ユーザーごとに id の順で変更番号 1, 2, ... を割り当て、カウンターを最後の番号にする
+BACKFILL_SYNC_VERSIONS = """
+UPDATE ramen_log_ramenlog AS log SET sync_version = numbered.version
+FROM (SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY id) AS version FROM ramen_log_ramenlog) AS numbered
+WHERE log.id = numbered.id;
+INSERT INTO ramen_log_ramenlogsynccounter (user_id, version, pruned_version)
+SELECT user_id, max(sync_version), 0 FROM ramen_log_ramenlog GROUP BY user_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_cached_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ramen_log', '0011_ramen_calendar_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RamenLogSyncCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.BigIntegerField(default=0)),
+                ('pruned_version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RamenLogTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_id', models.BigIntegerField()),
+                ('client_key', models.CharField(blank=True, max_length=64, null=True)),
+                ('sync_version', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ramenlog',
+            name='client_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='ramenlog',
+            name='sync_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ramenlog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunSQL(BACKFILL_SYNC_VERSIONS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='ramenlog',
+            index=models.Index(fields=['user', 'sync_version'], name='ramenlog_user_sync_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ramenlog',
+            constraint=models.UniqueConstraint(fields=('user', 'client_key'), name='unique_ramenlog_client_key'),
+        ),
+        migrations.AddField(
+            model_name='ramenlogtombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='ramenlogtombstone',
+            index=models.Index(fields=['user', 'sync_version'], name='ramenlog_tombstone_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ramenlogtombstone',
+            index=models.Index(fields=['deleted_at'], name='ramenlog_tombstone_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+# 0009 で topping_tags を埋めたログから、ユーザーごとのトッピングの回数 (RamenStatsCounter, kind=topping) を数える
+# (stats.py と同じく、1つのログの同じタグは1回と数える。topping_tags は重複を含まない)
+# 0009 の後に作成・削除されたログの分も含めて数え直すため、既存の行は上書きする
+BACKFILL_TOPPING_COUNTERS = """
+INSERT INTO ramen_log_ramenstatscounter (user_id, kind, value, count)
+SELECT log.user_id, 'topping', tag.value, count(*)
+FROM ramen_log_ramenlog AS log CROSS JOIN unnest(log.topping_tags) AS tag(value)
+GROUP BY log.user_id, tag.value
+ON CONFLICT (user_id, kind, value) DO UPDATE SET count = EXCLUDED.count;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0012_ramenlog_sync'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_TOPPING_COUNTERS, migrations.RunSQL.noop),
+    ]
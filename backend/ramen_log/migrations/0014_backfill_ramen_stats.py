@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# 0005 で作った統計 (RamenStats と、注文・麺の硬さの RamenStatsCounter) を既存のログから数える
+# (stats.counter_value() と同じく、前後の空白を除いて空になる値は数えない)。
+# 0005 の後に作成・削除されたログの分も含めて数え直すため、既存の行は上書きする。
+# 店のカウンターは表記ゆれをまとめた正規化キーで数えるため、0015 で作り直す。
+# ここでは shop_count を保存されている店のカウンターの行数に合わせるだけにする
+BACKFILL_RAMEN_STATS = """
+INSERT INTO ramen_log_ramenstatscounter (user_id, kind, value, count)
+SELECT counted.user_id, counted.kind, counted.value, count(*)
+FROM (
+    SELECT user_id, 'item' AS kind, regexp_replace(ordered_item, '^\\s+|\\s+$', '', 'g') AS value
+    FROM ramen_log_ramenlog
+    UNION ALL
+    SELECT user_id, 'hardness', regexp_replace(noodle_hardness, '^\\s+|\\s+$', '', 'g')
+    FROM ramen_log_ramenlog
+) AS counted
+WHERE counted.value <> ''
+GROUP BY counted.user_id, counted.kind, counted.value
+ON CONFLICT (user_id, kind, value) DO UPDATE SET count = EXCLUDED.count;
+
+INSERT INTO ramen_log_ramenstats (user_id, visit_count, shop_count, rating_count, rating_sum, updated_at)
+SELECT log.user_id, count(*),
+    (SELECT count(*) FROM ramen_log_ramenstatscounter AS counter WHERE counter.user_id = log.user_id AND counter.kind = 'shop'),
+    count(log.rating), coalesce(sum(log.rating), 0), now()
+FROM ramen_log_ramenlog AS log
+GROUP BY log.user_id
+ON CONFLICT (user_id) DO UPDATE SET
+    visit_count = EXCLUDED.visit_count,
+    shop_count = EXCLUDED.shop_count,
+    rating_count = EXCLUDED.rating_count,
+    rating_sum = EXCLUDED.rating_sum,
+    updated_at = EXCLUDED.updated_at;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0013_backfill_topping_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_RAMEN_STATS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,72 @@
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import migrations
+from django.db.models import Count
+
+# 店のカウンター (RamenStatsCounter, kind=shop) を、表記ゆれをまとめた正規化キーで数え直す。
+# 以前のカウンターは店名そのまま (前後の空白を除いたもの) で数えていたため、正規化キーのカウンターと
+# 二重に数えられ、削除時にも減算されなかった。ユーザーごとに店のカウンターを RamenLog から作り直し、
+# RamenStats.shop_count を合わせる。
+# 正規化は ramen_log.shops の normalize_shop_name (このマイグレーションを作った時点のもの) を写したもの。
+# アプリのコードが変わっても結果が変わらないよう、マイグレーションからは import しない
+BATCH_SIZE = 500
+_WHITESPACE = re.compile(r'\s+')
+_SHOP_SUFFIX = '店'
+
+
+def normalize_shop_name(name):
+    if not name:
+        return ''
+    key = unicodedata.normalize('NFKC', str(name)).casefold()
+    key = _WHITESPACE.sub('', key)
+    if key.endswith(_SHOP_SUFFIX) and len(key) > len(_SHOP_SUFFIX):
+        key = key[:-len(_SHOP_SUFFIX)]
+    return key
+
+
+def forwards(apps, schema_editor):
+    RamenLog = apps.get_model('ramen_log', 'RamenLog')
+    RamenStats = apps.get_model('ramen_log', 'RamenStats')
+    RamenStatsCounter = apps.get_model('ramen_log', 'RamenStatsCounter')
+    last_id = 0
+    while True:
+        # 0014 でログのあるユーザー全員に RamenStats の行があるため、その user_id で区切って処理する
+        stats = list(RamenStats.objects.filter(user_id__gt=last_id).order_by('user_id').only('user_id')[:BATCH_SIZE])
+        if not stats:
+            return
+        user_ids = [row.user_id for row in stats]
+        counters = Counter()
+        rows = (
+            RamenLog.objects.filter(user_id__in=user_ids)
+            .values_list('user_id', 'shop_name').annotate(n=Count('id')).order_by()
+        )
+        for user_id, shop_name, n in rows.iterator():
+            key = normalize_shop_name(shop_name)
+            if key:
+                counters[(user_id, key)] += n
+        RamenStatsCounter.objects.filter(user_id__in=user_ids, kind='shop').delete()
+        RamenStatsCounter.objects.bulk_create(
+            [
+                RamenStatsCounter(user_id=user_id, kind='shop', value=key, count=n)
+                for (user_id, key), n in counters.items()
+            ],
+            batch_size=1000,
+        )
+        shop_counts = Counter(user_id for user_id, _ in counters)
+        for row in stats:
+            row.shop_count = shop_counts[row.user_id]
+        RamenStats.objects.bulk_update(stats, ['shop_count'], batch_size=BATCH_SIZE)
+        last_id = user_ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ramen_log', '0014_backfill_ramen_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
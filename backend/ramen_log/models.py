@@ -1,15 +1,245 @@
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.db import connections, models, router, transaction
+from django.db.models import F
 from django.conf import settings
 
+from .toppings import parse_toppings
+
+class Shop(models.Model):
+    """
+    ラーメン店。表記ゆれのある RamenLog.shop_name を、正規化したキー (name_key) でまとめる。
+    正規化の内容は shops.normalize_shop_name() を参照。
+    """
+    name = models.CharField(max_length=100, help_text="表示用の店名 (最初に登録された表記)")
+    name_key = models.CharField(max_length=255, unique=True, help_text="名寄せ用に正規化した店名")
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # 名前の n-gram (shops.shop_ngrams() を参照)。オートコンプリートの候補を GIN インデックスで絞るため
+    name_grams = ArrayField(models.CharField(max_length=3), default=list, blank=True)
+    # 全ユーザーのログの件数 (オートコンプリートの並び順に使う。ログの作成・削除時に差分で更新する)
+    visit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['name_grams'], name='shop_name_grams_gin'),
+            # 候補の多い入力では、人気順に走査して先頭の数件だけを読む
+            models.Index(fields=['-visit_count', 'id'], name='shop_popularity_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
 class RamenLog(models.Model):
     shop_name = models.CharField(max_length=100)
+    # 正規化した店 (shop_name から自動で割り当てる)
+    shop = models.ForeignKey(Shop, on_delete=models.SET_NULL, null=True, blank=True, related_name='logs')
     # Userモデルへの関連付け (ForeignKey)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ramen_logs')
     ordered_item = models.CharField(max_length=100, blank=True, null=True)  # 空OK
     noodle_hardness = models.CharField(max_length=30, blank=True, null=True) # 空OK
     toppings = models.CharField(max_length=200, blank=True, null=True)       # 空OK
+    # toppings を分解・正規化したタグ (toppings.parse_toppings() で save() 時に自動で計算する)
+    topping_tags = ArrayField(models.CharField(max_length=50), default=list, blank=True, editable=False)
     rating = models.DecimalField(max_digits=3, decimal_places=1, blank=True, null=True)  # 空OK
     visited_at = models.DateTimeField(null=True, blank=True, default=None)
+    updated_at = models.DateTimeField(auto_now=True)
+    # 差分同期 (sync.py) 用の、ユーザーごとの変更番号 (save() 時に RamenLogSyncCounter から割り当てる)
+    sync_version = models.BigIntegerField(default=0, editable=False)
+    # オフラインで作成したログの冪等キー (クライアントが決める。同じキーの再送では作成しない)
+    client_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'client_key'], name='unique_ramenlog_client_key'),
+        ]
+        indexes = [
+            # 一覧のキーセットページネーション (visited_at DESC NULLS LAST, id DESC) 用
+            models.Index(
+                F('user'), F('visited_at').desc(nulls_last=True), F('id').desc(),
+                name='ramenlog_user_visited_idx',
+            ),
+            # 一覧の並び順 (?ordering=visited_at / -rating) 用
+            models.Index(
+                F('user'), F('visited_at').asc(nulls_last=True), F('id').asc(),
+                name='ramenlog_user_visited_asc_idx',
+            ),
+            # 評価の範囲 (?rating_min= / rating_max=) の絞り込みを兼ねる
+            models.Index(
+                F('user'), F('rating').desc(nulls_last=True), F('id').desc(),
+                name='ramenlog_user_rating_idx',
+            ),
+            # 店・麺の硬さでの絞り込み (既定の並び順のまま読める)
+            models.Index(
+                F('user'), F('shop'), F('visited_at').desc(nulls_last=True), F('id').desc(),
+                name='ramenlog_user_shop_idx',
+            ),
+            models.Index(
+                F('user'), F('noodle_hardness'), F('visited_at').desc(nulls_last=True), F('id').desc(),
+                name='ramenlog_user_hardness_idx',
+            ),
+            # タイムラインで fan-out-on-read のユーザーのログを新しい順に取得するため
+            models.Index(fields=['user', '-id'], name='ramenlog_user_id_idx'),
+            # トッピングでの絞り込み (topping_tags @> ARRAY[...]) 用
+            GinIndex(fields=['topping_tags'], name='ramenlog_topping_tags_gin'),
+            # 差分同期で、変更番号より後のログを読むため
+            models.Index(fields=['user', 'sync_version'], name='ramenlog_user_sync_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.topping_tags = parse_toppings(self.toppings)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = {'sync_version', 'updated_at'}
+            if 'toppings' in update_fields:
+                extra.add('topping_tags')
+            kwargs['update_fields'] = set(update_fields) | extra
+        # 変更番号の割り当てと書き込みを同じトランザクションにする (sync.py を参照)
+        with transaction.atomic(using=router.db_for_write(RamenLog, instance=self)):
+            self.sync_version = RamenLogSyncCounter.objects.reserve(self.user_id)
+            super().save(*args, **kwargs)
+
     def __str__(self):
         visited_date_str = self.visited_at.date() if self.visited_at else "訪問日未登録"
         return f"{self.shop_name} - {self.user.username} ({visited_date_str})"
+
+
+class RamenLogSyncCounterManager(models.Manager):
+    def reserve(self, user_id, count=1):
+        """
+        user_id の変更番号を count 個進め、割り当てた番号の最初の値を返す。
+        カウンターの行はトランザクションの終わりまでロックされるため、同じユーザーの書き込みは
+        番号の順にコミットされる (トランザクションの中で呼ぶこと)。
+        """
+        table = self.model._meta.db_table
+        with connections[router.db_for_write(self.model)].cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, version, pruned_version) VALUES (%s, %s, 0)
+                ON CONFLICT (user_id) DO UPDATE SET version = {table}.version + EXCLUDED.version
+                RETURNING version
+                """,
+                [user_id, count],
+            )
+            return cursor.fetchone()[0] - count + 1
+
+
+class RamenLogSyncCounter(models.Model):
+    """ユーザーごとのラーメンログの変更番号 (差分同期のトークンはこの番号を持つ)"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    # 最後に割り当てた変更番号
+    version = models.BigIntegerField(default=0)
+    # 削除済みの墓標 (RamenLogTombstone) をこの番号まで消した。これより前のトークンでは差分を返せない
+    pruned_version = models.BigIntegerField(default=0)
+
+    objects = RamenLogSyncCounterManager()
+
+
+class RamenLogTombstone(models.Model):
+    """削除されたラーメンログの記録 (差分同期で削除をクライアントに伝えるため。古いものは prune_sync_tombstones で消す)"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    log_id = models.BigIntegerField()
+    client_key = models.CharField(max_length=64, null=True, blank=True)
+    sync_version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'sync_version'], name='ramenlog_tombstone_sync_idx'),
+            models.Index(fields=['deleted_at'], name='ramenlog_tombstone_deleted_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    フォロー中ユーザーのラーメンログのタイムライン。
+    ログ作成時に、承認済みフォロワーごとに1行ずつ書き込んでおく (fan-out-on-write)。
+    """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timeline_entries')
+    # ログが削除されるとタイムラインからも消える
+    log = models.ForeignKey(RamenLog, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            # (owner, log) のインデックスを兼ね、タイムラインの読み込みはこの範囲スキャンになる
+            models.UniqueConstraint(fields=['owner', 'log'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            # アンフォロー時に、そのユーザーのログをまとめて取り除くため
+            models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx'),
+        ]
+
+
+class TimelinePullAuthor(models.Model):
+    """
+    フォロワーが多すぎるため書き込み時の展開を行わないユーザー。
+    このユーザーのログは、タイムラインの読み込み時に RamenLog から直接取得する (fan-out-on-read)。
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class RamenStats(models.Model):
+    """
+    ユーザーごとのラーメン統計 (集計済みの値)。
+    ログの作成・削除時に差分だけ更新するため、参照時に RamenLog を集計する必要がない。
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='ramen_stats')
+    visit_count = models.PositiveIntegerField(default=0)
+    # 訪問した店の数 (RamenStatsCounter の shop の行数)
+    shop_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+
+class RamenCalendarMonth(models.Model):
+    """
+    ユーザーごと・月ごとの訪問カレンダーの集計 (visit_calendar.py)。
+    終わった月の分だけ保存し、その月の訪問日時のログが作成・削除されたら行を削除して計算し直させる。
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # 月の初日 (TIME_ZONE での日付)
+    month = models.DateField()
+    visit_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    # 日ごとの訪問回数 ({"日": 回数}。訪問のない日は含めない)
+    days = models.JSONField(default=dict)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='unique_ramen_calendar_month'),
+        ]
+
+
+class RamenStatsCounter(models.Model):
+    """ユーザーごと・項目ごとの出現回数 (店名、注文したメニュー、麺の硬さ、トッピング)"""
+    class Kind(models.TextChoices):
+        SHOP = 'shop', '店'
+        ORDERED_ITEM = 'item', '注文'
+        NOODLE_HARDNESS = 'hardness', '麺の硬さ'
+        TOPPING = 'topping', 'トッピング'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    value = models.CharField(max_length=200)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kind', 'value'], name='unique_ramen_stats_counter'),
+        ]
+        indexes = [
+            # 「一番多い注文」などを LIMIT 1 のインデックススキャンで取得するため
+            models.Index(fields=['user', 'kind', '-count', 'value'], name='ramen_stats_counter_top_idx'),
+        ]
@@ -0,0 +1,193 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import timeline
+from .models import RamenLog
+
+
+class KeysetPagination(BasePagination):
+    """
+    不透明なカーソルによるキーセットページネーション。
+
+    (ordering_field NULLS LAST, id) の順に並べ、カーソルには直前のページの最後の行の
+    (ordering_field, id) を持たせる。OFFSET を使わず「その行より後ろ」を範囲条件で
+    取得するため、どれだけ深くスクロールしてもページ取得のコストは一定になる。
+    NULL の行は並びの最後にまとめて返す。
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_field = 'visited_at'
+    descending = True
+    invalid_cursor_message = '無効なカーソルです。'
+
+    def get_ordering(self, request, view):
+        """(並び替えに使うフィールド名, 降順かどうか) を返す"""
+        return self.ordering_field, self.descending
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        head, tail = self.page_queries(queryset, request, view)
+        rows = list(head)
+        if tail is not None and len(rows) < self.fetch_size:
+            # 非NULLの行を使い切ったら、続けてNULLの行を返す
+            rows += list(tail[:self.fetch_size - len(rows)])
+        return self.take_page(rows)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() の非同期版 (非同期 ORM で読み込む)"""
+        head, tail = self.page_queries(queryset, request, view)
+        rows = [row async for row in head]
+        if tail is not None and len(rows) < self.fetch_size:
+            rows += [row async for row in tail[:self.fetch_size - len(rows)]]
+        return self.take_page(rows)
+
+    def page_queries(self, queryset, request, view):
+        """
+        (最初に読むクエリ, その件数が足りなければ続けて読むクエリまたは None) を返す。
+        どちらも評価はしない (同期・非同期のどちらでも読めるようにするため)。
+        """
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.fetch_size = self.page_size_value + 1
+        field, descending = self.get_ordering(request, view)
+        self.field = field
+        position = self.decode_cursor(request, queryset.model, field)
+        order = self.order_by(field, descending)
+
+        if position is None:
+            return queryset.order_by(*order)[:self.fetch_size], None
+        value, pk = position
+        if value is None:
+            return self.null_rows(queryset, field, descending, pk).order_by(*order)[:self.fetch_size], None
+        return (
+            self.rows_after(queryset, field, descending, value, pk).order_by(*order)[:self.fetch_size],
+            self.null_rows(queryset, field, descending).order_by(*order),
+        )
+
+    def take_page(self, rows):
+        """page_size + 1 件まで読んだ行から、ページと次のページの位置を決める"""
+        self.has_next = len(rows) > self.page_size_value
+        page = rows[:self.page_size_value]
+        self.next_position = self.position_of(page[-1], self.field) if self.has_next else None
+        return page
+
+    def order_by(self, field, descending):
+        if descending:
+            return [F(field).desc(nulls_last=True), F('id').desc()]
+        return [F(field).asc(nulls_last=True), F('id').asc()]
+
+    def rows_after(self, queryset, field, descending, value, pk):
+        # (field, id) の行比較を、インデックスの範囲条件 (field <= value) と
+        # 同値の行の絞り込みに分けて表現する
+        if descending:
+            return queryset.filter(
+                Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}),
+                **{f'{field}__lte': value},
+            )
+        return queryset.filter(
+            Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}),
+            **{f'{field}__gte': value},
+        )
+
+    def null_rows(self, queryset, field, descending, pk=None):
+        queryset = queryset.filter(**{f'{field}__isnull': True})
+        if pk is not None:
+            queryset = queryset.filter(**{'id__lt' if descending else 'id__gt': pk})
+        return queryset
+
+    def position_of(self, row, field):
+        # values() の辞書とモデルインスタンスの両方に対応する
+        if isinstance(row, dict):
+            return row[field], row['id']
+        return getattr(row, field), row.id
+
+    def encode_cursor(self, position):
+        value, pk = position
+        if value is not None:
+            value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        raw = json.dumps([value, pk], separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, model, field):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            value, pk = json.loads(raw.decode('utf-8'))
+            if value is not None:
+                value = model._meta.get_field(field).to_python(value)
+            return value, int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class RamenLogCursorPagination(KeysetPagination):
+    """
+    ラーメンログ一覧用: 既定は訪問日時の新しい順 (訪問日未登録は最後)。
+    ?ordering= で並び順を選べる (どれも user から始まる同じ並びのインデックスがある)。
+    """
+    ordering_field = 'visited_at'
+    descending = True
+    ordering_query_param = 'ordering'
+    orderings = {
+        '-visited_at': ('visited_at', True),
+        'visited_at': ('visited_at', False),
+        '-rating': ('rating', True),
+    }
+
+    def get_ordering(self, request, view):
+        # 不正な値はビュー (RamenLogListQuerySerializer) で 400 にしている
+        return self.orderings.get(request.query_params.get(self.ordering_query_param), (self.ordering_field, self.descending))
+
+
+class TimelineCursorPagination(KeysetPagination):
+    """タイムライン用: ログの新しい順 (id の降順)"""
+    ordering_field = 'id'
+    descending = True
+
+    def paginate_timeline(self, request, owner):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.field = self.ordering_field
+        position = self.decode_cursor(request, RamenLog, self.ordering_field)
+        before_id = position[1] if position else None
+        return self.take_page(timeline.read_timeline(owner, before_id, self.page_size_value + 1))
@@ -1,10 +1,120 @@
 from rest_framework import serializers
-from .models import RamenLog
+from ramen_project.metrics import timed_serialization
+from .models import RamenLog, Shop
 
 class RamenLogSerializer(serializers.ModelSerializer):
     # userフィールドは読み取り専用とし、ユーザー名を表示する
     user = serializers.StringRelatedField(read_only=True)
+    # 店は shop_name から自動で割り当てるため読み取り専用
+    shop = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = RamenLog
-        fields = '__all__'
+        # topping_tags は toppings から計算する検索用の値、同期用の値は差分同期 (sync.py) でのみ返す
+        exclude = ['topping_tags', 'updated_at', 'sync_version', 'client_key']
+
+
+class ShopSerializer(serializers.ModelSerializer):
+    """店の情報と、全ユーザーのログの集計を表示するためのシリアライザ"""
+    visit_count = serializers.IntegerField(read_only=True)
+    average_rating = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Shop
+        fields = ['id', 'name', 'latitude', 'longitude', 'visit_count', 'average_rating']
+
+
+class ShopAutocompleteQuerySerializer(serializers.Serializer):
+    """店名のオートコンプリート用のクエリパラメータ用シリアライザ"""
+    q = serializers.CharField(max_length=100, trim_whitespace=False, help_text="入力中の店名 (一部でもよい)")
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10, help_text="候補の最大件数")
+
+
+class RamenLogListQuerySerializer(serializers.Serializer):
+    """ラーメンログ一覧の絞り込みと並び順のクエリパラメータ用シリアライザ (範囲の指定は下限・上限とも省略できる)"""
+    rating_min = serializers.DecimalField(max_digits=3, decimal_places=1, required=False, help_text="評価の下限 (以上)")
+    rating_max = serializers.DecimalField(max_digits=3, decimal_places=1, required=False, help_text="評価の上限 (以下)")
+    visited_after = serializers.DateTimeField(
+        input_formats=['iso-8601', '%Y-%m-%d'], required=False, help_text="訪問日時の下限 (以降。日付のみも可)"
+    )
+    visited_before = serializers.DateTimeField(
+        input_formats=['iso-8601', '%Y-%m-%d'], required=False, help_text="訪問日時の上限 (より前。日付のみも可)"
+    )
+    shop = serializers.IntegerField(min_value=1, required=False, help_text="店の id")
+    shop_name = serializers.CharField(max_length=100, required=False, help_text="店名 (表記ゆれは同じ店として扱う)")
+    noodle_hardness = serializers.CharField(max_length=30, required=False, help_text="麺の硬さ (完全一致)")
+    topping = serializers.ListField(
+        child=serializers.CharField(max_length=200), required=False, help_text="トッピング (複数指定するとすべてを含むログ)"
+    )
+    ordering = serializers.ChoiceField(
+        choices=['-visited_at', 'visited_at', '-rating'], default='-visited_at',
+        help_text="並び順 (訪問日時の新しい順・古い順、評価の高い順。値のないログは最後)",
+    )
+
+
+class RamenCalendarQuerySerializer(serializers.Serializer):
+    """訪問カレンダーのクエリパラメータ用シリアライザ"""
+    year = serializers.IntegerField(min_value=1970, max_value=2999, required=False, help_text="年 (省略時は今年)")
+
+
+class RamenLogSyncQuerySerializer(serializers.Serializer):
+    """差分同期のクエリパラメータ用シリアライザ"""
+    token = serializers.CharField(required=False, allow_blank=True, help_text="前回の同期で返されたトークン (省略時は全件)")
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=500, help_text="1回で返す変更の最大件数")
+
+
+class RamenLogSyncSerializer(RamenLogSyncQuerySerializer):
+    """差分同期でオフラインで作成したログを送るときのリクエスト用シリアライザ"""
+    logs = serializers.ListField(
+        child=serializers.DictField(), max_length=100, default=list,
+        help_text="オフラインで作成したログ (client_key と、インポートと同じ項目)",
+    )
+
+
+class RamenLogImportSerializer(serializers.Serializer):
+    """ラーメンログの一括インポート用のシリアライザ (アップロードファイルと読み込み設定を受け取る)"""
+    file = serializers.FileField(help_text="CSV (ヘッダー付き) または NDJSON のファイル")
+    file_format = serializers.ChoiceField(choices=['csv', 'ndjson'], required=False, help_text="ファイル形式 (省略時はファイル名から判定)")
+    batch_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000, help_text="1回の書き込み件数")
+    encoding = serializers.ChoiceField(choices=['utf-8', 'shift_jis'], default='utf-8', help_text="ファイルの文字コード")
+
+
+class RamenLogExportQuerySerializer(serializers.Serializer):
+    """ラーメンログのエクスポート用のクエリパラメータ用シリアライザ"""
+    file_format = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv', help_text="ファイル形式")
+    gzip = serializers.BooleanField(default=False, help_text="gzip で圧縮するかどうか")
+
+
+# --- 一覧用の軽量な読み取り専用パス ---
+# ModelSerializer はインスタンスごとにフィールドをたどるため、件数の多い一覧では
+# values() の行から直接 RamenLogSerializer と同じ形の辞書を組み立てる。
+
+# 一覧で values() に渡すフィールド (user は StringRelatedField と同じくユーザー名を返す)
+RAMEN_LOG_LIST_VALUES = (
+    'id', 'user__username', 'shop', 'shop_name', 'ordered_item',
+    'noodle_hardness', 'toppings', 'rating', 'visited_at',
+)
+
+_rating_field = serializers.DecimalField(max_digits=3, decimal_places=1)
+_datetime_field = serializers.DateTimeField()
+
+
+@timed_serialization
+def serialize_ramen_log_rows(rows):
+    """RAMEN_LOG_LIST_VALUES の行を RamenLogSerializer と同じ出力に変換する"""
+    rating = _rating_field.to_representation
+    visited_at = _datetime_field.to_representation
+    return [
+        {
+            'id': row['id'],
+            'user': row['user__username'],
+            'shop': row['shop'],
+            'shop_name': row['shop_name'],
+            'ordered_item': row['ordered_item'],
+            'noodle_hardness': row['noodle_hardness'],
+            'toppings': row['toppings'],
+            'rating': None if row['rating'] is None else rating(row['rating']),
+            'visited_at': None if row['visited_at'] is None else visited_at(row['visited_at']),
+        }
+        for row in rows
+    ]
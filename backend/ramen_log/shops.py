@@ -0,0 +1,217 @@
+# ramen_log/shops.py
+"""
+自由入力の店名 (RamenLog.shop_name) を Shop にまとめるための正規化と名寄せ。
+
+「一蘭 渋谷店」「一蘭渋谷」「ｲﾁﾗﾝ渋谷」のような表記ゆれを同じ店として扱うため、
+次の順で正規化したキー (Shop.name_key) で店を識別する。
+  1. NFKC 正規化 (全角英数・半角カナなどを統一)
+  2. 大文字小文字の統一
+  3. 空白の除去 (全角スペースを含む)
+  4. 末尾の「店」を除去 (「渋谷店」と「渋谷」を同じにする)
+
+オートコンプリートでは、前方一致する店 → 部分一致する店の順に、それぞれ訪問回数 (Shop.visit_count) の多い順で返す。
+部分一致は、正規化した店名の n-gram (Shop.name_grams) を含む店を GIN インデックスで絞ってから判定する。
+かな・漢字は単語の区切りがないため、形態素ではなく文字単位の n-gram で検索する。
+"""
+import re
+import unicodedata
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+_WHITESPACE = re.compile(r'\s+')
+_SHOP_SUFFIX = '店'
+# オートコンプリートで、まず人気順に調べる店の数
+POPULAR_SCAN = 2000
+# その境目の訪問回数はゆっくりとしか変わらないため、しばらくキャッシュする
+# (古い値でも結果は変わらず、どちらのインデックスを使うかが変わるだけ)
+POPULAR_THRESHOLD_CACHE_KEY = 'ramen_log:shop_popular_threshold'
+POPULAR_THRESHOLD_TIMEOUT = 60
+# 部分一致の候補を GIN で絞るときに使う n-gram の数
+QUERY_NGRAMS = 3
+
+
+def normalize_shop_name(name):
+    """店名を名寄せ用のキーに正規化する (空になる場合は空文字を返す)"""
+    if not name:
+        return ''
+    key = unicodedata.normalize('NFKC', str(name)).casefold()
+    key = _WHITESPACE.sub('', key)
+    if key.endswith(_SHOP_SUFFIX) and len(key) > len(_SHOP_SUFFIX):
+        key = key[:-len(_SHOP_SUFFIX)]
+    return key
+
+
+def shop_ngrams(key):
+    """正規化した店名から Shop.name_grams に保存する n-gram (1文字・2文字の部分文字列) の一覧を返す"""
+    grams = set(key)
+    grams.update(key[i:i + 2] for i in range(len(key) - 1))
+    return sorted(grams)
+
+
+def _query_ngrams(key):
+    """
+    検索語を含む店が必ず持つ n-gram。GIN は条件の n-gram ごとに一覧を読むため、
+    末尾から重ならない2文字の n-gram を QUERY_NGRAMS 個だけ使う
+    (この条件を使うのは一致する店が少ない入力で、入力の末尾ほど店を絞り込める)。
+    """
+    if len(key) < 2:
+        return [key]
+    return sorted({key[i - 2:i] for i in range(len(key), 1, -2)[:QUERY_NGRAMS]})
+
+
+def resolve_shop_ids(names, shop_model=None):
+    """
+    店名の一覧から {店名: Shop の id} を返す。未登録の店はまとめて作成する。
+    shop_model を省略すると Shop を使う。
+    """
+    if shop_model is None:
+        from .models import Shop as shop_model
+    keys = {}
+    for name in names:
+        key = normalize_shop_name(name)
+        if key:
+            keys.setdefault(key, str(name).strip())
+    if not keys:
+        return {}
+    found = dict(shop_model.objects.filter(name_key__in=keys).values_list('name_key', 'id'))
+    missing = [
+        shop_model(name=display[:100], name_key=key, name_grams=shop_ngrams(key))
+        for key, display in keys.items() if key not in found
+    ]
+    if missing:
+        # 同時に作成された店があっても失敗しないよう、衝突は無視してから取り直す
+        shop_model.objects.bulk_create(missing, ignore_conflicts=True)
+        found.update(
+            shop_model.objects.filter(name_key__in=[s.name_key for s in missing]).values_list('name_key', 'id')
+        )
+    return {name: found[normalize_shop_name(name)] for name in names if normalize_shop_name(name) in found}
+
+
+def resolve_shop_id(name):
+    """店名1件に対応する Shop の id を返す (空の店名なら None)"""
+    return resolve_shop_ids([name]).get(name)
+
+
+def backfill_shops(log_model, shop_model, batch_size=2000, last_id=0):
+    """
+    shop が未設定のログに Shop を割り当てる。id 順に batch_size 件ずつ処理し、
+    処理したログの件数を返す (backfill_shops コマンドから使う。マイグレーションは当時の処理を写して持つ)。
+    店を割り当てたログには新しい変更番号を割り当て、差分同期のクライアントに変更を届ける。
+    """
+    from .sync import assign_versions
+
+    done = 0
+    while True:
+        logs = list(
+            log_model.objects.filter(id__gt=last_id, shop__isnull=True)
+            .order_by('id').only('id', 'user_id', 'shop_name')[:batch_size]
+        )
+        if not logs:
+            return done
+        shop_ids = resolve_shop_ids({log.shop_name for log in logs}, shop_model=shop_model)
+        changed = []
+        for log in logs:
+            log.shop_id = shop_ids.get(log.shop_name)
+            if log.shop_id is not None:
+                changed.append(log)
+        now = timezone.now()
+        with transaction.atomic():
+            assign_versions(changed)
+            for log in changed:
+                log.updated_at = now
+            log_model.objects.bulk_update(changed, ['shop', 'sync_version', 'updated_at'], batch_size=batch_size)
+            record_visits([log.shop_id for log in changed])
+        done += len(logs)
+        last_id = logs[-1].id
+
+
+def record_visits(shop_ids, sign=1):
+    """ログの店 (shop_id の一覧) ごとに Shop.visit_count を sign 件ずつ増減する"""
+    from .models import Shop
+
+    # 同じ件数の店はまとめて1回の UPDATE にする
+    by_count = {}
+    for shop_id, n in Counter(shop_id for shop_id in shop_ids if shop_id is not None).items():
+        by_count.setdefault(n, []).append(shop_id)
+    for n, ids in by_count.items():
+        shops = Shop.objects.filter(id__in=ids)
+        if sign < 0:
+            shops = shops.filter(visit_count__gte=n)
+        shops.update(visit_count=F('visit_count') + sign * n)
+
+
+def _popular_threshold():
+    """人気上位 POPULAR_SCAN 店に入るための訪問回数 (店が少ないうちは None)"""
+    from .models import Shop
+
+    return (
+        Shop.objects.order_by('-visit_count', 'id')
+        .values_list('visit_count', flat=True)[POPULAR_SCAN - 1:POPULAR_SCAN].first()
+    )
+
+
+def _top_matches(match, limit, threshold, narrow=Q()):
+    """
+    条件 match に一致する店を、訪問回数の多い順に最大 limit 件返す。
+    まず訪問回数が threshold 以上の人気店だけを人気順のインデックスで調べ、足りない場合
+    (一致する店の少ない入力) に限って、narrow (n-gram の GIN で絞る条件) を加えて全店から探す。
+    GIN の条件は件数の見積もりが極端に小さくなるため、1つのクエリにまとめると
+    プランナーが常に全件を集めてから並べ替える実行計画を選んでしまう。
+    """
+    from .models import Shop
+
+    fields = ('id', 'name', 'visit_count')
+    order = ('-visit_count', 'id')
+    if threshold is not None:
+        found = list(Shop.objects.filter(match, visit_count__gte=threshold).order_by(*order).values(*fields)[:limit])
+        if len(found) == limit:
+            return found
+    return list(Shop.objects.filter(match, narrow).order_by(*order).values(*fields)[:limit])
+
+
+def autocomplete(query, limit=10):
+    """
+    query を含む店を最大 limit 件返す。前方一致する店を先に、それぞれ訪問回数の多い順に並べる。
+    各行は {'id', 'name', 'visit_count'} の辞書。
+    """
+    from .models import Shop
+
+    key = normalize_shop_name(query)
+    if not key:
+        return []
+    threshold = cache.get_or_set(POPULAR_THRESHOLD_CACHE_KEY, _popular_threshold, POPULAR_THRESHOLD_TIMEOUT)
+    # 前方一致は name_key の一意インデックス (varchar_pattern_ops) の範囲スキャンで探せる
+    prefix = Q(name_key__startswith=key)
+    found = _top_matches(prefix, limit, threshold)
+    if len(found) < limit:
+        found += _top_matches(
+            Q(name_key__contains=key) & ~prefix, limit - len(found), threshold,
+            narrow=Q(name_grams__contains=_query_ngrams(key)),
+        )
+    return found
+
+
+def rebuild_search_index(log_model, shop_model, batch_size=2000):
+    """
+    全店の name_grams と visit_count を作り直し、処理した店の数を返す (rebuild_shop_index コマンドから使う)。
+    """
+    done = 0
+    last_id = 0
+    while True:
+        shops = list(shop_model.objects.filter(id__gt=last_id).order_by('id').only('id', 'name_key')[:batch_size])
+        if not shops:
+            return done
+        ids = [shop.id for shop in shops]
+        counts = dict(
+            log_model.objects.filter(shop_id__in=ids).values_list('shop_id').annotate(n=Count('id')).order_by()
+        )
+        for shop in shops:
+            shop.name_grams = shop_ngrams(shop.name_key)
+            shop.visit_count = counts.get(shop.id, 0)
+        shop_model.objects.bulk_update(shops, ['name_grams', 'visit_count'], batch_size=batch_size)
+        done += len(shops)
+        last_id = ids[-1]
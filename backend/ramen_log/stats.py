@@ -0,0 +1,214 @@
+# ramen_log/stats.py
+"""
+ユーザーごとのラーメン統計 (RamenStats / RamenStatsCounter) の差分更新。
+
+ログの作成・削除のたびに、そのログの分だけ F() 式で加算・減算する。
+全件からの再集計は rebuild_user() で行い、rebuild_ramen_stats コマンドから使う。
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+
+from .models import RamenLog, RamenStats, RamenStatsCounter
+from .shops import normalize_shop_name
+from .toppings import parse_toppings
+
+Kind = RamenStatsCounter.Kind
+
+# カウンターの種類と、対応する RamenLog のフィールド
+COUNTED_FIELDS = (
+    (Kind.SHOP, 'shop_name'),
+    (Kind.ORDERED_ITEM, 'ordered_item'),
+    (Kind.NOODLE_HARDNESS, 'noodle_hardness'),
+)
+# 統計APIで返すトッピングの数 (回数の多い順)
+TOP_TOPPINGS = 10
+
+
+def counter_value(kind, value):
+    """カウンターに記録する値 (空の値は数えない)。店は表記ゆれをまとめた正規化キーで数える"""
+    if value is None:
+        return None
+    if kind == Kind.SHOP:
+        return normalize_shop_name(value) or None
+    value = str(value).strip()
+    return value or None
+
+
+def _deltas(logs):
+    """ログの一覧から、統計に加える差分を計算する"""
+    visits = 0
+    rating_count = 0
+    rating_sum = Decimal(0)
+    counters = Counter()
+    for log in logs:
+        visits += 1
+        if log.rating is not None:
+            rating_count += 1
+            rating_sum += Decimal(log.rating)
+        for kind, field in COUNTED_FIELDS:
+            value = counter_value(kind, getattr(log, field))
+            if value is not None:
+                counters[(kind, value)] += 1
+        # トッピングは1つのログに複数あるため、タグごとに数える
+        for tag in parse_toppings(log.toppings):
+            counters[(Kind.TOPPING, tag)] += 1
+    return visits, rating_count, rating_sum, counters
+
+
+def _increment_counter(user_id, kind, value, delta):
+    """カウンターを delta だけ増やす。新しく行を作った場合は True を返す"""
+    counters = RamenStatsCounter.objects.filter(user_id=user_id, kind=kind, value=value)
+    if counters.update(count=F('count') + delta):
+        return False
+    try:
+        with transaction.atomic():
+            RamenStatsCounter.objects.create(user_id=user_id, kind=kind, value=value, count=delta)
+        return True
+    except IntegrityError:
+        # 同時に作成された場合は、作成された行に加算する
+        counters.update(count=F('count') + delta)
+        return False
+
+
+def _lock_stats(user_id, create=True):
+    """
+    ユーザーの RamenStats の行をロックする (トランザクションの中で呼ぶこと)。
+    差分の更新と rebuild_user() はこのロックで1つずつ行う。
+    """
+    if create:
+        RamenStats.objects.get_or_create(user_id=user_id)
+    list(RamenStats.objects.select_for_update().filter(user_id=user_id).values_list('pk'))
+
+
+def _apply(user_id, logs, sign):
+    visits, rating_count, rating_sum, counters = _deltas(logs)
+    if not visits:
+        return
+    with transaction.atomic():
+        shop_delta = 0
+        # 行がない場合に作るのは加算のときだけ (減算で作っても 0 のまま)
+        _lock_stats(user_id, create=sign > 0)
+        if sign > 0:
+            for (kind, value), delta in counters.items():
+                if _increment_counter(user_id, kind, value, delta) and kind == Kind.SHOP:
+                    shop_delta += 1
+        else:
+            for (kind, value), delta in counters.items():
+                RamenStatsCounter.objects.filter(
+                    user_id=user_id, kind=kind, value=value, count__gte=delta
+                ).update(count=F('count') - delta)
+            for kind in {kind for kind, _ in counters}:
+                values = [value for (k, value) in counters if k == kind]
+                deleted, _ = RamenStatsCounter.objects.filter(
+                    user_id=user_id, kind=kind, value__in=values, count=0
+                ).delete()
+                if kind == Kind.SHOP:
+                    shop_delta -= deleted
+        # 統計の行がない、または集計より前のログを削除した場合でも負の値にはしない
+        # (PositiveIntegerField の CHECK 制約で削除ごと失敗するため。正しい値は rebuild_user() で作り直せる)
+        RamenStats.objects.filter(user_id=user_id).update(
+            visit_count=Greatest(F('visit_count') + sign * visits, 0),
+            shop_count=Greatest(F('shop_count') + shop_delta, 0),
+            rating_count=Greatest(F('rating_count') + sign * rating_count, 0),
+            rating_sum=Greatest(F('rating_sum') + sign * rating_sum, Decimal(0)),
+        )
+
+
+def record_created(user_id, logs):
+    """作成されたログ (同じユーザーのもの) の分だけ統計を加算する"""
+    _apply(user_id, logs, 1)
+
+
+def record_deleted(user_id, logs):
+    """削除されたログ (同じユーザーのもの) の分だけ統計を減算する"""
+    _apply(user_id, logs, -1)
+
+
+def summary(user):
+    """統計APIのレスポンス用の辞書を返す (RamenLog は参照しない)"""
+    stats = RamenStats.objects.filter(user=user).first() or RamenStats(user=user)
+    tops = {}
+    for kind in (Kind.ORDERED_ITEM, Kind.NOODLE_HARDNESS):
+        tops[kind] = (
+            RamenStatsCounter.objects.filter(user=user, kind=kind)
+            .order_by('-count', 'value')
+            .values_list('value', flat=True)
+            .first()
+        )
+    # (user, kind, -count, value) のインデックスを先頭から読むだけで、ログの件数に関係なく返せる
+    toppings = (
+        RamenStatsCounter.objects.filter(user=user, kind=Kind.TOPPING)
+        .order_by('-count', 'value')
+        .values_list('value', 'count')[:TOP_TOPPINGS]
+    )
+    average = stats.average_rating
+    return {
+        'visit_count': stats.visit_count,
+        'shop_count': stats.shop_count,
+        'rating_count': stats.rating_count,
+        'average_rating': None if average is None else round(float(average), 2),
+        'top_ordered_item': tops[Kind.ORDERED_ITEM],
+        'favorite_noodle_hardness': tops[Kind.NOODLE_HARDNESS],
+        'topping_counts': [{'topping': value, 'count': count} for value, count in toppings],
+    }
+
+
+def compute_user(user_id, chunk_size=5000):
+    """RamenLog から統計を全件集計し直した (RamenStats, カウンターの辞書) を返す"""
+    logs = RamenLog.objects.filter(user_id=user_id)
+    totals = logs.aggregate(visits=Count('id'), rating_count=Count('rating'), rating_sum=Sum('rating'))
+    counters = {}
+    for kind, field in COUNTED_FIELDS:
+        rows = logs.exclude(**{f'{field}__isnull': True}).values_list(field).annotate(n=Count('id')).order_by()
+        for value, n in rows.iterator(chunk_size=chunk_size):
+            value = counter_value(kind, value)
+            if value is not None:
+                counters[(kind, value)] = counters.get((kind, value), 0) + n
+    rows = logs.exclude(toppings__isnull=True).values_list('toppings').annotate(n=Count('id')).order_by()
+    for value, n in rows.iterator(chunk_size=chunk_size):
+        for tag in parse_toppings(value):
+            counters[(Kind.TOPPING, tag)] = counters.get((Kind.TOPPING, tag), 0) + n
+    stats = RamenStats(
+        user_id=user_id,
+        visit_count=totals['visits'],
+        shop_count=sum(1 for kind, _ in counters if kind == Kind.SHOP),
+        rating_count=totals['rating_count'],
+        rating_sum=totals['rating_sum'] or 0,
+    )
+    return stats, counters
+
+
+def stored_user(user_id):
+    """保存されている統計を compute_user() と同じ形で返す"""
+    stats = RamenStats.objects.filter(user_id=user_id).first() or RamenStats(user_id=user_id)
+    counters = {
+        (kind, value): count
+        for kind, value, count in RamenStatsCounter.objects.filter(user_id=user_id).values_list('kind', 'value', 'count')
+    }
+    return stats, counters
+
+
+def same_stats(a, b):
+    fields = ('visit_count', 'shop_count', 'rating_count')
+    return all(getattr(a, f) == getattr(b, f) for f in fields) and Decimal(a.rating_sum) == Decimal(b.rating_sum)
+
+
+def rebuild_user(user_id):
+    """
+    ユーザーの統計を RamenLog から作り直す。
+    集計の前に RamenStats の行をロックするため、その間のログの作成・削除の差分の更新は集計の後に行われる
+    (集計から漏れたり、二重に数えられたりしない)。
+    """
+    with transaction.atomic():
+        _lock_stats(user_id)
+        stats, counters = compute_user(user_id)
+        RamenStatsCounter.objects.filter(user_id=user_id).delete()
+        RamenStatsCounter.objects.bulk_create(
+            [RamenStatsCounter(user_id=user_id, kind=kind, value=value, count=n) for (kind, value), n in counters.items()],
+            batch_size=1000,
+        )
+        stats.save()
@@ -0,0 +1,184 @@
+# ramen_log/sync.py
+"""
+モバイルアプリ (オフライン対応) 向けのラーメンログの差分同期。
+
+ログの作成・更新・削除のたびに、ユーザーごとの変更番号 (RamenLogSyncCounter) を進めて
+RamenLog.sync_version (削除は RamenLogTombstone.sync_version) に記録する。番号の割り当てはカウンターの行を
+ロックして書き込みと同じトランザクションで行うため、同じユーザーの変更は番号の順にコミットされる。
+同期のトークンは「どの番号まで返したか」を署名したもので、次の同期ではそれより後の変更だけを返す。
+
+- 読み込みはカウンターの番号を先に読み、その番号以下の変更だけを返す (コミット前の変更を飛ばさない)
+- 墓標は prune_tombstones() で古いものから消す。消した番号より前のトークンには reset を返し、全件を送り直す
+- オフラインで作成したログは client_key (冪等キー) 付きで送り、同じキーの再送では作成しない
+"""
+from django.core import signing
+from django.db import transaction
+from django.db.models import Max
+from rest_framework import serializers
+
+from . import importers, timeline
+from .models import RamenLog, RamenLogSyncCounter, RamenLogTombstone
+from .serializers import RAMEN_LOG_LIST_VALUES, serialize_ramen_log_rows
+
+TOKEN_SALT = 'ramen_log.sync'
+CLIENT_KEY_MAX_LENGTH = RamenLog._meta.get_field('client_key').max_length
+SYNC_VALUES = RAMEN_LOG_LIST_VALUES + ('client_key', 'updated_at', 'sync_version')
+
+_datetime_field = serializers.DateTimeField()
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def issue_token(user_id, version):
+    return signing.dumps([user_id, version], salt=TOKEN_SALT, compress=True)
+
+
+def read_token(user_id, token):
+    """トークンの変更番号を返す (トークンがなければ None)。別のユーザーのトークンや改ざんされたものは InvalidToken"""
+    if not token:
+        return None
+    try:
+        token_user_id, version = signing.loads(token, salt=TOKEN_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidToken('無効な同期トークンです。')
+    if token_user_id != user_id:
+        raise InvalidToken('無効な同期トークンです。')
+    return int(version)
+
+
+def assign_versions(logs):
+    """bulk_create する前のログに変更番号を割り当てる (トランザクションの中で呼ぶこと)"""
+    by_user = {}
+    for log in logs:
+        by_user.setdefault(log.user_id, []).append(log)
+    # 複数のユーザーのカウンターは id の順にロックする (デッドロックを避けるため)
+    for user_id in sorted(by_user):
+        first_version = RamenLogSyncCounter.objects.reserve(user_id, len(by_user[user_id]))
+        for offset, log in enumerate(by_user[user_id]):
+            log.sync_version = first_version + offset
+
+
+def record_deleted(log):
+    """削除するログの墓標を書き込む (ログの削除と同じトランザクションの中で呼ぶこと)"""
+    RamenLogTombstone.objects.create(
+        user_id=log.user_id, log_id=log.id, client_key=log.client_key,
+        sync_version=RamenLogSyncCounter.objects.reserve(log.user_id),
+    )
+
+
+def changes(user_id, since, limit):
+    """
+    変更番号 since より後の変更を最大 limit 件、番号の順に返す。since が None なら全件 (墓標なし)。
+    返した変更より後にも変更があれば has_more が True になり、続きは token で取得する。
+    """
+    current, pruned = (
+        RamenLogSyncCounter.objects.filter(user_id=user_id).values_list('version', 'pruned_version').first() or (0, 0)
+    )
+    reset = since is not None and since < pruned
+    if reset or since is None:
+        since, with_tombstones = 0, False
+    else:
+        with_tombstones = True
+
+    rows = list(
+        RamenLog.objects.filter(user_id=user_id, sync_version__gt=since, sync_version__lte=current)
+        .order_by('sync_version').values(*SYNC_VALUES)[:limit + 1]
+    )
+    tombstones = []
+    if with_tombstones:
+        tombstones = list(
+            RamenLogTombstone.objects.filter(user_id=user_id, sync_version__gt=since, sync_version__lte=current)
+            .order_by('sync_version').values_list('sync_version', 'log_id')[:limit + 1]
+        )
+    # 2つの一覧を番号の順に合わせて、先頭の limit 件を返す
+    versions = sorted([row['sync_version'] for row in rows] + [version for version, _ in tombstones])
+    has_more = len(versions) > limit
+    until = versions[limit - 1] if has_more else current
+    rows = [row for row in rows if row['sync_version'] <= until]
+
+    logs = serialize_ramen_log_rows(rows)
+    for log, row in zip(logs, rows):
+        log['client_key'] = row['client_key']
+        log['updated_at'] = _datetime_field.to_representation(row['updated_at'])
+    return {
+        'token': issue_token(user_id, until),
+        'has_more': has_more,
+        'reset': reset,
+        'logs': logs,
+        'deleted': [log_id for version, log_id in tombstones if version <= until],
+    }
+
+
+def push(user, records):
+    """
+    オフラインで作成されたログ (client_key 付きの辞書) をまとめて作成する。
+    送られた順に {'client_key', 'status', 'id' または 'errors'} を返す。status は
+    created (作成した) / existing (同じキーで作成済み) / deleted (同じキーで作成済みで、削除された) / invalid。
+    """
+    validator = importers.RowValidator()
+    results = []
+    pending = {}
+    for record in records:
+        key = record.get('client_key')
+        values, errors = validator.validate(record)
+        if not isinstance(key, str) or not key.strip():
+            errors['client_key'] = ['この項目は必須です。']
+        elif len(key) > CLIENT_KEY_MAX_LENGTH:
+            errors['client_key'] = [f'{CLIENT_KEY_MAX_LENGTH} 文字以下にしてください。']
+        elif key in pending:
+            errors['client_key'] = ['同じリクエストの中で重複しています。']
+        result = {'client_key': key}
+        if errors:
+            result.update(status='invalid', errors=errors)
+        else:
+            pending[key] = dict(values, client_key=key)
+        results.append(result)
+    if not pending:
+        return results
+
+    with transaction.atomic():
+        # 同じユーザーの同時の送信を、カウンターの行のロックで1つずつにする (番号は進めない)
+        RamenLogSyncCounter.objects.reserve(user.id, 0)
+        existing = dict(
+            RamenLog.objects.filter(user=user, client_key__in=pending).values_list('client_key', 'id')
+        )
+        deleted = dict(
+            RamenLogTombstone.objects.filter(user=user, client_key__in=pending).values_list('client_key', 'log_id')
+        )
+        rows = [values for key, values in pending.items() if key not in existing and key not in deleted]
+        logs = importers.create_logs(user, rows) if rows else []
+        # 通常の作成 (perform_create) と同じく、フォロワーのタイムラインに展開する
+        timeline.fan_out_logs(user.id, logs)
+    created = {log.client_key: log.id for log in logs}
+
+    for result in results:
+        key = result['client_key']
+        if 'status' in result:
+            continue
+        if key in created:
+            result.update(status='created', id=created[key])
+        elif key in existing:
+            result.update(status='existing', id=existing[key])
+        else:
+            result.update(status='deleted', id=deleted[key])
+    return results
+
+
+def prune_tombstones(older_than, batch_size=1000):
+    """older_than より前の墓標を batch_size 件ずつ消し、消した件数を返す"""
+    total = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                RamenLogTombstone.objects.filter(deleted_at__lt=older_than)
+                .order_by('deleted_at').values_list('id', flat=True)[:batch_size]
+            )
+            if not batch:
+                return total
+            tombstones = RamenLogTombstone.objects.filter(id__in=batch)
+            # 消した番号より前のトークンでは削除を伝えられないため、ユーザーごとに記録しておく
+            for user_id, version in tombstones.values('user_id').annotate(version=Max('sync_version')).values_list('user_id', 'version'):
+                RamenLogSyncCounter.objects.filter(user_id=user_id, pruned_version__lt=version).update(pruned_version=version)
+            total += tombstones.delete()[0]
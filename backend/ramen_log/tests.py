@@ -1,3 +1,977 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import tracemalloc
+from unittest import mock, skipUnless
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import connection
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ramen_project import db_router, metrics
+from ramen_project.middleware import ConcurrencyLimitMiddleware
+from user_relationships.models import UserRelationship
+from users.authentication import user_cache
+from .importers import import_logs, iter_records
+from .models import RamenCalendarMonth, RamenLog, RamenLogSyncCounter, RamenLogTombstone, RamenStats, RamenStatsCounter, Shop, TimelineEntry, TimelinePullAuthor
+from . import exporters, shops, sync, visit_calendar
+from .shops import normalize_shop_name
+from .serializers import RamenLogSerializer, RAMEN_LOG_LIST_VALUES, serialize_ramen_log_rows
+
+User = get_user_model()
+
+
+class RamenLogPaginationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ramen', password='pass')
+        other = User.objects.create_user(username='other', password='pass')
+        base = datetime(2025, 1, 1, 12, 0, tzinfo=dt_timezone.utc)
+        logs = []
+        for i in range(7):
+            # 2件ずつ同じ訪問日時にして、id によるタイブレークも確認する
+            logs.append(RamenLog(user=self.user, shop_name=f'shop{i}', visited_at=base + timedelta(days=i // 2)))
+        logs.append(RamenLog(user=self.user, shop_name='undated1'))
+        logs.append(RamenLog(user=self.user, shop_name='undated2'))
+        logs.append(RamenLog(user=other, shop_name='others', visited_at=base))
+        RamenLog.objects.bulk_create(logs)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramenlog-list-create')
+
+    def fetch_all(self, page_size):
+        names = []
+        url = self.url
+        params = {'page_size': page_size}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            names += [row['shop_name'] for row in response.data['results']]
+            url, params = response.data['next'], None
+        return names
+
+    def test_retrieve_only_own_logs(self):
+        own = RamenLog.objects.get(shop_name='shop0')
+        response = self.client.get(reverse('ramenlog-retrieve', args=[own.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['shop_name'], 'shop0')
+        others = RamenLog.objects.get(shop_name='others')
+        self.assertEqual(self.client.get(reverse('ramenlog-retrieve', args=[others.id])).status_code, 404)
+
+    def test_pages_follow_visited_at_desc_nulls_last(self):
+        expected = list(
+            RamenLog.objects.filter(user=self.user)
+            .order_by('-visited_at', '-id')
+            .exclude(visited_at=None)
+            .values_list('shop_name', flat=True)
+        ) + ['undated2', 'undated1']
+        for page_size in (1, 2, 3, 50):
+            self.assertEqual(self.fetch_all(page_size), expected)
+
+    def test_page_fetch_query_count_is_constant(self):
+        first = self.client.get(self.url, {'page_size': 2})
+        cursor_url = first.data['next']
+        # ETag 用の番号の読み込みと、一覧の1クエリ
+        with self.assertNumQueries(2):
+            self.client.get(cursor_url.replace('page_size=2', 'page_size=1'))
+
+    def test_response_keeps_serializer_fields(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'user', 'shop', 'shop_name', 'ordered_item', 'noodle_hardness', 'toppings', 'rating', 'visited_at'},
+        )
+
+    def test_lean_rows_match_model_serializer(self):
+        RamenLog.objects.filter(shop_name='shop0').update(rating='4.5', toppings='味玉')
+        queryset = RamenLog.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            serialize_ramen_log_rows(queryset.values(*RAMEN_LOG_LIST_VALUES)),
+            [dict(row) for row in RamenLogSerializer(queryset, many=True).data],
+        )
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TimelineTest(APITestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.friend = User.objects.create_user(username='friend', password='pass')
+        self.stranger = User.objects.create_user(username='stranger', password='pass')
+        UserRelationship.objects.create(follower=self.reader, followed=self.friend, status=UserRelationship.STATUS_APPROVED)
+        self.url = reverse('ramen-timeline')
+
+    def post_log(self, user, shop_name):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('ramenlog-list-create'), {'shop_name': shop_name})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def read(self, **params):
+        self.client.force_authenticate(user=self.reader)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_created_logs_fan_out_to_approved_followers(self):
+        self.post_log(self.friend, 'first')
+        self.post_log(self.stranger, 'not followed')
+        self.post_log(self.friend, 'second')
+        self.assertEqual([row['shop_name'] for row in self.read()['results']], ['second', 'first'])
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 2)
+
+    def test_pages_with_cursor(self):
+        for i in range(5):
+            self.post_log(self.friend, f'shop{i}')
+        names = []
+        data = self.read(page_size=2)
+        names += [row['shop_name'] for row in data['results']]
+        while data['next']:
+            self.client.force_authenticate(user=self.reader)
+            data = self.client.get(data['next']).data
+            names += [row['shop_name'] for row in data['results']]
+        self.assertEqual(names, ['shop4', 'shop3', 'shop2', 'shop1', 'shop0'])
+
+    def test_delete_and_unfollow_retract_entries(self):
+        log_id = self.post_log(self.friend, 'deleted')
+        self.post_log(self.friend, 'kept')
+        self.client.force_authenticate(user=self.friend)
+        self.client.delete(reverse('ramenlog-delete', args=[log_id]))
+        self.assertEqual([row['shop_name'] for row in self.read()['results']], ['kept'])
+
+        self.client.force_authenticate(user=self.reader)
+        response = self.client.delete(reverse('unfollow', args=[self.friend.id]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.read()['results'], [])
+
+    @override_settings(TIMELINE_BACKFILL_LOGS=3)
+    def test_import_adds_only_recent_logs_to_timelines(self):
+        other = User.objects.create_user(username='other', password='pass')
+        UserRelationship.objects.create(follower=other, followed=self.friend, status=UserRelationship.STATUS_APPROVED)
+        content = 'shop_name\n' + ''.join(f'shop{i}\n' for i in range(20))
+        report = import_logs(self.friend, iter_records(io.BytesIO(content.encode('utf-8')), 'csv'), batch_size=4)
+        self.assertEqual(report.created, 20)
+        # インポートの行数によらず、フォロワーごとに TIMELINE_BACKFILL_LOGS 行まで
+        self.assertEqual(TimelineEntry.objects.count(), 2 * 3)
+        self.assertEqual([row['shop_name'] for row in self.read()['results']], ['shop19', 'shop18', 'shop17'])
+
+    def test_approval_backfills_recent_logs(self):
+        self.post_log(self.stranger, 'before follow')
+        UserRelationship.objects.create(follower=self.reader, followed=self.stranger)
+        self.client.force_authenticate(user=self.stranger)
+        response = self.client.patch(reverse('follow-approve', args=[self.reader.id]), {'action': 'approve'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['shop_name'] for row in self.read()['results']], ['before follow'])
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_follower_authors_are_read_on_demand(self):
+        self.post_log(self.friend, 'pulled')
+        self.assertTrue(TimelinePullAuthor.objects.filter(user=self.friend).exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual([row['shop_name'] for row in self.read()['results']], ['pulled'])
+
+
+class RamenLogImportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramenlog-import')
+
+    def upload(self, name, content, **extra):
+        return self.client.post(self.url, dict({'file': SimpleUploadedFile(name, content.encode('utf-8'))}, **extra))
+
+    def test_imports_csv_in_batches_and_reports_bad_rows(self):
+        content = (
+            'shop_name,ordered_item,rating,visited_at\n'
+            '一蘭,ラーメン,4.5,2024-05-01T12:00:00+09:00\n'
+            ',醤油,3.0,\n'
+            '天下一品,こってり,12.34,not-a-date\n'
+            '二郎,小ラーメン,,\n'
+        )
+        response = self.upload('logs.csv', content, batch_size=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([e['row'] for e in response.data['errors']], [2, 3])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'rating', 'visited_at'})
+        log = RamenLog.objects.get(shop_name='一蘭')
+        self.assertEqual(log.user, self.user)
+        self.assertEqual(str(log.rating), '4.5')
+        self.assertEqual(log.visited_at, datetime(2024, 5, 1, 3, 0, tzinfo=dt_timezone.utc))
+
+    def test_imports_ndjson(self):
+        content = '{"shop_name": "蒙古タンメン中本", "rating": 5}\n\nnot json\n'
+        response = self.upload('logs.ndjson', content)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+
+    def test_undecodable_rows_are_reported(self):
+        # 2行目は Shift_JIS、4行目は引用符の中に改行があり、その2行目だけが Shift_JIS
+        content = (
+            'shop_name,ordered_item\n'.encode() + '一蘭,ラーメン\n'.encode() + '二郎,小\n'.encode('shift_jis')
+            + '天下一品,こってり\n'.encode() + '"中本\n'.encode() + '北極",辛\n'.encode('shift_jis') + '富田,つけ麺\n'.encode()
+        )
+        response = self.client.post(self.url, {'file': SimpleUploadedFile('logs.csv', content), 'batch_size': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['errors'], [
+            {'row': 2, 'errors': {'non_field_errors': ['utf-8 として読み込めません。']}},
+            {'row': 4, 'errors': {'non_field_errors': ['utf-8 として読み込めません。']}},
+        ])
+
+        response = self.client.post(self.url, {'file': SimpleUploadedFile('logs.ndjson', b'\xff\n{"shop_name": "a"}\n')})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['errors'][0]['row'], 1)
+
+    def test_shift_jis(self):
+        content = 'shop_name,toppings\n一蘭,味玉・チャーシュー\n'.encode('shift_jis')
+        response = self.client.post(self.url, {'file': SimpleUploadedFile('logs.csv', content)})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RamenLog.objects.exists())
+
+        response = self.client.post(self.url, {'file': SimpleUploadedFile('logs.csv', content), 'encoding': 'shift_jis'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RamenLog.objects.get().toppings, '味玉・チャーシュー')
+
+    def test_csv_errors_are_row_errors(self):
+        # csv の1項目の上限 (131072 文字) を超える行
+        content = 'shop_name\n一蘭\n"' + 'x' * 200_000 + '"\n二郎\n'
+        response = self.upload('logs.csv', content)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+
+    def test_rejects_when_nothing_is_valid(self):
+        response = self.upload('logs.txt', '{"rating": 1}\n', file_format='ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RamenLog.objects.exists())
+
+
+class RamenLogExportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramenlog-export')
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_round_trips_through_import(self):
+        RamenLog.objects.create(user=self.user, shop_name='一蘭, 渋谷', rating='4.5',
+                                visited_at=datetime(2024, 5, 1, 3, 0, tzinfo=dt_timezone.utc))
+        RamenLog.objects.create(user=self.user, shop_name='二郎')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        body = self.content(response).decode('utf-8')
+        self.assertEqual(body.splitlines()[0], 'id,shop_name,ordered_item,noodle_hardness,toppings,rating,visited_at')
+        self.assertIn('"一蘭, 渋谷",,,,4.5,2024-05-01T03:00:00Z', body)
+
+        other = User.objects.create_user(username='other', password='pass')
+        report = import_logs(other, iter_records(io.BytesIO(body.encode('utf-8')), 'csv'))
+        self.assertEqual((report.created, report.failed), (2, 0))
+
+    def test_gzipped_ndjson(self):
+        RamenLog.objects.create(user=self.user, shop_name='中本')
+        response = self.client.get(self.url, {'file_format': 'ndjson', 'gzip': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(self.content(response)).decode('utf-8').splitlines()
+        self.assertEqual(json.loads(lines[0])['shop_name'], '中本')
+
+    def test_large_export_streams_under_fixed_memory_ceiling(self):
+        rows = 50000
+        RamenLog.objects.bulk_create([
+            RamenLog(user=self.user, shop_name=f'ラーメン店{i}', ordered_item='特製醤油ラーメン', toppings='味玉,チャーシュー,メンマ',
+                     rating='4.0', visited_at=datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+            for i in range(rows)
+        ], batch_size=5000)
+        response = self.client.get(self.url)
+        total = 0
+        tracemalloc.start()
+        try:
+            for chunk in response.streaming_content:
+                total += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(total, 5 * 1024 * 1024)
+        # 出力全体 (数MB) を溜め込まず、チャンク単位のメモリだけで書き出せていること
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+    async def test_asgi_streams_without_reading_everything_first(self):
+        await RamenLog.objects.abulk_create([RamenLog(user=self.user, shop_name=f'shop{i}') for i in range(10)])
+        read = []
+        export_rows = exporters.export_rows
+
+        def counting_rows(user, chunk_size):
+            for row in export_rows(user, chunk_size=chunk_size):
+                read.append(row)
+                yield row
+
+        user_cache.clear()
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        with mock.patch.object(exporters, 'export_rows', counting_rows), mock.patch.object(exporters, 'FLUSH_BYTES', 1):
+            response = await self.async_client.get(self.url, headers=headers)
+            self.assertTrue(response.is_async)
+            chunks = aiter(response)
+            # 最初のチャンク (ヘッダー行) は、ログを読み始める前に返ってくる
+            self.assertTrue((await anext(chunks)).startswith(b'id,shop_name'))
+            self.assertEqual(read, [])
+            rest = [chunk async for chunk in chunks]
+        self.assertEqual((len(read), len(rest)), (10, 10))
+
+    async def test_asgi_exports_do_not_take_regular_slots(self):
+        started = []
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            started.append(scope['path'])
+            await release.wait()
+
+        limited = ConcurrencyLimitMiddleware(app, 1, {'/export/': 1})
+        regular = [asyncio.ensure_future(limited({'type': 'http', 'path': path}, None, None)) for path in ('/a/', '/b/')]
+        export = asyncio.ensure_future(limited({'type': 'http', 'path': '/export/'}, None, None))
+        await asyncio.sleep(0.01)
+        # /b/ は /a/ の終了を待つが、エクスポートは別の枠で始まる
+        self.assertEqual(started, ['/a/', '/export/'])
+        release.set()
+        await asyncio.gather(*regular, export)
+        self.assertEqual(started, ['/a/', '/export/', '/b/'])
+
+
+class RamenStatsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='stats', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramen-stats')
+
+    def post_log(self, **data):
+        response = self.client.post(reverse('ramenlog-list-create'), data)
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_stats_follow_creates_and_deletes(self):
+        self.post_log(shop_name='一蘭', ordered_item='ラーメン', noodle_hardness='かため', rating='4.0')
+        second = self.post_log(shop_name='一蘭', ordered_item='替え玉', noodle_hardness='かため', rating='5.0')
+        self.post_log(shop_name='二郎', ordered_item='ラーメン', noodle_hardness='やわらかめ')
+        data = self.client.get(self.url).data
+        self.assertEqual(data['visit_count'], 3)
+        self.assertEqual(data['shop_count'], 2)
+        self.assertEqual(data['average_rating'], 4.5)
+        self.assertEqual(data['top_ordered_item'], 'ラーメン')
+        self.assertEqual(data['favorite_noodle_hardness'], 'かため')
+
+        self.client.delete(reverse('ramenlog-delete', args=[second]))
+        data = self.client.get(self.url).data
+        self.assertEqual((data['visit_count'], data['shop_count'], data['average_rating']), (2, 2, 4.0))
+        self.assertFalse(RamenStatsCounter.objects.filter(value='替え玉').exists())
+
+    def test_delete_without_rollup_does_not_fail(self):
+        # 集計より前からあるログ (統計の行がない) を削除しても、負の値にならずに削除できる
+        log_id = self.post_log(shop_name='一蘭', ordered_item='ラーメン', rating='4.0')
+        RamenStats.objects.filter(user=self.user).delete()
+        RamenStatsCounter.objects.filter(user=self.user).delete()
+        self.post_log(shop_name='二郎', rating='3.0')
+        response = self.client.delete(reverse('ramenlog-delete', args=[log_id]))
+        self.assertEqual(response.status_code, 204)
+        data = self.client.get(self.url).data
+        self.assertEqual((data['visit_count'], data['rating_count']), (0, 0))
+        call_command('rebuild_ramen_stats', stdout=io.StringIO())
+        data = self.client.get(self.url).data
+        self.assertEqual((data['visit_count'], data['shop_count'], data['average_rating']), (1, 1, 3.0))
+
+    def test_create_is_atomic_with_rollup(self):
+        with mock.patch('ramen_log.views.timeline.fan_out', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('ramenlog-list-create'), {'shop_name': '一蘭'})
+        self.assertFalse(RamenLog.objects.filter(user=self.user).exists())
+        self.assertEqual(RamenStats.objects.filter(user=self.user, visit_count__gt=0).count(), 0)
+
+    def test_rebuild_locks_stats_before_counting(self):
+        # 集計の間に作成・削除されたログの差分の更新が、集計の後まで待つように
+        from . import stats
+        self.post_log(shop_name='一蘭')
+        with CaptureQueriesContext(connection) as ctx:
+            stats.rebuild_user(self.user.id)
+        sqls = [q['sql'] for q in ctx.captured_queries]
+        lock = next(i for i, sql in enumerate(sqls) if 'FOR UPDATE' in sql and 'ramen_log_ramenstats' in sql)
+        count = next(i for i, sql in enumerate(sqls) if 'ramen_log_ramenlog' in sql)
+        self.assertLess(lock, count)
+        self.assertEqual(self.client.get(self.url).data['visit_count'], 1)
+
+    def test_read_does_not_touch_ramen_logs(self):
+        self.post_log(shop_name='一蘭')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        self.assertFalse(any('ramen_log_ramenlog' in q['sql'] for q in ctx.captured_queries))
+
+    def test_import_updates_stats_and_rebuild_verifies(self):
+        import_logs(self.user, iter_records(io.BytesIO('shop_name,rating\n一蘭,3\n一蘭,4\n中本,\n'.encode('utf-8')), 'csv'))
+        self.assertEqual(self.client.get(self.url).data['visit_count'], 3)
+        call_command('rebuild_ramen_stats', '--verify', stdout=io.StringIO())
+
+        RamenStats.objects.filter(user=self.user).update(visit_count=99)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ramen_stats', '--verify', stdout=io.StringIO())
+        call_command('rebuild_ramen_stats', stdout=io.StringIO())
+        data = self.client.get(self.url).data
+        self.assertEqual((data['visit_count'], data['shop_count'], data['average_rating']), (3, 2, 3.5))
+
+
+class RamenLogListFilterTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='filter', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramenlog-list-create')
+        base = datetime(2025, 1, 1, 12, 0, tzinfo=dt_timezone.utc)
+        for i, (shop_name, hardness, rating) in enumerate((
+            ('一蘭 渋谷店', 'かため', '4.5'), ('一蘭渋谷', '普通', '3.0'), ('二郎', 'かため', None), ('中本', None, '5.0'),
+        )):
+            RamenLog.objects.create(
+                user=self.user, shop_name=shop_name, shop_id=shops.resolve_shop_id(shop_name),
+                noodle_hardness=hardness, rating=rating, visited_at=base + timedelta(days=i),
+            )
+
+    def shop_names(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['shop_name'] for row in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.shop_names(rating_min='3.5'), ['中本', '一蘭 渋谷店'])
+        self.assertEqual(self.shop_names(rating_min='3', rating_max='4.5'), ['一蘭渋谷', '一蘭 渋谷店'])
+        self.assertEqual(self.shop_names(visited_after='2025-01-02', visited_before='2025-01-03T12:00:00Z'), ['一蘭渋谷'])
+        self.assertEqual(self.shop_names(shop_name='一蘭 渋谷'), ['一蘭渋谷', '一蘭 渋谷店'])
+        shop_id = Shop.objects.get(name_key=normalize_shop_name('二郎')).id
+        self.assertEqual(self.shop_names(shop=shop_id), ['二郎'])
+        self.assertEqual(self.shop_names(noodle_hardness='かため', rating_min='4'), ['一蘭 渋谷店'])
+
+    def test_orderings_paginate_with_nulls_last(self):
+        for ordering, expected in (
+            ('-visited_at', ['中本', '二郎', '一蘭渋谷', '一蘭 渋谷店']),
+            ('visited_at', ['一蘭 渋谷店', '一蘭渋谷', '二郎', '中本']),
+            ('-rating', ['中本', '一蘭 渋谷店', '一蘭渋谷', '二郎']),
+        ):
+            names, url, params = [], self.url, {'ordering': ordering, 'page_size': 1}
+            while url:
+                response = self.client.get(url, params)
+                names += [row['shop_name'] for row in response.data['results']]
+                url, params = response.data['next'], None
+            self.assertEqual(names, expected, ordering)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'rating_min': 'high'}, {'visited_after': 'yesterday'}, {'ordering': 'shop_name'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_filters_never_scan_the_whole_table(self):
+        """大きなテーブルで、どの絞り込み・並び順も順次走査 (Seq Scan) にならない"""
+        import random
+        rng = random.Random(1)
+        users = User.objects.bulk_create([User(username=f'filter{i}') for i in range(200)])
+        names = [f'店{i}' for i in range(100)]
+        shop_ids = shops.resolve_shop_ids(names)
+        base = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        RamenLog.objects.bulk_create([
+            RamenLog(
+                user=user, shop_name=name, shop_id=shop_ids[name], noodle_hardness=rng.choice(['かため', '普通', None]),
+                rating=rng.choice([None, Decimal('3.0'), Decimal('4.5')]), topping_tags=rng.choice([[], ['味玉']]),
+                visited_at=rng.choice([None, base + timedelta(hours=rng.randrange(10000))]),
+            )
+            for user in users + [self.user] for name in rng.choices(names, k=100)
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE ramen_log_ramenlog')
+        shop_id = shop_ids['店1']
+        cases = [
+            {}, {'ordering': 'visited_at'}, {'ordering': '-rating'},
+            {'rating_min': '4'}, {'rating_min': '3', 'rating_max': '4', 'ordering': '-rating'},
+            {'visited_after': '2024-06-01', 'visited_before': '2024-07-01'},
+            {'visited_after': '2024-06-01', 'ordering': 'visited_at'},
+            {'shop': shop_id}, {'shop_name': '店1'}, {'noodle_hardness': 'かため'},
+            {'noodle_hardness': 'かため', 'rating_min': '4'}, {'topping': '味玉'},
+        ]
+        for params in cases:
+            url, params = self.url, dict(params, page_size=5)
+            # 1ページ目と、カーソルを使う2ページ目の両方の SQL を調べる
+            for _ in range(2):
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                for query in ctx.captured_queries:
+                    if 'ramen_log_ramenlog' not in query['sql']:
+                        continue
+                    with connection.cursor() as cursor:
+                        cursor.execute('EXPLAIN ' + query['sql'])
+                        plan = '\n'.join(row[0] for row in cursor.fetchall())
+                    self.assertNotIn('Seq Scan on ramen_log_ramenlog', plan, f'{params}\n{plan}')
+                url, params = response.data['next'], None
+                if url is None:
+                    break
+
+
+class RamenCalendarTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='calendar', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramen-calendar')
+        for visited_at, rating in (('2025-01-03T12:00:00Z', '4.0'), ('2025-01-03T20:00:00Z', '5.0'), ('2025-03-31T23:00:00Z', None)):
+            RamenLog.objects.create(user=self.user, shop_name='一蘭', visited_at=visited_at, rating=rating)
+
+    def months(self, year=2025):
+        response = self.client.get(self.url, {'year': year})
+        self.assertEqual(response.status_code, 200)
+        return {month['month']: month for month in response.data['months']}
+
+    def test_aggregates_days_and_months(self):
+        months = self.months()
+        self.assertEqual(len(months), 12)
+        self.assertEqual(
+            months['2025-01'],
+            {'month': '2025-01', 'visit_count': 2, 'rating_count': 2, 'average_rating': 4.5, 'days': {'2025-01-03': 2}},
+        )
+        self.assertEqual(months['2025-03']['days'], {'2025-03-31': 1})
+        self.assertEqual(months['2025-02']['visit_count'], 0)
+
+    def test_closed_months_are_cached_and_invalidated_by_writes(self):
+        self.months()
+        self.assertEqual(RamenCalendarMonth.objects.filter(user=self.user).count(), 12)
+        # 保存済みの月は RamenLog を集計しない
+        with CaptureQueriesContext(connection) as ctx:
+            self.months()
+        self.assertFalse(any('ramen_log_ramenlog' in q['sql'] for q in ctx.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('ramenlog-list-create'), {'shop_name': '二郎', 'visited_at': '2025-01-10T12:00:00Z'},
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(RamenCalendarMonth.objects.filter(user=self.user, month='2025-01-01').exists())
+        self.assertEqual(self.months()['2025-01']['visit_count'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('ramenlog-delete', args=[response.data['id']]))
+        self.assertEqual(self.months()['2025-01']['visit_count'], 2)
+
+    def test_write_during_compute_is_not_cached(self):
+        compute = visit_calendar._compute
+
+        def compute_then_write(user_id, months):
+            result = compute(user_id, months)
+            # 集計を読んだ後、保存する前に過去の月のログが作成され、コミット後の削除も先に終わる
+            with self.captureOnCommitCallbacks(execute=True):
+                log = RamenLog.objects.create(user=self.user, shop_name='二郎', visited_at=datetime(2025, 1, 10, 12, tzinfo=dt_timezone.utc))
+                visit_calendar.invalidate(self.user.id, [log])
+            return result
+
+        with mock.patch.object(visit_calendar, '_compute', compute_then_write):
+            self.assertEqual(self.months()['2025-01']['visit_count'], 2)
+        # 古い集計は保存されず、次の読み込みで計算し直される
+        self.assertFalse(RamenCalendarMonth.objects.filter(user=self.user).exists())
+        self.assertEqual(self.months()['2025-01']['visit_count'], 3)
+        self.assertTrue(RamenCalendarMonth.objects.filter(user=self.user, month='2025-01-01').exists())
+
+    def test_current_month_is_always_computed(self):
+        RamenLog.objects.create(user=self.user, shop_name='一蘭', visited_at=timezone.now())
+        year = timezone.localdate().year
+        self.assertEqual(sum(month['visit_count'] for month in self.months(year).values()), 1)
+        self.assertFalse(RamenCalendarMonth.objects.filter(user=self.user, month__gte=timezone.localdate().replace(day=1)).exists())
+        RamenLog.objects.create(user=self.user, shop_name='一蘭', visited_at=timezone.now())
+        self.assertEqual(sum(month['visit_count'] for month in self.months(year).values()), 2)
+
+
+class RamenLogSyncTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sync', password='pass')
+        self.other = User.objects.create_user(username='sync_other', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramenlog-sync')
+        # 統計も更新されるよう、インポートと同じ経路で作成する
+        import_logs(self.user, iter_records(io.BytesIO('shop_name\nshop0\nshop1\nshop2\n'.encode()), 'csv'))
+        self.logs = list(RamenLog.objects.filter(user=self.user).order_by('id'))
+        RamenLog.objects.create(user=self.other, shop_name='other')
+
+    def sync(self, token=None, **params):
+        response = self.client.get(self.url, {'token': token or '', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_returns_only_changes_since_token(self):
+        first = self.sync()
+        self.assertEqual([log['id'] for log in first['logs']], [log.id for log in self.logs])
+        self.assertEqual((first['deleted'], first['has_more'], first['reset']), ([], False, False))
+        self.assertEqual(self.sync(first['token'])['logs'], [])
+
+        updated = self.logs[0]
+        updated.rating = Decimal('4.5')
+        updated.save(update_fields=['rating'])
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post(reverse('ramenlog-list-create'), {'shop_name': '二郎'}).data
+            self.client.delete(reverse('ramenlog-delete', args=[self.logs[1].id]))
+        second = self.sync(first['token'])
+        self.assertEqual([log['id'] for log in second['logs']], [updated.id, created['id']])
+        self.assertEqual(second['logs'][0]['rating'], '4.5')
+        self.assertEqual(second['deleted'], [self.logs[1].id])
+        self.assertEqual(self.sync(second['token'])['logs'], [])
+
+    def test_pages_through_changes_in_version_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('ramenlog-delete', args=[self.logs[0].id]))
+        self.logs[1].save()
+        token, seen = None, []
+        while True:
+            page = self.sync(token, limit=1)
+            seen += [log['id'] for log in page['logs']]
+            token = page['token']
+            if not page['has_more']:
+                break
+        self.assertEqual(seen, [self.logs[2].id, self.logs[1].id])
+
+    def test_invalid_and_foreign_tokens_are_rejected(self):
+        response = self.client.get(self.url, {'token': 'broken'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {'token': sync.issue_token(self.other.id, 0)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pruned_tombstones_force_reset(self):
+        token = self.sync()['token']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('ramenlog-delete', args=[self.logs[0].id]))
+        self.assertEqual(sync.prune_tombstones(timezone.now() + timedelta(seconds=1)), 1)
+        page = self.sync(token)
+        self.assertTrue(page['reset'])
+        self.assertEqual([log['id'] for log in page['logs']], [log.id for log in self.logs[1:]])
+
+    def test_push_is_idempotent(self):
+        token = self.sync()['token']
+        body = {'token': token, 'logs': [
+            {'client_key': 'a', 'shop_name': '一蘭', 'rating': '4.0', 'visited_at': '2025-01-01T12:00:00Z'},
+            {'client_key': 'b', 'shop_name': ''},
+            {'client_key': 'a', 'shop_name': '一蘭'},
+        ]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, body, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['created']], ['created', 'invalid', 'invalid'])
+        log_id = response.data['created'][0]['id']
+        self.assertEqual([(log['id'], log['client_key']) for log in response.data['logs']], [(log_id, 'a')])
+        self.assertEqual(RamenStats.objects.get(user=self.user).visit_count, 4)
+
+        # 同じキーの再送では作成しない (削除後も作り直さない)
+        response = self.client.post(self.url, {'logs': body['logs'][:1]}, format='json')
+        self.assertEqual(response.data['created'][0], {'client_key': 'a', 'status': 'existing', 'id': log_id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('ramenlog-delete', args=[log_id]))
+        response = self.client.post(self.url, {'logs': body['logs'][:1]}, format='json')
+        self.assertEqual(response.data['created'][0]['status'], 'deleted')
+        self.assertEqual(RamenLog.objects.filter(user=self.user, client_key='a').count(), 0)
+        self.assertEqual(RamenLogTombstone.objects.get(log_id=log_id).client_key, 'a')
+
+    def test_versions_follow_writes(self):
+        counter = RamenLogSyncCounter.objects.get(user=self.user)
+        self.assertEqual(counter.version, 3)
+        self.assertEqual([log.sync_version for log in self.logs], [1, 2, 3])
+        self.logs[0].save()
+        RamenLog.objects.create(user=self.user, shop_name='shop3')
+        self.assertEqual(sorted(RamenLog.objects.filter(user=self.user).values_list('sync_version', flat=True)), [2, 3, 4, 5])
+        self.assertEqual(RamenLogSyncCounter.objects.get(user=self.other).version, 1)
+
+
+class RamenLogToppingTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='topping', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('ramenlog-list-create')
+        for shop_name, toppings in (('一蘭', '味玉、ﾁｬｰｼｭｰ'), ('二郎', 'チャーシュー / ネギ'), ('中本', None)):
+            data = {'shop_name': shop_name}
+            if toppings:
+                data['toppings'] = toppings
+            self.assertEqual(self.client.post(self.url, data).status_code, 201)
+
+    def shop_names(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['shop_name'] for row in response.data['results'])
+
+    def test_parse_toppings_normalizes_and_dedupes(self):
+        from .toppings import parse_toppings
+        self.assertEqual(parse_toppings('味玉，ﾁｬｰｼｭｰ・のり 味玉/ABC'), ['味玉', 'チャーシュー', 'のり', 'abc'])
+        self.assertEqual(parse_toppings(None), [])
+
+    def test_filters_by_all_given_toppings(self):
+        self.assertEqual(self.shop_names(topping='チャーシュー'), ['一蘭', '二郎'])
+        self.assertEqual(self.shop_names(topping=['ﾁｬｰｼｭｰ', '味玉']), ['一蘭'])
+        self.assertEqual(self.shop_names(topping='もやし'), [])
+        self.assertEqual(len(self.shop_names()), 3)
+
+    def test_filter_uses_gin_index(self):
+        with connection.cursor() as cursor:
+            # 件数が少ないと順次走査が選ばれるため、インデックスを使えることだけを確かめる
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            queryset = RamenLog.objects.filter(topping_tags__contains=['味玉'])
+            self.assertIn('ramenlog_topping_tags_gin', queryset.explain())
+
+    def test_stats_count_toppings_and_backfill(self):
+        counts = self.client.get(reverse('ramen-stats')).data['topping_counts']
+        self.assertEqual(counts, [
+            {'topping': 'チャーシュー', 'count': 2}, {'topping': 'ネギ', 'count': 1}, {'topping': '味玉', 'count': 1},
+        ])
+        self.client.delete(reverse('ramenlog-delete', args=[RamenLog.objects.get(shop_name='二郎').id]))
+        counts = self.client.get(reverse('ramen-stats')).data['topping_counts']
+        self.assertEqual(counts, [{'topping': 'チャーシュー', 'count': 1}, {'topping': '味玉', 'count': 1}])
+        call_command('rebuild_ramen_stats', '--verify', stdout=io.StringIO())
+
+        # update() では topping_tags が計算されないため、backfill_toppings で作り直す
+        RamenLog.objects.filter(shop_name='中本').update(toppings='もやし,ネギ')
+        self.assertEqual(self.shop_names(topping='もやし'), [])
+        version = RamenLogSyncCounter.objects.get(user=self.user).version
+        call_command('backfill_toppings', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.shop_names(topping='もやし'), ['中本'])
+        # タグが変わったログだけが、差分同期で送り直される
+        self.assertEqual([log['shop_name'] for log in sync.changes(self.user.id, version, 100)['logs']], ['中本'])
+
+
+class ShopTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='pass')
+        self.client.force_authenticate(user=self.user)
+
+    def test_normalization_merges_spelling_variants(self):
+        self.assertEqual(normalize_shop_name('一蘭 渋谷店'), normalize_shop_name('一蘭渋谷'))
+        self.assertEqual(normalize_shop_name('ＩＣＨＩＲＡＮ　渋谷'), normalize_shop_name('ichiran渋谷店'))
+        self.assertEqual(normalize_shop_name('ｲﾁﾗﾝ'), 'イチラン')
+        self.assertEqual(normalize_shop_name('店'), '店')
+        self.assertEqual(normalize_shop_name('  '), '')
+
+    def test_created_logs_share_one_shop(self):
+        url = reverse('ramenlog-list-create')
+        first = self.client.post(url, {'shop_name': '一蘭 渋谷店', 'rating': '4.0'}).data
+        second = self.client.post(url, {'shop_name': '一蘭渋谷', 'rating': '5.0'}).data
+        self.assertEqual(first['shop'], second['shop'])
+        self.assertEqual(Shop.objects.get().name, '一蘭 渋谷店')
+        self.assertEqual(self.client.get(reverse('ramen-stats')).data['shop_count'], 1)
+
+        detail = self.client.get(reverse('shop-detail', args=[first['shop']])).data
+        self.assertEqual((detail['visit_count'], detail['average_rating']), (2, 4.5))
+
+    def test_backfill_assigns_shops_in_batches(self):
+        RamenLog.objects.bulk_create([
+            RamenLog(user=self.user, shop_name=name)
+            for name in ['天下一品 本店', '天下一品本', 'ﾗｰﾒﾝ二郎', 'ラーメン二郎店', '中本']
+        ])
+        self.assertEqual(sync.changes(self.user.id, 0, 100)['logs'], [])
+        call_command('backfill_shops', '--batch-size', '2', stdout=io.StringIO())
+        self.assertFalse(RamenLog.objects.filter(shop__isnull=True).exists())
+        # 店を割り当てたログは、差分同期で送り直される
+        changed = sync.changes(self.user.id, 0, 100)['logs']
+        self.assertEqual(len(changed), 5)
+        self.assertTrue(all(log['shop'] is not None for log in changed))
+        self.assertEqual(Shop.objects.count(), 3)
+        self.assertEqual(sorted(Shop.objects.values_list('visit_count', flat=True)), [1, 2, 2])
+
+
+class ShopAutocompleteTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='typist', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('shop-autocomplete')
+        visits = {
+            'ラーメン二郎 三田本店': 5, '麺屋 武蔵': 3, 'ラーメン凪': 2, '蒙古タンメン中本': 4,
+            'ﾗｰﾒﾝ 大至': 1, '家系ラーメン 武蔵家': 6,
+        }
+        RamenLog.objects.bulk_create([
+            RamenLog(user=self.user, shop_name=name) for name, n in visits.items() for _ in range(n)
+        ])
+        call_command('backfill_shops', stdout=io.StringIO())
+
+    def names(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data]
+
+    def test_prefix_matches_rank_first_then_by_popularity(self):
+        self.assertEqual(
+            self.names('ラーメン'),
+            ['ラーメン二郎 三田本店', 'ラーメン凪', 'ﾗｰﾒﾝ 大至', '家系ラーメン 武蔵家'],
+        )
+        self.assertEqual(self.names('武蔵'), ['家系ラーメン 武蔵家', '麺屋 武蔵'])
+        self.assertEqual(self.names('ラーメン', limit=2), ['ラーメン二郎 三田本店', 'ラーメン凪'])
+
+    def test_query_is_normalized(self):
+        self.assertEqual(self.names('ﾗｰﾒﾝ 二郎'), ['ラーメン二郎 三田本店'])
+        self.assertEqual(self.names('タン'), ['蒙古タンメン中本'])
+        self.assertEqual(self.names('中'), ['蒙古タンメン中本'])
+        self.assertEqual(self.names('天下一品'), [])
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_popular_scan_and_index_scan_agree(self):
+        queries = ['ラ', 'ラーメン', 'メン', '武蔵', '蔵', '本店', '二郎三田']
+        expected = {q: self.names(q, limit=3) for q in queries}
+        # 人気上位だけを調べる経路と、GIN で全店から探す経路の両方を通す
+        for scan in (1, 2, 3, 6):
+            cache.clear()
+            with mock.patch.object(shops, 'POPULAR_SCAN', scan):
+                self.assertEqual({q: self.names(q, limit=3) for q in queries}, expected)
+
+    def test_visit_counts_follow_created_and_deleted_logs(self):
+        create = reverse('ramenlog-list-create')
+        log = self.client.post(create, {'shop_name': '麺屋武蔵'}).data
+        self.client.post(create, {'shop_name': '麺屋 武蔵店'})
+        self.assertEqual(Shop.objects.get(pk=log['shop']).visit_count, 5)
+        self.client.delete(reverse('ramenlog-delete', args=[log['id']]))
+        self.assertEqual(Shop.objects.get(pk=log['shop']).visit_count, 4)
+        self.assertEqual(self.names('武蔵'), ['家系ラーメン 武蔵家', '麺屋 武蔵'])
+
+        Shop.objects.update(visit_count=0, name_grams=[])
+        call_command('rebuild_shop_index', stdout=io.StringIO())
+        self.assertEqual(Shop.objects.get(pk=log['shop']).visit_count, 4)
+        self.assertEqual(self.names('武蔵'), ['家系ラーメン 武蔵家', '麺屋 武蔵'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica_a'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = db_router.ReplicaRouter()
+
+    def route(self, method, user_id=1, write=False):
+        token = db_router.begin_request(method)
+        try:
+            db_router.bind_user(user_id)
+            if write:
+                self.assertEqual(self.router.db_for_write(RamenLog), 'default')
+            return self.router.db_for_read(RamenLog)
+        finally:
+            db_router.end_request(token)
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.route('GET'), 'replica_a')
+        self.assertIsNone(self.route('POST'))
+        # リクエストの外では primary
+        self.assertIsNone(self.router.db_for_read(RamenLog))
+
+    def test_writer_reads_from_primary_for_a_while(self):
+        self.assertIsNone(self.route('GET', write=True))
+        self.assertIsNone(self.route('GET'))
+        # 他のユーザーはレプリカのまま
+        self.assertEqual(self.route('GET', user_id=2), 'replica_a')
+        cache.clear()  # REPLICA_STICKY_SECONDS が過ぎた
+        self.assertEqual(self.route('GET'), 'replica_a')
+
+    def test_check_requires_shared_cache(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}
+        with self.settings(CACHES=locmem):
+            self.assertEqual([error.id for error in db_router.check_sticky_cache(None)], ['ramen_project.E001'])
+            with self.settings(DATABASE_REPLICAS=[]):
+                self.assertEqual(db_router.check_sticky_cache(None), [])
+        with self.settings(CACHES=redis):
+            self.assertEqual(db_router.check_sticky_cache(None), [])
+
+
+def _separate_replica():
+    """primary とは別のインスタンス (MIRROR でない) のレプリカが設定されていれば、そのエイリアスを返す"""
+    for alias in settings.DATABASE_REPLICAS:
+        if settings.DATABASES[alias].get('TEST', {}).get('MIRROR') is None:
+            return alias
+    return None
+
+
+@skipUnless(_separate_replica(), 'primary と別のインスタンスのレプリカが設定されていない')
+@override_settings(DATABASE_REPLICAS=[_separate_replica()])
+class ReplicaRoutingTest(APITransactionTestCase):
+    """
+    primary と、複製されていない別のインスタンスをレプリカとして設定し、読み込みの振り分けを確認する。
+    (例: DATABASES['replica1'] に別の Postgres を設定し、DATABASE_REPLICAS = ['replica1'])
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.replica = _separate_replica()
+        self.user = User.objects.create_user(username='replica', password='pass')
+        RamenLog.objects.create(user=self.user, shop_name='primary only')
+        # 認証のため、ユーザーだけはレプリカにも作っておく
+        User.objects.using(self.replica).create(id=self.user.id, username='replica')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def list_shop_names(self):
+        response = self.client.get(reverse('ramenlog-list-create'))
+        self.assertEqual(response.status_code, 200)
+        return [log['shop_name'] for log in response.data['results']]
+
+    def test_reads_go_to_replica_until_user_writes(self):
+        self.assertEqual(self.list_shop_names(), [])
+        response = self.client.post(reverse('ramenlog-list-create'), {'shop_name': '一蘭'})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(RamenLog.objects.using(self.replica).exists())
+        # 書き込んだユーザーの読み込みは、しばらく primary から返す
+        self.assertCountEqual(self.list_shop_names(), ['primary only', '一蘭'])
+        cache.clear()
+        self.assertEqual(self.list_shop_names(), [])
+
+    def test_authentication_reads_from_primary(self):
+        # レプリカが無効化を反映していなくても、無効化されたユーザーのトークンは使えない
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        response = self.client.get(reverse('ramenlog-list-create'))
+        self.assertEqual((response.status_code, response.data['code']), (401, 'user_inactive'))
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='metrics', password='pass')
+        RamenLog.objects.create(user=self.user, shop_name='一蘭')
+        self.client.force_authenticate(user=self.user)
+
+    def sample(self, name, route, **labels):
+        return metrics.REGISTRY.get_sample_value(name, {'method': 'GET', 'route': route, **labels}) or 0
+
+    def test_records_requests_queries_and_serializer_time_per_route(self):
+        route = 'api/ramen/ramenlog/'
+        requests_before = self.sample('ramen_http_requests_total', route, status='200')
+        queries_before = self.sample('ramen_db_queries_per_request_sum', route)
+        serializer_before = self.sample('ramen_serializer_duration_seconds_count', route)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('ramenlog-list-create'))
+
+        self.assertEqual(self.sample('ramen_http_requests_total', route, status='200'), requests_before + 1)
+        self.assertEqual(self.sample('ramen_db_queries_per_request_sum', route), queries_before + len(queries))
+        self.assertEqual(self.sample('ramen_serializer_duration_seconds_count', route), serializer_before + 1)
+        self.assertGreater(self.sample('ramen_serializer_duration_seconds_sum', route), 0)
+
+        # ルートのないURLは1つのラベルにまとめる
+        self.client.get('/no/such/path/')
+        self.assertGreater(self.sample('ramen_http_requests_total', metrics.UNMATCHED_ROUTE, status='404'), 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('ramenlog-retrieve', args=[RamenLog.objects.get().id]))
+        with override_settings(DEBUG=True):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('ramen_http_request_duration_seconds_bucket{le="0.005",method="GET",route="api/ramen/ramenlog/<int:pk>/"}', body)
+        # /metrics 自体は記録しない
+        self.assertNotIn('route="metrics"', body)
+        with override_settings(METRICS_TOKEN='secret', DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_metrics_endpoint_is_closed_without_token(self):
+        # METRICS_TOKEN を設定していなければ、DEBUG でない限り返さない
+        with override_settings(METRICS_TOKEN='', DEBUG=False):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
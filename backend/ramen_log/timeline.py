@@ -0,0 +1,146 @@
+# ramen_log/timeline.py
+"""
+フォロー中ユーザーのラーメンログのタイムライン。
+
+通常はログ作成時に承認済みフォロワーの TimelineEntry へ書き込み (fan-out-on-write)、
+読み込みは (owner, log) のインデックスの範囲スキャン1回で済ませる。
+フォロワーが TIMELINE_FANOUT_MAX_FOLLOWERS を超えるユーザーは TimelinePullAuthor に登録し、
+そのユーザーのログは読み込み時に RamenLog から直接取得してマージする (fan-out-on-read)。
+"""
+from django.conf import settings
+
+from user_relationships.models import UserRelationship
+
+from .models import RamenLog, TimelineEntry, TimelinePullAuthor
+from .serializers import RAMEN_LOG_LIST_VALUES
+
+# TimelineEntry から values() でログの内容を取得するためのフィールド
+TIMELINE_VALUES = tuple(f'log__{name}' for name in RAMEN_LOG_LIST_VALUES)
+
+
+def _fanout_max_followers():
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 1000)
+
+
+def _approved_follower_ids(author_id, limit=None):
+    follower_ids = UserRelationship.objects.filter(
+        followed_id=author_id,
+        status=UserRelationship.STATUS_APPROVED
+    ).values_list('follower_id', flat=True)
+    if limit is not None:
+        follower_ids = follower_ids[:limit]
+    return list(follower_ids)
+
+
+def fan_out(log):
+    """作成されたログを、作者の承認済みフォロワー全員のタイムラインに書き込む"""
+    fan_out_logs(log.user_id, [log])
+
+
+def fan_out_logs(author_id, logs, batch_size=1000):
+    """
+    fan_out() の一括版。author_id のユーザーが作成したログ (差分同期でまとめて送られたものなど) をまとめて書き込む。
+    フォロワーは1回だけ読み、TimelineEntry は batch_size 行ずつ書き込む。
+    """
+    if not logs or TimelinePullAuthor.objects.filter(user_id=author_id).exists():
+        return
+    max_followers = _fanout_max_followers()
+    follower_ids = _approved_follower_ids(author_id, limit=max_followers + 1)
+    if len(follower_ids) > max_followers:
+        # フォロワーが多すぎる場合は、以後このユーザーのログを読み込み時に取得する
+        TimelinePullAuthor.objects.get_or_create(user_id=author_id)
+        return
+    if not follower_ids:
+        return
+    # 全ログ分の行を一度に作らないよう、batch_size 行ほどになる件数ずつ展開する
+    step = max(batch_size // len(follower_ids), 1)
+    for start in range(0, len(logs), step):
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner_id=follower_id, log_id=log.id, author_id=author_id)
+                for log in logs[start:start + step] for follower_id in follower_ids
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+
+def retract_log(log):
+    """ログをすべてのタイムラインから取り除く"""
+    TimelineEntry.objects.filter(log_id=log.id).delete()
+
+
+def retract_author(owner, author):
+    """アンフォロー時に、相手のログを自分のタイムラインから取り除く"""
+    TimelineEntry.objects.filter(owner=owner, author=author).delete()
+
+
+def backfill_author(owner, author):
+    """フォロー承認時に、相手の最近のログを自分のタイムラインに追加する"""
+    backfill_author_for_owners([owner.id], author)
+
+
+def backfill_followers(author):
+    """
+    インポートの後に、author の最近のログを承認済みフォロワー全員のタイムラインに追加する。
+    インポートしたのは過去の訪問の記録で、ログごとに展開すると (行数 x フォロワー数) の行を書き込み、
+    新しい id でタイムラインの先頭を埋めてしまうため、フォロー承認時と同じく最近の分だけを追加する。
+    """
+    max_followers = _fanout_max_followers()
+    follower_ids = _approved_follower_ids(author.id, limit=max_followers + 1)
+    if len(follower_ids) > max_followers:
+        TimelinePullAuthor.objects.get_or_create(user_id=author.id)
+        return
+    backfill_author_for_owners(follower_ids, author)
+
+
+def backfill_author_for_owners(owner_ids, author):
+    """backfill_author() の一括版。author の最近のログを owner_ids 全員のタイムラインに追加する"""
+    if not owner_ids or TimelinePullAuthor.objects.filter(user_id=author.id).exists():
+        return
+    limit = getattr(settings, 'TIMELINE_BACKFILL_LOGS', 50)
+    log_ids = list(RamenLog.objects.filter(user=author).order_by('-id').values_list('id', flat=True)[:limit])
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner_id=owner_id, log_id=log_id, author_id=author.id)
+            for owner_id in owner_ids for log_id in log_ids
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def read_timeline(owner, before_id=None, limit=50):
+    """
+    タイムラインをログの新しい順 (id の降順) に最大 limit 件返す。
+    before_id を指定すると、その id より古いログだけを返す。
+    各行は RAMEN_LOG_LIST_VALUES をキーに持つ辞書。
+    """
+    entries = TimelineEntry.objects.filter(owner=owner)
+    if before_id is not None:
+        entries = entries.filter(log_id__lt=before_id)
+    rows = [
+        {name: row[f'log__{name}'] for name in RAMEN_LOG_LIST_VALUES}
+        for row in entries.order_by('-log_id').values(*TIMELINE_VALUES)[:limit]
+    ]
+
+    followees = UserRelationship.objects.filter(
+        follower=owner,
+        status=UserRelationship.STATUS_APPROVED
+    ).values('followed_id')
+    pull_author_ids = list(
+        TimelinePullAuthor.objects.filter(user_id__in=followees).values_list('user_id', flat=True)
+    )
+    if pull_author_ids:
+        seen = {row['id'] for row in rows}
+        for author_id in pull_author_ids:
+            pulled = RamenLog.objects.filter(user_id=author_id)
+            if before_id is not None:
+                pulled = pulled.filter(id__lt=before_id)
+            rows += [
+                row for row in pulled.order_by('-id').values(*RAMEN_LOG_LIST_VALUES)[:limit]
+                if row['id'] not in seen
+            ]
+        rows.sort(key=lambda row: row['id'], reverse=True)
+        rows = rows[:limit]
+    return rows
@@ -0,0 +1,67 @@
+# ramen_log/toppings.py
+"""
+自由入力のトッピング (RamenLog.toppings) を、検索用のタグの配列 (RamenLog.topping_tags) に分解する。
+
+「味玉,チャーシュー」「味玉、ﾁｬｰｼｭｰ」「味玉 / チャーシュー」のような入力を同じタグにするため、
+NFKC 正規化と大文字小文字の統一をしてから、区切り文字 (カンマ・読点・スラッシュ・中黒・空白) で分ける。
+topping_tags には GIN インデックスがあり、一覧の ?topping= の絞り込みは配列の包含 (@>) で行う。
+トッピングごとの回数は RamenStatsCounter (kind=topping) で数える (stats.py)。
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.utils import timezone
+
+# タグ1つの最大の長さ (これより長いものは切り詰める)
+MAX_TAG_LENGTH = 50
+_SEPARATORS = re.compile(r'[,、，/／・･\s]+')
+
+
+def normalize_topping(name):
+    """タグ1つを正規化する (空になった場合は '')"""
+    return unicodedata.normalize('NFKC', name).lower().strip()[:MAX_TAG_LENGTH]
+
+
+def parse_toppings(text):
+    """トッピングの文字列をタグのリストにする (重複は除き、入力の順を保つ)"""
+    if not text:
+        return []
+    tags = []
+    for part in _SEPARATORS.split(unicodedata.normalize('NFKC', text)):
+        tag = normalize_topping(part)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def backfill_topping_tags(log_model, batch_size=2000, last_id=0):
+    """
+    toppings からすべてのログの topping_tags を作り直す。id 順に batch_size 件ずつ処理し、
+    処理したログの件数を返す (backfill_toppings コマンドから使う。マイグレーションは当時の処理を写して持つ)。
+    タグが変わったログだけを書き込み、新しい変更番号を割り当てて差分同期のクライアントに変更を届ける。
+    """
+    from .sync import assign_versions
+
+    done = 0
+    while True:
+        logs = list(
+            log_model.objects.filter(id__gt=last_id, toppings__isnull=False)
+            .order_by('id').only('id', 'user_id', 'toppings', 'topping_tags')[:batch_size]
+        )
+        if not logs:
+            return done
+        changed = []
+        for log in logs:
+            tags = parse_toppings(log.toppings)
+            if tags != log.topping_tags:
+                log.topping_tags = tags
+                changed.append(log)
+        now = timezone.now()
+        with transaction.atomic():
+            assign_versions(changed)
+            for log in changed:
+                log.updated_at = now
+            log_model.objects.bulk_update(changed, ['topping_tags', 'sync_version', 'updated_at'], batch_size=batch_size)
+        done += len(logs)
+        last_id = logs[-1].id
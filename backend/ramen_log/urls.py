@@ -1,12 +1,28 @@
 from django.urls import path
 from .views import (
     RamenLogListCreateAPIView,
+    RamenLogImportAPIView,
+    RamenLogExportAPIView,
+    RamenLogSyncAPIView,
     RamenLogRetrieveAPIView,
     RamenLogDestroyAPIView,
+    TimelineAPIView,
+    RamenStatsAPIView,
+    RamenCalendarAPIView,
+    ShopRetrieveAPIView,
+    ShopAutocompleteAPIView,
 )
 
 urlpatterns = [
     path('ramenlog/', RamenLogListCreateAPIView.as_view(), name='ramenlog-list-create'),
+    path('ramenlog/import/', RamenLogImportAPIView.as_view(), name='ramenlog-import'),
+    path('ramenlog/export/', RamenLogExportAPIView.as_view(), name='ramenlog-export'),
+    path('ramenlog/sync/', RamenLogSyncAPIView.as_view(), name='ramenlog-sync'),
     path('ramenlog/<int:pk>/', RamenLogRetrieveAPIView.as_view(), name='ramenlog-retrieve'),
     path('ramenlog/<int:pk>/delete/', RamenLogDestroyAPIView.as_view(), name='ramenlog-delete'),
+    path('timeline/', TimelineAPIView.as_view(), name='ramen-timeline'),
+    path('stats/', RamenStatsAPIView.as_view(), name='ramen-stats'),
+    path('calendar/', RamenCalendarAPIView.as_view(), name='ramen-calendar'),
+    path('shops/autocomplete/', ShopAutocompleteAPIView.as_view(), name='shop-autocomplete'),
+    path('shops/<int:pk>/', ShopRetrieveAPIView.as_view(), name='shop-detail'),
 ]
@@ -1,25 +1,152 @@
-from rest_framework import generics, permissions
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Avg, Count
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import generics, permissions, serializers, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from .models import RamenLog
-from .serializers import RamenLogSerializer
+from .models import RamenLog, Shop
+from .serializers import RamenLogSerializer, ShopSerializer, ShopAutocompleteQuerySerializer, RamenLogListQuerySerializer, RamenCalendarQuerySerializer, RamenLogSyncQuerySerializer, RamenLogSyncSerializer, RamenLogImportSerializer, RamenLogExportQuerySerializer, RAMEN_LOG_LIST_VALUES, serialize_ramen_log_rows
+from .pagination import RamenLogCursorPagination, TimelineCursorPagination
+from . import exporters, importers, shops, stats, sync, timeline, visit_calendar
 from .nulldata import default_ramen_log
+from .toppings import parse_toppings
+from users import versions
 
-class RamenLogListCreateAPIView(generics.ListCreateAPIView):
+class RamenLogListCreateAPIView(versions.ConditionalListMixin, generics.ListCreateAPIView):
     serializer_class = RamenLogSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # カーソル (?cursor=) によるキーセットページネーション
+    pagination_class = RamenLogCursorPagination
+    # 一覧は ETag による条件付き GET に対応する
+    version_resource = versions.Resource.RAMEN_LOGS
 
     def get_queryset(self):
-        """認証されたユーザーのログのみを返す"""
-        return RamenLog.objects.filter(user=self.request.user).order_by('-visited_at')
+        """認証されたユーザーのログのみを返す (並び順はページネーションで決まる)"""
+        queryset = RamenLog.objects.filter(user=self.request.user)
+        if self.request.method == 'GET':
+            queryset = self.filter_list(queryset)
+        return queryset
+
+    def filter_list(self, queryset):
+        """
+        一覧のクエリパラメータ (RamenLogListQuerySerializer) で絞り込む。
+        どの条件も user から始まる複合インデックス (トッピングは GIN) で読めるようにしてある。
+        """
+        query = RamenLogListQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        if 'rating_min' in params:
+            queryset = queryset.filter(rating__gte=params['rating_min'])
+        if 'rating_max' in params:
+            queryset = queryset.filter(rating__lte=params['rating_max'])
+        if 'visited_after' in params:
+            queryset = queryset.filter(visited_at__gte=params['visited_after'])
+        if 'visited_before' in params:
+            queryset = queryset.filter(visited_at__lt=params['visited_before'])
+        if 'shop' in params:
+            queryset = queryset.filter(shop_id=params['shop'])
+        if 'shop_name' in params:
+            # 表記ゆれをまとめた店 (Shop.name_key は unique) に絞る
+            queryset = queryset.filter(shop__name_key=shops.normalize_shop_name(params['shop_name']))
+        if 'noodle_hardness' in params:
+            queryset = queryset.filter(noodle_hardness=params['noodle_hardness'].strip())
+        tags = [tag for value in params.get('topping', []) for tag in parse_toppings(value)]
+        if tags:
+            # topping_tags の GIN インデックスを使う
+            queryset = queryset.filter(topping_tags__contains=tags)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """一覧は values() の行から直接組み立てる (行ごとのユーザー取得やフィールド走査を避ける)"""
+        queryset = self.filter_queryset(self.get_queryset()).values(*RAMEN_LOG_LIST_VALUES)
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(serialize_ramen_log_rows(page))
 
     def perform_create(self, serializer):
-        """ログ作成時にリクエストユーザーを自動で割り当てる"""
-        serializer.save(user=self.request.user)
+        """ログ作成時にリクエストユーザーと店を自動で割り当て、フォロワーのタイムラインに展開する"""
+        # 集計の更新が途中で失敗しても、集計に含まれないログだけが残ることのないようにする
+        with transaction.atomic():
+            shop_id = shops.resolve_shop_id(serializer.validated_data['shop_name'])
+            log = serializer.save(user=self.request.user, shop_id=shop_id)
+            stats.record_created(log.user_id, [log])
+            visit_calendar.invalidate(log.user_id, [log])
+            shops.record_visits([log.shop_id])
+            timeline.fan_out(log)
+        versions.bump(log.user_id, versions.Resource.RAMEN_LOGS)
+
+# 一括インポート用ビュー
+class RamenLogImportAPIView(generics.GenericAPIView):
+    """
+    CSV / NDJSON ファイルからラーメンログをまとめて登録するAPI。
+    ファイルは1行ずつ読み込み、batch_size 件ごとに bulk_create で書き込む。
+    レスポンスには作成件数と、失敗した行 (文字コードが合わない行を含む) の行番号・エラー内容を含める。
+    """
+    serializer_class = RamenLogImportSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        file_format = serializer.validated_data.get('file_format') or importers.guess_format(upload.name, upload.content_type)
+        if file_format is None:
+            return Response({'detail': 'ファイル形式を判定できません。file_format を指定してください。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = importers.import_logs(
+                request.user,
+                importers.iter_records(upload.file, file_format, serializer.validated_data['encoding']),
+                batch_size=serializer.validated_data['batch_size'],
+            )
+        except importers.ImportFileError as exc:
+            # ヘッダー行で止まるため、まだ何も書き込んでいない
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if report.created == 0 and report.failed:
+            return Response(report.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict(), status=status.HTTP_201_CREATED)
+
+# エクスポート用ビュー
+class RamenLogExportAPIView(generics.GenericAPIView):
+    """
+    自分のラーメンログ全件を CSV / NDJSON でダウンロードするAPI。
+    サーバーサイドカーソルで少しずつ読み出してストリーミングで返すため、件数が多くてもメモリを圧迫しない
+    (ASGI では非同期イテレーターで返す。ダウンロード中の接続は通常のリクエストとは別の枠で数える
+    (settings.ASGI_PATH_CONCURRENCY_LIMITS))。
+    ?gzip=true で gzip 圧縮したファイルを返す。
+    """
+    serializer_class = RamenLogExportQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        file_format = serializer.validated_data['file_format']
+        gzip = serializer.validated_data['gzip']
+
+        filename = f'ramen_logs.{file_format}'
+        if gzip:
+            filename += '.gz'
+            content_type = 'application/gzip'
+        else:
+            content_type = exporters.CONTENT_TYPES[file_format]
+        content = exporters.stream_export(request.user, file_format, gzip=gzip)
+        if isinstance(request._request, ASGIRequest):
+            content = exporters.aiter_chunks(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
 class RamenLogRetrieveAPIView(generics.RetrieveAPIView):
     serializer_class = RamenLogSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        """認証されたユーザーのログのみを取得可能にする"""
+        return RamenLog.objects.filter(user=self.request.user)
+
     def get(self, request, *args, **kwargs):
         instance = self.get_object()
         # visited_at が None の場合は初期データを返す
@@ -36,3 +163,116 @@ class RamenLogDestroyAPIView(generics.DestroyAPIView):
     def get_queryset(self):
         """認証されたユーザーのログのみを削除可能にする"""
         return RamenLog.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        """ログを削除し、統計から差し引いてフォロワーのタイムラインからも取り除く (差分同期用に墓標を残す)"""
+        with transaction.atomic():
+            timeline.retract_log(instance)
+            stats.record_deleted(instance.user_id, [instance])
+            visit_calendar.invalidate(instance.user_id, [instance])
+            shops.record_visits([instance.shop_id], sign=-1)
+            sync.record_deleted(instance)
+            instance.delete()
+        versions.bump(instance.user_id, versions.Resource.RAMEN_LOGS)
+
+# 差分同期
+class RamenLogSyncAPIView(generics.GenericAPIView):
+    """
+    オフライン対応のアプリ向けに、前回の同期 (?token=) から作成・更新・削除されたログだけを返すAPI。
+    POST ではオフラインで作成したログ (client_key 付き) をまとめて送り、作成結果と差分を1回で受け取れる。
+    レスポンスの token を次の同期で送る。has_more が True なら続けて取得し、reset が True なら全件を取り直す。
+    """
+    serializer_class = RamenLogSyncSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = RamenLogSyncQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        return Response(sync.changes(request.user.id, self.read_token(params), params['limit']))
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # 先にトークンを確かめてから作成する
+        since = self.read_token(serializer.validated_data)
+        created = sync.push(request.user, serializer.validated_data['logs'])
+        data = sync.changes(request.user.id, since, serializer.validated_data['limit'])
+        return Response({**data, 'created': created})
+
+    def read_token(self, params):
+        try:
+            return sync.read_token(self.request.user.id, params.get('token'))
+        except sync.InvalidToken as exc:
+            raise serializers.ValidationError({'token': [str(exc)]})
+
+# フォロー中ユーザーのラーメンログのタイムライン
+class TimelineAPIView(generics.GenericAPIView):
+    """
+    承認済みでフォローしているユーザーのラーメンログを新しい順に返すAPI。
+    カーソル (?cursor=) によるページネーションで、レスポンスは一覧APIと同じ形式。
+    """
+    serializer_class = RamenLogSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TimelineCursorPagination
+
+    def get(self, request, *args, **kwargs):
+        page = self.paginator.paginate_timeline(request, request.user)
+        return self.paginator.get_paginated_response(serialize_ramen_log_rows(page))
+
+# ラーメン統計
+class RamenStatsAPIView(generics.GenericAPIView):
+    """
+    自分のラーメン統計 (訪問回数、訪問した店の数、平均評価、一番多い注文、好きな麺の硬さ、トッピングの回数) を返すAPI。
+    集計済みの RamenStats を読むだけなので、ログの件数に関係なく一定のコストで返せる。
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(stats.summary(request.user))
+
+# 訪問カレンダー
+class RamenCalendarAPIView(generics.GenericAPIView):
+    """
+    自分の訪問カレンダー (?year= の年の、月ごとの訪問回数・平均評価と日ごとの訪問回数) を返すAPI。
+    終わった月は保存済みの集計 (RamenCalendarMonth) を読み、ログを集計するのは今月と保存のない月だけ。
+    """
+    serializer_class = RamenCalendarQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        year = serializer.validated_data.get('year') or timezone.localdate().year
+        return Response({'year': year, 'months': visit_calendar.year_calendar(request.user.id, year)})
+
+# 店の情報
+class ShopRetrieveAPIView(generics.RetrieveAPIView):
+    """
+    店の情報と、全ユーザーのログから集計した訪問回数・平均評価を返すAPI。
+    集計は RamenLog.shop (外部キーのインデックス) による絞り込みで行う。
+    """
+    serializer_class = ShopSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    queryset = Shop.objects.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        shop = self.get_object()
+        totals = RamenLog.objects.filter(shop=shop).aggregate(visit_count=Count('id'), average_rating=Avg('rating'))
+        shop.visit_count = totals['visit_count']
+        shop.average_rating = totals['average_rating']
+        return Response(self.get_serializer(shop).data)
+
+# 店名のオートコンプリート
+class ShopAutocompleteAPIView(generics.GenericAPIView):
+    """
+    入力中の店名 (?q=) を含む店の候補を返すAPI。前方一致する店を先に、訪問回数の多い順に並べる。
+    店名の n-gram (Shop.name_grams) の GIN インデックスで候補を絞るため、ログの件数に関係なく高速に返せる。
+    """
+    serializer_class = ShopAutocompleteQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(shops.autocomplete(serializer.validated_data['q'], limit=serializer.validated_data['limit']))
@@ -0,0 +1,141 @@
+# ramen_log/visit_calendar.py
+"""
+プロフィールの訪問カレンダー (日ごとの訪問回数と、月ごとの訪問回数・平均評価)。
+
+終わった月の集計は変わらないため RamenCalendarMonth に保存しておき、読み込み時に計算するのは
+保存のない月と今月以降だけにする (計算は (user, visited_at) のインデックスの範囲スキャン1回)。
+ログが作成・削除されたら、その訪問日時の月の行を invalidate() で削除する。
+月と日の区切りは TIME_ZONE で決める。
+
+計算中にログが変わると、コミット後の削除 (invalidate) より後に古い集計を保存してしまうことがあるため、
+保存はログの変更番号 (RamenLogSyncCounter。ログの書き込みと同じトランザクションで進み、コミットまで行をロックする) が
+計算前から変わっていないときだけ行う。計算もレプリカの遅延を避けて primary から読む。
+"""
+from datetime import date, datetime
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import RamenCalendarMonth, RamenLog, RamenLogSyncCounter
+
+
+def month_of(value):
+    """日時 (または日付) の月の初日"""
+    if hasattr(value, 'hour'):
+        value = timezone.localtime(value)
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _month_start(month):
+    return timezone.make_aware(datetime(month.year, month.month, 1))
+
+
+def invalidate(user_id, logs):
+    """
+    作成・削除されたログ (同じユーザーのもの) の訪問日時の月の集計を、コミット後に削除する。
+    コミット前に削除すると、その間に変更前のログから計算した集計が保存されて残ってしまうため。
+    """
+    months = {month_of(log.visited_at) for log in logs if log.visited_at is not None}
+    if months:
+        transaction.on_commit(
+            lambda: RamenCalendarMonth.objects.filter(user_id=user_id, month__in=months).delete()
+        )
+
+
+def _compute(user_id, months):
+    """months (月の初日の一覧) の集計を RamenCalendarMonth (未保存) の辞書で返す"""
+    result = {month: RamenCalendarMonth(user_id=user_id, month=month, days={}) for month in months}
+    # 続いている月はまとめて1つの範囲にする
+    ranges = []
+    for month in sorted(months):
+        if ranges and ranges[-1][1] == month:
+            ranges[-1][1] = next_month(month)
+        else:
+            ranges.append([month, next_month(month)])
+    in_ranges = Q()
+    for start, end in ranges:
+        in_ranges |= Q(visited_at__gte=_month_start(start), visited_at__lt=_month_start(end))
+    rows = (
+        RamenLog.objects.using(DEFAULT_DB_ALIAS).filter(in_ranges, user_id=user_id)
+        .annotate(day=TruncDate('visited_at'))
+        .values('day')
+        .annotate(visits=Count('id'), rating_count=Count('rating'), rating_sum=Sum('rating'))
+        .order_by()
+    )
+    for row in rows:
+        entry = result[month_of(row['day'])]
+        entry.days[str(row['day'].day)] = row['visits']
+        entry.visit_count += row['visits']
+        entry.rating_count += row['rating_count']
+        entry.rating_sum += row['rating_sum'] or 0
+    return result
+
+
+def year_calendar(user_id, year):
+    """year 年の12か月分の集計を返す (保存のない終わった月は、計算して保存する)"""
+    months = [date(year, number, 1) for number in range(1, 13)]
+    current = month_of(timezone.now())
+    stored = {
+        entry.month: entry
+        for entry in RamenCalendarMonth.objects.filter(user_id=user_id, month__in=months)
+        if entry.month < current
+    }
+    missing = [month for month in months if month not in stored]
+    if missing:
+        version = _change_version(user_id)
+        computed = _compute(user_id, missing)
+        closed = [entry for month, entry in computed.items() if month < current]
+        if closed:
+            _store(user_id, closed, version)
+        stored.update(computed)
+    return [_as_dict(stored[month]) for month in months]
+
+
+def _change_version(user_id):
+    """ユーザーのログの変更番号を primary から読む (カウンターの行がなければ作る)"""
+    counters = RamenLogSyncCounter.objects.using(DEFAULT_DB_ALIAS)
+    version = counters.filter(user_id=user_id).values_list('version', flat=True).first()
+    if version is None:
+        # 同時に作られた場合は番号が合わず、今回は保存しないだけになる
+        counters.bulk_create([RamenLogSyncCounter(user_id=user_id)], ignore_conflicts=True)
+        version = 0
+    return version
+
+
+def _store(user_id, entries, version):
+    """
+    変更番号が version のままであれば entries を保存し、保存したかどうかを返す。
+    カウンターの行を FOR SHARE でロックするため、書き込み中のトランザクションがあればそのコミットを待ってから比べ、
+    保存した後に始まった書き込みは、この保存のコミット後に invalidate() で保存した行を削除する。
+    """
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                f'SELECT version FROM {RamenLogSyncCounter._meta.db_table} WHERE user_id = %s FOR SHARE', [user_id]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] != version:
+            return False
+        # 同時に計算した別のリクエストと重なっても、どちらかの行が残ればよい
+        RamenCalendarMonth.objects.using(DEFAULT_DB_ALIAS).bulk_create(entries, ignore_conflicts=True)
+    return True
+
+
+def _as_dict(entry):
+    average = entry.rating_sum / entry.rating_count if entry.rating_count else None
+    return {
+        'month': entry.month.strftime('%Y-%m'),
+        'visit_count': entry.visit_count,
+        'rating_count': entry.rating_count,
+        'average_rating': None if average is None else round(float(average), 2),
+        'days': {
+            f'{entry.month:%Y-%m}-{int(day):02d}': count
+            for day, count in sorted(entry.days.items(), key=lambda item: int(item[0]))
+        },
+    }
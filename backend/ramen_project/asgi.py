@@ -9,8 +9,21 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
+from ramen_project.middleware import ConcurrencyLimitMiddleware
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ramen_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from user_relationships.ikitai_events import EventStreamMiddleware  # noqa: E402 (アプリの読み込み後に import する)
+
+# Django に同時に渡すリクエストの数 (= スレッドとDB接続の数) をプロセスごとに制限する (エクスポートは別の枠)
+# 「ラーメンイキタイ」の通知の SSE (接続したままになる) は、制限の外で Django を通さずに処理する
+application = EventStreamMiddleware(
+    ConcurrencyLimitMiddleware(
+        django_application, settings.ASGI_MAX_CONCURRENT_REQUESTS, settings.ASGI_PATH_CONCURRENCY_LIMITS,
+    )
+)
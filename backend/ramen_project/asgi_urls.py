@@ -0,0 +1,25 @@
+"""
+ASGI で動かすときの URL 設定 (ramen_project.middleware.asgi_urlconf_middleware が切り替える)。
+
+よく呼ばれる読み取りAPIを非同期版のビューに差し替え、それ以外は ramen_project.urls と同じ。
+非同期版も書き込みなどは同期版のビューで処理するため、URL とレスポンスは WSGI と変わらない。
+"""
+from django.urls import path
+
+from ramen_log.async_views import AsyncRamenLogListCreateView
+from user_relationships.async_views import (
+    AsyncFollowingListView,
+    AsyncFollowerListView,
+    AsyncPendingFollowRequestListView,
+    AsyncIkitaiStatusView,
+)
+
+from . import urls
+
+urlpatterns = [
+    path('api/ramen/ramenlog/', AsyncRamenLogListCreateView.as_view()),
+    path('api/relationships/following/', AsyncFollowingListView.as_view()),
+    path('api/relationships/followers/', AsyncFollowerListView.as_view()),
+    path('api/relationships/pending-requests/', AsyncPendingFollowRequestListView.as_view()),
+    path('api/relationships/ikitai/', AsyncIkitaiStatusView.as_view()),
+] + urls.urlpatterns
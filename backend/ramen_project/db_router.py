@@ -0,0 +1,104 @@
+"""
+リードレプリカへの読み込みの振り分け (settings.DATABASE_ROUTERS)。
+
+- 安全なメソッド (GET / HEAD / OPTIONS) のリクエストの読み込みは、DATABASE_REPLICAS のどれか1つに送る
+  (同じリクエストの中では同じレプリカを使う)。
+- 書き込みは常に primary (default) に送る。書き込んだリクエストでは、それ以降の読み込みも primary に送る。
+  トランザクション中の読み込みも primary に送る。
+- 書き込みのあったユーザーは REPLICA_STICKY_SECONDS 秒の間、読み込みも primary に送る
+  (レプリカの遅延で、自分の書き込みが一覧に出てこないことを防ぐ)。
+  この記録には Django のキャッシュを使うため、複数のプロセス・サーバーで共有できるキャッシュ (REDIS_URL で設定する Redis)
+  が必要になる。レプリカを設定してプロセス内のキャッシュ (LocMemCache など) のままにしていると、
+  システムチェック (check_sticky_cache) がエラーにする (ワーカーごとに記録が分かれ、自分の書き込みが見えなくなるため)。
+
+リクエストの外 (管理コマンドなど) の読み込みは primary のまま。
+リクエストごとの状態は replica_routing_middleware が作り、ユーザーは認証したときに bind_user() で設定する。
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# プロセスの間で共有されないキャッシュ
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+
+class RoutingState:
+    """リクエストごとの振り分けの状態"""
+
+    def __init__(self, replica):
+        # このリクエストの読み込みに使うレプリカ (None なら primary)
+        self.replica = replica
+        self.user_id = None
+        self.wrote = False
+
+
+def begin_request(method):
+    """リクエストの開始時に状態を作る。end_request() に渡すトークンを返す"""
+    replicas = settings.DATABASE_REPLICAS
+    replica = random.choice(replicas) if replicas and method in SAFE_METHODS else None
+    return _state.set(RoutingState(replica))
+
+
+def end_request(token):
+    """リクエストの終了時に、書き込みのあったユーザーを記録して状態を破棄する"""
+    state = _state.get()
+    _state.reset(token)
+    if state is not None and state.wrote and state.user_id is not None:
+        cache.set(_sticky_key(state.user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def bind_user(user_id):
+    """認証したユーザーを設定する。直前に書き込みのあったユーザーであれば、読み込みを primary に戻す"""
+    state = _state.get()
+    if state is None:
+        return
+    state.user_id = user_id
+    if state.replica is not None and cache.get(_sticky_key(user_id)):
+        state.replica = None
+
+
+def _sticky_key(user_id):
+    return f'db_router:sticky:{user_id}'
+
+
+@checks.register(checks.Tags.caches)
+def check_sticky_cache(app_configs, **kwargs):
+    """レプリカを使うときに、書き込みのあったユーザーの記録がプロセス内のキャッシュになっていないか確認する"""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DATABASE_REPLICAS and backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            f'DATABASE_REPLICAS を設定していますが、キャッシュ ({backend}) がプロセスの間で共有されません。',
+            hint='REDIS_URL を設定して、書き込みのあったユーザーの記録を全ワーカーで共有してください。',
+            id='ramen_project.E001',
+        )]
+    return []
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカは primary と同じデータを持つため、どのエイリアスのオブジェクト同士でも関連付けてよい
+        return True
@@ -0,0 +1,160 @@
+"""
+Prometheus 形式のメトリクス (/metrics)。
+
+metrics_middleware (ramen_project/middleware.py) がリクエストごとに、URL のルート
+(例: 'api/ramen/ramenlog/<int:pk>/') とメソッドごとに次の値を記録する。
+- ramen_http_requests_total: リクエスト数 (ステータスごと)
+- ramen_http_request_duration_seconds: レスポンスを返すまでの時間
+- ramen_db_queries_per_request / ramen_db_duration_seconds: 1リクエストの SQL の数と、その合計時間
+- ramen_serializer_duration_seconds: シリアライズ (DRF のシリアライザの .data と、@timed_serialization を
+  付けた一覧用の関数) の時間。中で実行された SQL の時間は除く
+
+値の集計は prometheus_client で行う。複数のワーカープロセスで動かすときは、環境変数
+PROMETHEUS_MULTIPROC_DIR に全ワーカーで共有するディレクトリ (起動前に空にしておく) を指定すると、
+各プロセスがロックなしで自分のファイル (mmap) に書き込み、/metrics はそれらを合算して返す。
+指定しなければプロセスごとのメモリ上で集計する (runserver など1プロセスのとき)。
+"""
+import contextvars
+import functools
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from rest_framework import serializers
+
+LABELS = ('method', 'route')
+# 一致するルートのないリクエスト (404) のラベル。URL をそのままラベルにすると種類が増え続けるため
+UNMATCHED_ROUTE = '<unmatched>'
+
+REQUESTS = Counter('ramen_http_requests', 'HTTP リクエスト数', LABELS + ('status',))
+REQUEST_DURATION = Histogram(
+    'ramen_http_request_duration_seconds', 'レスポンスを返すまでの時間', LABELS,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    'ramen_db_queries_per_request', '1リクエストで実行した SQL の数', LABELS,
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_DURATION = Histogram(
+    'ramen_db_duration_seconds', '1リクエストで SQL の実行にかかった時間の合計', LABELS,
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+SERIALIZER_DURATION = Histogram(
+    'ramen_serializer_duration_seconds', '1リクエストでシリアライズにかかった時間の合計 (SQL の時間を除く)', LABELS,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+class RequestStats:
+    """処理中のリクエストの SQL とシリアライズの集計"""
+    __slots__ = ('queries', 'db_seconds', 'serializer_seconds', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        # ネストしたシリアライズ (.data の中の @timed_serialization など) を二重に数えないため
+        self.serializing = False
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def begin_request():
+    """リクエストの集計を始める。end_request() に渡すトークンを返す"""
+    return _current.set(RequestStats())
+
+
+def end_request(token, request, response, duration):
+    """リクエストの集計を終えて、メトリクスに記録する"""
+    stats = _current.get()
+    _current.reset(token)
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.url_name == 'metrics':
+        return
+    route = match.route if match is not None else UNMATCHED_ROUTE
+    method = request.method
+    REQUESTS.labels(method, route, str(response.status_code)).inc()
+    REQUEST_DURATION.labels(method, route).observe(duration)
+    DB_QUERIES.labels(method, route).observe(stats.queries)
+    DB_DURATION.labels(method, route).observe(stats.db_seconds)
+    SERIALIZER_DURATION.labels(method, route).observe(stats.serializer_seconds)
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_seconds += time.perf_counter() - start
+        stats.queries += 1
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    # 接続ごとに1度だけ登録する (プールから同じ DatabaseWrapper に接続し直したときも重ならないように)
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def timed_serialization(function):
+    """関数の実行時間を、処理中のリクエストのシリアライズの時間に加えるデコレーター"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stats = _current.get()
+        if stats is None or stats.serializing:
+            return function(*args, **kwargs)
+        stats.serializing = True
+        start = time.perf_counter()
+        db_seconds = stats.db_seconds
+        try:
+            return function(*args, **kwargs)
+        finally:
+            # 遅延評価のクエリセットを渡された場合などに、中で実行された SQL の時間は除く
+            stats.serializer_seconds += time.perf_counter() - start - (stats.db_seconds - db_seconds)
+            stats.serializing = False
+    return wrapper
+
+
+_installed = False
+
+
+def install():
+    """SQL とシリアライザの計測を組み込む (metrics_middleware の初期化時に1度だけ呼ばれる)"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(_install_query_counter, dispatch_uid='ramen_project.metrics')
+    for connection in connections.all(initialized_only=True):
+        _install_query_counter(None, connection)
+    # ModelSerializer などの .data (Serializer.data / ListSerializer.data はどちらもここを通る)
+    data = serializers.BaseSerializer.data
+    serializers.BaseSerializer.data = property(timed_serialization(data.fget))
+
+
+def metrics_view(request):
+    """
+    Prometheus のスクレイプ用のビュー。METRICS_TOKEN の Bearer トークンを要求する。
+    METRICS_TOKEN が空の場合は、DEBUG のときだけ認証なしで返し、それ以外は 403 を返す
+    (ルートごとのトラフィックや DB の負荷を外部に公開しないため)。
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,100 @@
+"""
+ASGI で動かすときのミドルウェア。
+
+- ConcurrencyLimitMiddleware (ASGI のミドルウェア、asgi.py で使う):
+  Django に渡すリクエストの数を、プロセスごとに ASGI_MAX_CONCURRENT_REQUESTS までに制限する。
+  Django 4.2 の ASGI ではリクエストごとにスレッドとDB接続が作られるため、制限しないと
+  同時接続数の分だけスレッドが増え (GIL の奪い合いでイベントループが進まなくなる)、
+  Postgres の接続 (max_connections) も使い切ってしまう。
+  枠はレスポンスを送り終えて接続が閉じられてから返すため、1プロセスの接続数は上限を超えない。
+  上限を超えたリクエストは、スレッドもDB接続も使わずに順番を待つ。
+  ダウンロードのように長く続くリクエストは、path_limits (ASGI_PATH_CONCURRENCY_LIMITS) でパスごとの別の枠にし、
+  通常のリクエストの枠を使い切らないようにする。
+
+- asgi_urlconf_middleware (Django のミドルウェア):
+  URL 設定を ASGI_ROOT_URLCONF (よく呼ばれるAPIを非同期版にしたもの) に切り替える。
+  WSGI (同期のミドルウェアチェーン) では何もしない。
+
+- replica_routing_middleware (Django のミドルウェア):
+  リクエストごとに、リードレプリカへの振り分けの状態を作る (ramen_project/db_router.py)。
+
+- metrics_middleware (Django のミドルウェア):
+  リクエストごとの時間・SQL の数と時間・シリアライズの時間を記録する (ramen_project/metrics.py)。
+"""
+import asyncio
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from . import db_router, metrics
+
+
+class ConcurrencyLimitMiddleware:
+    def __init__(self, app, limit, path_limits=None):
+        self.app = app
+        self.limit = limit
+        self.path_limits = dict(path_limits or {})
+        self._slots = None
+        self._path_slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        if self._slots is None:
+            # イベントループの中で作る (ワーカーのプロセスごとにループが作られるため)
+            self._slots = asyncio.Semaphore(self.limit)
+            self._path_slots = {path: asyncio.Semaphore(limit) for path, limit in self.path_limits.items()}
+        async with self._path_slots.get(scope['path'], self._slots):
+            return await self.app(scope, receive, send)
+
+
+@sync_and_async_middleware
+def asgi_urlconf_middleware(get_response):
+    if not iscoroutinefunction(get_response):
+        return get_response
+
+    async def middleware(request):
+        request.urlconf = settings.ASGI_ROOT_URLCONF
+        return await get_response(request)
+    return middleware
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = db_router.begin_request(request.method)
+            try:
+                return await get_response(request)
+            finally:
+                db_router.end_request(token)
+    else:
+        def middleware(request):
+            token = db_router.begin_request(request.method)
+            try:
+                return get_response(request)
+            finally:
+                db_router.end_request(token)
+    return middleware
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    metrics.install()
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = metrics.begin_request()
+            start = time.perf_counter()
+            response = await get_response(request)
+            metrics.end_request(token, request, response, time.perf_counter() - start)
+            return response
+    else:
+        def middleware(request):
+            token = metrics.begin_request()
+            start = time.perf_counter()
+            response = get_response(request)
+            metrics.end_request(token, request, response, time.perf_counter() - start)
+            return response
+    return middleware
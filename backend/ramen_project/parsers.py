@@ -0,0 +1,15 @@
+"""MessagePack のリクエストの本文 (Content-Type: application/msgpack) を読む DRF のパーサー (renderers.py を参照)"""
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        # マップのキーに配列やマップがあると (Python の dict のキーにできず) TypeError になる
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError(f'MessagePack の形式が正しくありません: {exc}')
@@ -0,0 +1,136 @@
+"""
+DB接続を使い回す PostgreSQL のバックエンド (ENGINE = 'ramen_project.postgresql_pool')。
+
+Django 4.2 の ASGI では、接続はリクエスト (コンテキスト) ごとに作られ、CONN_MAX_AGE による持続接続も使えない。
+Postgres の接続はプロセスの fork を伴うため、毎回つなぎ直すとリクエストごとに数 ms かかる。
+このバックエンドは、閉じられた接続をプロセス内のプールに戻し、次の接続で使い回す。
+プールに残すのは POOL_SIZE 件までで、足りなければ新しく接続する (同時に使う接続の数は
+ConcurrencyLimitMiddleware で制限する)。ASGI のプロファイルだけで使う (settings.DATABASES を参照)。
+
+戻すときに、トランザクションの途中であればロールバックし、状態の分からない (壊れた) 接続や
+ロールバックに失敗した接続は閉じる。取り出すときには SELECT 1 で接続が生きているか確かめ、
+Postgres の再起動やアイドル接続のタイムアウトで切れた接続は捨てて次の接続を使う。
+"""
+import threading
+
+import psycopg2
+from django.db.backends.postgresql import base, creation
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+DEFAULT_POOL_SIZE = 20
+
+
+class ConnectionPool:
+    """接続先ごとの、使われていない接続の置き場所"""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self, connect):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection = self._idle.pop()
+            # 確認のクエリはロックの外で行う (他のスレッドの取り出しを待たせない)
+            if self._is_usable(connection):
+                return connection
+            _close_quietly(connection)
+        return connect()
+
+    def put(self, connection):
+        if connection.closed:
+            return
+        try:
+            status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                raise psycopg2.InterfaceError('connection is in an unknown state')
+            if status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            # 壊れた接続はプールに戻さずに閉じる (接続を返す側にはエラーにしない)
+            _close_quietly(connection)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        _close_quietly(connection)
+
+    @staticmethod
+    def _is_usable(connection):
+        if connection.closed or connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                # autocommit でない接続では、確認のクエリでトランザクションが始まる
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except psycopg2.Error:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_for(key, size):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(size)
+        return pool
+
+
+def clear_pools():
+    """プールにある接続をすべて閉じる (データベースを削除する前など)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.clear()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # プールに残っている、テスト用データベースへの接続を閉じてから削除する
+        clear_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    connection_pool = None
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('POOL_SIZE', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        # テストでは同じ alias の接続先 (NAME) が変わるため、プールは接続のパラメータごとに分ける
+        key = (self.alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+        self.connection_pool = _pool_for(key, self.settings_dict['OPTIONS'].get('POOL_SIZE', DEFAULT_POOL_SIZE))
+        connect = super().get_new_connection
+        return self.connection_pool.get(lambda: connect(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.connection_pool.put(self.connection)
@@ -0,0 +1,68 @@
+"""
+APIのレスポンスの形式 (DRF のコンテントネゴシエーションで Accept ヘッダーから選ぶ)。
+
+- application/json: これまでどおりの JSON
+- application/msgpack: MessagePack。JSON より小さく、モバイルでのデコードも速い (?format=msgpack でも選べる)
+
+どちらも Accept のパラメータに users=ref を付けると (例: Accept: application/msgpack; users=ref)、
+レスポンス中のユーザー (UserSerializer の形の辞書) を1人1回だけ users に入れ、元の位置には id を入れる。
+フォロー関係の一覧のように同じユーザーが何度も出てくるレスポンスが小さくなる。
+    {"users": [{"id": 1, "username": ..., ...}, ...], "data": <元のレスポンス (ユーザーは id)>}
+リクエストの本文を MessagePack で送る場合は Content-Type: application/msgpack を指定する (parsers.py)。
+"""
+import msgpack
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.mediatypes import _MediaType
+
+from users.serializers import UserSerializer
+
+USER_FIELDS = frozenset(UserSerializer.Meta.fields)
+USER_REFERENCE_PARAM = 'users'
+
+
+def wants_user_references(accepted_media_type):
+    return bool(accepted_media_type) and _MediaType(accepted_media_type).params.get(USER_REFERENCE_PARAM) == 'ref'
+
+
+def reference_users(data):
+    """data の中のユーザーを id に置き換え、{'users': [ユーザー], 'data': 置き換えた data} を返す"""
+    users = {}
+
+    def replace(value):
+        if isinstance(value, dict):
+            if value.keys() == USER_FIELDS:
+                users.setdefault(value['id'], value)
+                return value['id']
+            return {key: replace(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [replace(item) for item in value]
+        return value
+
+    data = replace(data)
+    return {'users': list(users.values()), 'data': data}
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF の JSONRenderer に users=ref の指定を加えたもの"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is not None and wants_user_references(accepted_media_type):
+            data = reference_users(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    # 日時や Decimal などは JSON と同じ表現 (文字列など) にする
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if wants_user_references(accepted_media_type):
+            data = reference_users(data)
+        return msgpack.packb(data, default=self.encoder.default, use_bin_type=True)
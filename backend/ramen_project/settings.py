@@ -49,6 +49,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # ルートごとのリクエスト数・時間・SQL の数と時間を記録し、/metrics で返す (ramen_project/metrics.py)
+    'ramen_project.middleware.metrics_middleware',
+    # ASGI で動かすときだけ、よく呼ばれるAPIを非同期版のビューに切り替える (WSGI では何もしない)
+    'ramen_project.middleware.asgi_urlconf_middleware',
+    # 安全なメソッドのリクエストの読み込みをリードレプリカに振り分ける (ramen_project/db_router.py)
+    'ramen_project.middleware.replica_routing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', # CORS対応のため追加
@@ -79,11 +85,23 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ramen_project.wsgi.application'
 
+# ASGI (uvicorn) で動かすときの URL 設定。よく呼ばれる読み取りAPIが非同期版になる
+ASGI_ROOT_URLCONF = 'ramen_project.asgi_urls'
+# ASGI で1プロセスが同時に処理するリクエスト数の上限 (= 1プロセスが使うDB接続数の上限)
+# ワーカー数 x (この値 + ASGI_PATH_CONCURRENCY_LIMITS の合計) が Postgres の max_connections (既定 100) を超えないようにする
+ASGI_MAX_CONCURRENT_REQUESTS = 20
+# 長く続くリクエストの、パスごとの同時処理数の上限 (ASGI_MAX_CONCURRENT_REQUESTS の枠とは別に数える)
+# エクスポートはダウンロードが終わるまでDB接続 (サーバーサイドカーソル) を使い続けるため、通常のAPIの枠を使わせない
+ASGI_PATH_CONCURRENCY_LIMITS = {
+    '/api/ramen/ramenlog/export/': 4,
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 # PostgreSQL を使用するように設定を変更
+# 接続はプロセス内のプールで使い回す (ramen_project/postgresql_pool/base.py)
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -92,8 +110,45 @@ DATABASES = {
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': 'db',  # docker-compose.yml のサービス名
         'PORT': '5432',
+        # WSGI ではスレッドごとの持続接続を使い、使い回す前に接続が生きているか確かめる
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# ASGI では CONN_MAX_AGE の持続接続が使えないため、接続をプロセス内のプールで使い回す
+# (docker-compose.yml の backend-asgi で DATABASE_CONNECTION_POOL=1 を設定する)
+if os.environ.get('DATABASE_CONNECTION_POOL') == '1':
+    DATABASES['default'].update({
+        'ENGINE': 'ramen_project.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': False,
+        # プールに残しておく接続の数 (ASGI_MAX_CONCURRENT_REQUESTS と同じにする)
+        'OPTIONS': {'POOL_SIZE': ASGI_MAX_CONCURRENT_REQUESTS},
+    })
+
+# リードレプリカ (カンマ区切りのホスト名)。primary と同じ名前・ユーザーで接続する
+# 設定すると、安全なメソッド (GET など) のリクエストの読み込みがレプリカに送られる
+for _number, _host in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'],
+        'HOST': _host.strip(),
+        # テストではレプリカ用のデータベースを作らず、primary のテスト用データベースを使う
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['ramen_project.db_router.ReplicaRouter']
+# 書き込みのあったユーザーの読み込みを primary に送り続ける時間 (秒)。レプリカの遅延より長くする
+REPLICA_STICKY_SECONDS = 10
+
+# Cache
+# レプリカを使うときは、書き込みのあったユーザーの記録 (db_router.py) を全ワーカーで共有するため Redis を設定する
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
 
 
 # Password validation
@@ -143,7 +198,20 @@ AUTH_USER_MODEL = 'users.User'
 # Django Rest Frameworkの設定
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # simplejwt の JWTAuthentication と同じ判定を、ユーザーのキャッシュを使って行う
+        'users.authentication.CachedJWTAuthentication',
+    ),
+    # レスポンスは Accept で JSON / MessagePack を選べる (ramen_project/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'ramen_project.renderers.JSONRenderer',
+        'ramen_project.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'ramen_project.parsers.MessagePackParser',
     ),
     # デフォルトで認証を要求する場合はコメントを外す
     # 'DEFAULT_PERMISSION_CLASSES': (
@@ -176,3 +244,31 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
+
+# JWT 認証でのユーザーのキャッシュ (users/authentication.py) の件数の上限と有効期間 (秒)
+# 他のプロセスでのユーザーの無効化・パスワード変更は、最大で TTL の間だけ反映が遅れる
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TTL = 30
+
+# タイムライン (フォロー中ユーザーのラーメンログ) の設定
+# 承認済みフォロワーがこの人数を超えるユーザーは、書き込み時の展開をやめて読み込み時に取得する
+TIMELINE_FANOUT_MAX_FOLLOWERS = 1000
+# フォロー承認時に、タイムラインへ追加する相手の過去ログの件数
+TIMELINE_BACKFILL_LOGS = 50
+
+# 「知り合いかも」のおすすめユーザー (user_relationships/recommendations.py) の設定
+# ユーザーごとに保存する件数
+RECOMMENDATION_TOP_K = 20
+# スコア = 共通のフォロー数 + この重み x 共通の店の数
+RECOMMENDATION_SHARED_SHOP_WEIGHT = 0.5
+
+# 「ラーメンイキタイ」の通知 (GET /api/relationships/ikitai/events/, user_relationships/ikitai_events.py) の設定
+# プロセスの間でイベントを配る方法 (1プロセスだけで動かすなら user_relationships.ikitai_events.LocalBroker でもよい)
+IKITAI_EVENT_BROKER = 'user_relationships.ikitai_events.PostgresBroker'
+# 通知がないときに送るハートビートの間隔 (秒)。プロキシのアイドルタイムアウトより短くする
+IKITAI_EVENTS_HEARTBEAT = 25
+# 1接続で送りきれずに溜めておけるイベントの数。あふれたら接続を閉じる (クライアントがつなぎ直す)
+IKITAI_EVENTS_MAX_QUEUED = 100
+
+# /metrics (Prometheus 形式のメトリクス) の Bearer トークン。空の場合は DEBUG のときだけ認証なしで返し、それ以外は 403 にする
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from ramen_project.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -33,4 +35,7 @@ urlpatterns = [
     # DRFの認証URL (simplejwt)
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+
+    # Prometheus 形式のメトリクス (ramen_project/metrics.py)
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,42 @@
+# relationships/async_views.py
+"""ASGI で使う、フォロー関係の一覧と「ラーメンイキタイ」状態の取得の非同期版 (users/async_views.py を参照)"""
+from rest_framework import status
+from rest_framework.response import Response
+
+from users.async_views import AsyncAPIView
+
+from .models import IkitaiStatus
+from .serializers import RELATIONSHIP_LIST_VALUES, serialize_relationship_rows, IkitaiStatusSerializer
+from .views import FollowingListView, FollowerListView, PendingFollowRequestListView, IkitaiStatusView
+
+
+class AsyncRelationshipListView(AsyncAPIView):
+    """RelationshipListView と同じ一覧を非同期 ORM で返す"""
+
+    async def get(self, request, view, *args, **kwargs):
+        queryset = view.filter_queryset(view.get_queryset()).values(*RELATIONSHIP_LIST_VALUES)
+        return Response(serialize_relationship_rows([row async for row in queryset]))
+
+
+class AsyncFollowingListView(AsyncRelationshipListView):
+    sync_view = FollowingListView
+
+
+class AsyncFollowerListView(AsyncRelationshipListView):
+    sync_view = FollowerListView
+
+
+class AsyncPendingFollowRequestListView(AsyncRelationshipListView):
+    sync_view = PendingFollowRequestListView
+
+
+class AsyncIkitaiStatusView(AsyncAPIView):
+    """IkitaiStatusView の GET を非同期で返す。POST (ON) と DELETE (OFF) は同期版で処理する"""
+    sync_view = IkitaiStatusView
+
+    async def get(self, request, view, *args, **kwargs):
+        # シリアライザがユーザーを読むため、同じクエリで取得しておく
+        instance = await IkitaiStatus.objects.active().select_related('user').filter(user=request.user).afirst()
+        if instance is None:
+            return Response({'detail': '「ラーメンイキタイ」状態ではありません。'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(IkitaiStatusSerializer(instance).data)
@@ -0,0 +1,102 @@
+# relationships/geo.py
+"""
+「ラーメンイキタイ」の近隣検索で使う位置計算ユーティリティ。
+
+位置は geohash 文字列として IkitaiStatus に保存し、検索時は半径を覆う
+geohash セル (中心セル + 周囲8セル) の前方一致で SQL 側の粗い絞り込みを行う。
+正確な距離 (haversine) は絞り込んだ候補にだけ計算する。
+"""
+import math
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# IkitaiStatus に保存する geohash の桁数 (約 38m x 19m のセル)
+STORED_PRECISION = 8
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def encode(latitude, longitude, precision=STORED_PRECISION):
+    """緯度経度を geohash 文字列に変換する"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit = 0
+    ch = 0
+    even = True  # geohash は経度のビットから始まる
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """指定桁数の geohash セルの (緯度方向の高さ, 経度方向の幅) を度で返す"""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def precision_for_radius(latitude, radius_m):
+    """
+    半径 radius_m の円が「中心セル + 周囲8セル」に必ず収まる最大の桁数を返す。
+    セルの高さ・幅がどちらも半径以上であれば、3x3 セルで円を覆える。
+    """
+    meters_per_deg_lat = math.pi * EARTH_RADIUS_M / 180.0
+    meters_per_deg_lon = meters_per_deg_lat * max(math.cos(math.radians(latitude)), 1e-6)
+    for precision in range(STORED_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if height * meters_per_deg_lat >= radius_m and width * meters_per_deg_lon >= radius_m:
+            return precision
+    return 1
+
+
+def covering_cells(latitude, longitude, radius_m):
+    """半径 radius_m の円を覆う geohash セル (重複なし) の一覧を返す"""
+    precision = precision_for_radius(latitude, radius_m)
+    height, width = cell_size(precision)
+    cells = set()
+    for dlat in (-height, 0.0, height):
+        lat = latitude + dlat
+        if lat > 90.0 or lat < -90.0:
+            continue
+        for dlon in (-width, 0.0, width):
+            lon = longitude + dlon
+            # 日付変更線をまたぐ場合は反対側に回り込む
+            if lon >= 180.0:
+                lon -= 360.0
+            elif lon < -180.0:
+                lon += 360.0
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """2点間の大円距離をメートルで返す"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,369 @@
+# relationships/ikitai_events.py
+"""
+「ラーメンイキタイ」状態の変化を、フォロワーに Server-Sent Events で通知する (ポーリングの代わり)。
+
+- GET /api/relationships/ikitai/events/ (ASGI のみ。EventStreamMiddleware が Django の手前で処理する)
+  接続すると、承認済みでフォローしているユーザーの現在の状態を snapshot として送り
+  (読み込みの前に購読を始め、読み込み中の変化は snapshot の後に送る)、
+  その後は状態が変わるたびに ikitai (ON・更新) / ikitai_off (OFF) / ikitai_expired (期限切れ) を送る。
+  フォロー先は接続時に決まるため、フォローが承認されたフォロワーの接続は revoke で閉じさせ、
+  つなぎ直したときに承認したユーザーも含めて購読させる。
+  アクセストークンの期限 (exp) が来たら接続を閉じる (クライアントは新しいトークンでつなぎ直す)。
+- IkitaiStatusView の POST / DELETE は、コミット後に publish() でイベントを発行する。
+- フォローの承認・アンフォロー・退会は、そのユーザーの接続を閉じさせる revoke を発行する
+  (承認した相手の通知が届かなかったり、フォローしていない相手の通知を受け取り続けたり、
+  退会したユーザーの接続が残ったりしないように)。
+- イベントは broker (settings.IKITAI_EVENT_BROKER) でプロセスの間を配り、各プロセスの Hub が
+  そのプロセスにつながっているフォロワーに届ける。
+  - PostgresBroker: Postgres の NOTIFY / LISTEN で全プロセスに配る (WSGI のワーカーで発行したイベントも届く)
+  - LocalBroker: 同じプロセスの中だけで配る (テストや1プロセスで動かすとき)
+- 期限切れはDBを見に行かず、各プロセスの Hub が expires_at にタイマーを設定して通知する。
+
+接続1本あたりはコルーチン1つとキューだけで、スレッドもDB接続も使わない (DBを読むのは接続したときだけ)。
+接続は ConcurrencyLimitMiddleware の枠の外で保持するため、アイドルな接続を数万本持てる
+(プロセスのファイルディスクリプタの上限 (ulimit -n) は接続数より大きくしておくこと)。
+"""
+import asyncio
+import io
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+
+from users.authentication import CachedJWTAuthentication
+
+from .models import IkitaiStatus, UserRelationship
+from .serializers import IkitaiStatusSerializer
+
+logger = logging.getLogger(__name__)
+
+EVENT_PATH = '/api/relationships/ikitai/events/'
+NOTIFY_CHANNEL = 'ikitai_events'
+
+ON = 'ikitai'
+OFF = 'ikitai_off'
+EXPIRED = 'ikitai_expired'
+# user_id のユーザーの接続を閉じさせる (接続には送らない)
+REVOKE = 'revoke'
+
+
+# --- イベントの発行 ---
+
+def publish(event_type, user_id, status=None):
+    """user_id の状態の変化を、トランザクションのコミット後にフォロワーへ通知する"""
+    event = {'type': event_type, 'user_id': user_id}
+    if status is not None:
+        event['status'] = IkitaiStatusSerializer(status).data
+    transaction.on_commit(lambda: get_broker().publish(event))
+
+
+class LocalBroker:
+    """同じプロセスの Hub にだけ配る broker"""
+
+    def publish(self, event):
+        if _hub is not None:
+            _hub.dispatch(event)
+
+    def start(self, hub):
+        pass
+
+
+class PostgresBroker:
+    """
+    Postgres の NOTIFY で全プロセスに配る broker。
+    Hub のあるプロセスでは、LISTEN 用の接続を1本持つスレッドが通知を受け取って Hub に渡す。
+    """
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, json.dumps(event)])
+
+    def start(self, hub):
+        threading.Thread(target=self._listen, args=(hub,), daemon=True, name='ikitai-events-listener').start()
+
+    def _listen(self, hub):
+        while True:
+            listener = None
+            try:
+                # プールの接続は使わず、LISTEN 専用に接続する
+                listener = psycopg2.connect(**connection.get_connection_params())
+                listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+                while True:
+                    if select.select([listener], [], [], 60) == ([], [], []):
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        hub.dispatch(json.loads(listener.notifies.pop(0).payload))
+            except Exception:
+                # 接続が切れた場合などは、少し待ってつなぎ直す (その間のイベントは届かない)
+                logger.exception('ikitai のイベントの受信に失敗しました。つなぎ直します。')
+            finally:
+                # つなぎ直すたびに接続が残らないよう、前の接続を閉じる
+                if listener is not None:
+                    try:
+                        listener.close()
+                    except psycopg2.Error:
+                        pass
+            threading.Event().wait(5)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.IKITAI_EVENT_BROKER)()
+    return _broker
+
+
+# --- プロセス内の配信 ---
+
+class Subscription:
+    """1本の SSE 接続。フォローしているユーザーのイベントをキューで受け取る"""
+
+    def __init__(self, user_id, author_ids, max_queued):
+        self.user_id = user_id
+        self.author_ids = frozenset(author_ids)
+        self.queue = asyncio.Queue(max_queued)
+        # 受け取りが追いつかずキューがあふれたら、接続を閉じる (クライアントはつなぎ直して snapshot を受け取る)
+        self.overflowed = False
+        # revoke されたら、キューに残ったイベントを送らずに接続を閉じる
+        self.revoked = asyncio.Event()
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Hub:
+    """
+    プロセスごとの配信先の一覧。イベントループのスレッドでだけ操作し、他のスレッドからは dispatch() で渡す。
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscribers = defaultdict(set)
+        # 接続しているユーザーごとの接続 (revoke で閉じるため)
+        self.connections = defaultdict(set)
+        # ユーザーごとの、期限切れを通知するタイマー
+        self.expiries = {}
+
+    def dispatch(self, event):
+        """どのスレッドからでも呼べる"""
+        self.loop.call_soon_threadsafe(self.deliver, event)
+
+    def deliver(self, event):
+        user_id = event['user_id']
+        if event['type'] == REVOKE:
+            for subscription in self.connections.get(user_id, ()):
+                subscription.revoked.set()
+            return
+        if event['type'] == ON:
+            self.watch_expiry(user_id, _parse_datetime(event['status']['expires_at']), replace=True)
+        elif event['type'] in (OFF, EXPIRED):
+            self._cancel_expiry(user_id)
+        for subscription in list(self.subscribers.get(user_id, ())):
+            subscription.put(event)
+
+    def subscribe(self, subscription):
+        self.connections[subscription.user_id].add(subscription)
+        for author_id in subscription.author_ids:
+            self.subscribers[author_id].add(subscription)
+
+    def unsubscribe(self, subscription):
+        connections = self.connections.get(subscription.user_id)
+        if connections is not None:
+            connections.discard(subscription)
+            if not connections:
+                del self.connections[subscription.user_id]
+        for author_id in subscription.author_ids:
+            subscribers = self.subscribers.get(author_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[author_id]
+
+    def watch_expiry(self, user_id, expires_at, replace=False):
+        """expires_at に user_id の期限切れを通知する (replace=False なら、既に設定されたタイマーを優先する)"""
+        if user_id in self.expiries:
+            if not replace:
+                return
+            self._cancel_expiry(user_id)
+        delay = (expires_at - timezone.now()).total_seconds()
+        self.expiries[user_id] = self.loop.call_later(max(delay, 0), self._expire, user_id)
+
+    def _cancel_expiry(self, user_id):
+        handle = self.expiries.pop(user_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _expire(self, user_id):
+        self.expiries.pop(user_id, None)
+        self.deliver({'type': EXPIRED, 'user_id': user_id})
+
+
+_hub = None
+
+
+def get_hub():
+    """このプロセスの Hub (イベントループの中で初めて呼ばれたときに作り、broker からの受信を始める)"""
+    global _hub
+    if _hub is None:
+        _hub = Hub(asyncio.get_running_loop())
+        get_broker().start(_hub)
+    return _hub
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+# --- SSE の接続 ---
+
+class EventStreamMiddleware:
+    """
+    EVENT_PATH への GET を SSE の接続として処理し、それ以外は app に渡す ASGI のミドルウェア (asgi.py で使う)。
+    Django 4.2 の StreamingHttpResponse ではクライアントの切断を検知できず、
+    切れた接続のキューが残り続けるため、ASGI で直接処理する。
+    """
+    authenticator = CachedJWTAuthentication()
+
+    def __init__(self, app):
+        self.app = app
+        self._handshake_slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != EVENT_PATH:
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await _send_json(send, 405, {'detail': f"メソッド \"{scope['method']}\" は許可されていません。"})
+        if self._handshake_slots is None:
+            # 接続時のDBの読み込みは、同時に ASGI_MAX_CONCURRENT_REQUESTS 件まで (一斉につなぎ直されたとき用)
+            self._handshake_slots = asyncio.Semaphore(settings.ASGI_MAX_CONCURRENT_REQUESTS)
+        request = ASGIRequest(scope, io.BytesIO())
+        try:
+            async with self._handshake_slots:
+                user_id, expires_at, author_ids = await sync_to_async(self._handshake, thread_sensitive=False)(request)
+        except exceptions.APIException as exc:
+            headers = {'WWW-Authenticate': self.authenticator.authenticate_header(request)} if exc.status_code == 401 else {}
+            return await _send_json(send, exc.status_code, {'detail': exc.detail}, headers)
+
+        # snapshot を読む前に購読しておく。読んでいる間にコミットされた変化はキューにたまり、snapshot の後に送る
+        # (snapshot に反映済みの変化が重ねて届くことはあるが、順に適用すれば同じ状態になる)
+        hub = get_hub()
+        subscription = Subscription(user_id, author_ids, settings.IKITAI_EVENTS_MAX_QUEUED)
+        hub.subscribe(subscription)
+        try:
+            async with self._handshake_slots:
+                snapshot = await sync_to_async(self._snapshot, thread_sensitive=False)(author_ids)
+            for status in snapshot:
+                hub.watch_expiry(status['user']['id'], _parse_datetime(status['expires_at']))
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    # nginx などのプロキシにバッファさせない
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await _send_event(send, 'snapshot', snapshot)
+            await self._stream(subscription, expires_at, receive, send)
+        finally:
+            hub.unsubscribe(subscription)
+
+    def _handshake(self, request):
+        """認証して、(ユーザーの id, アクセストークンの期限 (UNIX 時刻), フォローしているユーザーの id) を返す"""
+        close_old_connections()
+        try:
+            result = self.authenticator.authenticate(request)
+            if result is None:
+                raise exceptions.NotAuthenticated()
+            user, token = result
+            author_ids = list(UserRelationship.objects.filter(
+                follower_id=user.id, status=UserRelationship.STATUS_APPROVED,
+            ).values_list('followed_id', flat=True))
+            return user.id, token['exp'], author_ids
+        finally:
+            close_old_connections()
+
+    def _snapshot(self, author_ids):
+        """author_ids のうち、現在「ラーメンイキタイ」状態のユーザーの状態の一覧を返す"""
+        close_old_connections()
+        try:
+            active = IkitaiStatus.objects.active().filter(user_id__in=author_ids).select_related('user')
+            return IkitaiStatusSerializer(active, many=True).data
+        finally:
+            close_old_connections()
+
+    async def _stream(self, subscription, expires_at, receive, send):
+        """切断されるか、revoke されるか、アクセストークンの期限 (expires_at) が来るまで、イベントとハートビートを送り続ける"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (expires_at - time.time())
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        revoked = asyncio.ensure_future(subscription.revoked.wait())
+        try:
+            while not disconnected.done() and not revoked.done():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                getter = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, disconnected, revoked}, timeout=min(settings.IKITAI_EVENTS_HEARTBEAT, remaining),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if getter not in done:
+                    getter.cancel()
+                    if not done and loop.time() < deadline:
+                        # 途中のプロキシに切られないよう、コメント行を送る
+                        await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                    continue
+                # 同じ event を他の接続にも渡しているため、変更しない
+                event = getter.result()
+                await _send_event(send, event['type'], {key: value for key, value in event.items() if key != 'type'})
+                if subscription.overflowed and subscription.queue.empty():
+                    break
+        finally:
+            disconnected.cancel()
+            revoked.cancel()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_event(send, event_type, data):
+    body = f'event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode()
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+
+async def _send_json(send, status, data, headers=None):
+    body = json.dumps(data, ensure_ascii=False).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')] + [
+            (name.lower().encode(), value.encode()) for name, value in (headers or {}).items()
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
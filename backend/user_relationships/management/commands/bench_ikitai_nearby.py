@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from user_relationships.geo import encode
+from user_relationships.models import IkitaiStatus, UserRelationship
+
+User = get_user_model()
+
+# 東京駅周辺を中心に、昼のピーク時のように密集した位置を生成する
+CENTER = (35.681236, 139.767125)
+
+
+class Command(BaseCommand):
+    help = '近くの「ラーメンイキタイ」検索APIのレイテンシをテーブルサイズごとに計測する (データはロールバックされる)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000', help='IkitaiStatus の行数 (カンマ区切り)')
+        parser.add_argument('--follows', type=int, default=300, help='計測ユーザーがフォローしている人数')
+        parser.add_argument('--iterations', type=int, default=300, help='サイズごとのリクエスト回数')
+        parser.add_argument('--radius', type=float, default=3000.0, help='検索半径 (メートル)')
+        parser.add_argument('--spread', type=float, default=0.2, help='位置のばらつき (度)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        rng = random.Random(options['seed'])
+        self.stdout.write('rows\tp50(ms)\tp95(ms)\tp99(ms)\tmax(ms)')
+        for size in sizes:
+            with transaction.atomic():
+                viewer = self._seed(size, options, rng)
+                timings = self._measure(viewer, options, rng)
+                transaction.set_rollback(True)
+            timings.sort()
+            self.stdout.write('%d\t%.2f\t%.2f\t%.2f\t%.2f' % (
+                size,
+                statistics.median(timings),
+                timings[int(len(timings) * 0.95) - 1],
+                timings[int(len(timings) * 0.99) - 1],
+                timings[-1],
+            ))
+
+    def _seed(self, size, options, rng):
+        prefix = f'bench_ikitai_{size}_'
+        viewer = User.objects.create_user(username=f'{prefix}viewer')
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}{i}') for i in range(size)],
+            batch_size=5000,
+        )
+        expires_at = timezone.now() + timedelta(hours=1)
+        spread = options['spread']
+        statuses = []
+        for user in users:
+            lat = CENTER[0] + rng.uniform(-spread, spread)
+            lon = CENTER[1] + rng.uniform(-spread, spread)
+            statuses.append(IkitaiStatus(
+                user=user, latitude=lat, longitude=lon,
+                geohash=encode(lat, lon), expires_at=expires_at,
+            ))
+        IkitaiStatus.objects.bulk_create(statuses, batch_size=5000)
+        followees = rng.sample(users, min(options['follows'], len(users)))
+        UserRelationship.objects.bulk_create(
+            [UserRelationship(follower=viewer, followed=u, status=UserRelationship.STATUS_APPROVED) for u in followees],
+            batch_size=5000,
+        )
+        # 他ユーザー同士のフォロー関係も作り、フォローテーブルも規模に合わせて大きくする
+        others = [
+            UserRelationship(follower=users[i], followed=users[(i * 7 + 1) % size], status=UserRelationship.STATUS_APPROVED)
+            for i in range(size) if users[i] != users[(i * 7 + 1) % size]
+        ]
+        UserRelationship.objects.bulk_create(others, batch_size=5000, ignore_conflicts=True)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return viewer
+
+    def _measure(self, viewer, options, rng):
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user=viewer)
+        url = reverse('ikitai-nearby')
+        spread = options['spread']
+        timings = []
+        for i in range(options['iterations'] + 10):
+            params = {
+                'latitude': CENTER[0] + rng.uniform(-spread, spread),
+                'longitude': CENTER[1] + rng.uniform(-spread, spread),
+                'radius': options['radius'],
+            }
+            start = time.perf_counter()
+            response = client.get(url, params)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert response.status_code == 200, response.content
+            if i >= 10:  # 最初の数回はウォームアップとして捨てる
+                timings.append(elapsed)
+        return timings
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user_relationships import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'おすすめユーザー (知り合いかも) を計算し直す。既定ではフォローの関係が変わったユーザーだけを計算する '
+        '(cron などで定期的に実行する。共通の店の数の変化も反映するには、--full を1日1回程度実行する)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='全ユーザーのおすすめを計算し直す')
+        parser.add_argument('--batch-size', type=int, default=1000, help='一度に計算するユーザー数')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['full']:
+            refreshed = recommendations.refresh(batch_size=options['batch_size'])
+        else:
+            refreshed = recommendations.refresh_stale(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{refreshed} 人のおすすめを計算しました ({time.perf_counter() - start:.1f} 秒)'
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user_relationships.models import IkitaiStatus
+
+
+class Command(BaseCommand):
+    help = (
+        '有効期限の切れた「ラーメンイキタイ」状態を少しずつ削除する (cron などで数分ごとに実行する。'
+        'APIは削除を待たずに期限切れの状態を「状態なし」として扱う)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の DELETE で削除する件数')
+        parser.add_argument('--max-batches', type=int, help='この回数だけ削除したら終える (指定しなければ残りがなくなるまで)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        deleted = IkitaiStatus.objects.delete_expired(options['batch_size'], options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(
+            f'期限切れの「ラーメンイキタイ」状態を {deleted} 件削除しました ({time.perf_counter() - start:.1f} 秒)'
+        ))
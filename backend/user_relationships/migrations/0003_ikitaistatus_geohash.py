@@ -0,0 +1,73 @@
+from django.db import migrations, models
+
+# user_relationships.geo の geohash への変換 (このマイグレーションを作った時点のもの) を写したもの。
+# アプリのコードが変わっても結果が変わらないよう、マイグレーションからは import しない
+BATCH_SIZE = 2000
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+STORED_PRECISION = 8
+
+
+def encode(latitude, longitude, precision=STORED_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit = 0
+    ch = 0
+    even = True  # geohash は経度のビットから始まる
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def backfill_geohash(apps, schema_editor):
+    IkitaiStatus = apps.get_model('user_relationships', 'IkitaiStatus')
+    batch = []
+    for status in IkitaiStatus.objects.only('id', 'latitude', 'longitude').iterator(chunk_size=BATCH_SIZE):
+        status.geohash = encode(status.latitude, status.longitude)
+        batch.append(status)
+        if len(batch) >= BATCH_SIZE:
+            IkitaiStatus.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        IkitaiStatus.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_relationships', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ikitaistatus',
+            name='geohash',
+            field=models.CharField(default='', editable=False, help_text='現在地の geohash', max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ikitaistatus',
+            index=models.Index(fields=['geohash', 'expires_at'], name='ikitai_geohash_expires_idx', opclasses=['varchar_pattern_ops', 'timestamptz_ops']),
+        ),
+    ]
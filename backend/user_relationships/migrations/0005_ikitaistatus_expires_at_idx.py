@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_relationships', '0004_follow_recommendation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ikitaistatus',
+            index=models.Index(fields=['expires_at'], name='ikitai_expires_at_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 # relationships/models.py
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+from .geo import encode as encode_geohash
 
 class UserRelationship(models.Model):
     """ユーザーのフォロー関係を管理するモデル"""
@@ -9,6 +12,11 @@ class UserRelationship(models.Model):
         APPROVED = 'APPROVED', '承認済み'
         DENIED = 'DENIED', '拒否済み'
 
+    # ビューやテストから参照されるステータス定数
+    STATUS_PENDING = Status.PENDING
+    STATUS_APPROVED = Status.APPROVED
+    STATUS_DENIED = Status.DENIED
+
     follower = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name='following_relationships',
@@ -43,6 +51,32 @@ class UserRelationship(models.Model):
         status_display = self.get_status_display()
         return f"{self.follower.username} が {self.followed.username} をフォロー ({status_display})"
 
+class IkitaiStatusQuerySet(models.QuerySet):
+    def active(self):
+        """有効期限内の状態 (期限切れの行は、sweep_ikitai で削除されるまで「状態なし」として扱う)"""
+        return self.filter(expires_at__gt=timezone.now())
+
+    def delete_expired(self, batch_size=1000, max_batches=None):
+        """
+        期限切れの行を、古い順に batch_size 件ずつ削除する (ロックを長く持たないよう、1回ごとにコミットされる)。
+        削除した件数を返す。
+        """
+        deleted = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            now = timezone.now()
+            ids = list(self.filter(expires_at__lte=now).order_by('expires_at').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            # 選んだ後に ON にし直された (expires_at が延びた) 行は残す
+            count, _ = self.filter(id__in=ids, expires_at__lte=now).delete()
+            deleted += count
+            batches += 1
+            if len(ids) < batch_size:
+                break
+        return deleted
+
+
 class IkitaiStatus(models.Model):
     """「ラーメンイキタイ」の状態を管理するモデル"""
     user = models.OneToOneField(
@@ -53,7 +87,62 @@ class IkitaiStatus(models.Model):
     latitude = models.FloatField(help_text="ユーザーの現在地の緯度")
     longitude = models.FloatField(help_text="ユーザーの現在地の経度")
     expires_at = models.DateTimeField(help_text="このステータスが失効する日時")
+    # 近隣検索用の geohash (緯度経度から save() 時に自動で計算する)
+    geohash = models.CharField(max_length=12, editable=False, default='', help_text="現在地の geohash")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = IkitaiStatusQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 期限切れの行の削除 (delete_expired) で、古い順に読むため
+            models.Index(fields=['expires_at'], name='ikitai_expires_at_idx'),
+            # geohash の前方一致 (LIKE 'xxx%') で使えるよう pattern_ops を指定する
+            models.Index(
+                fields=['geohash', 'expires_at'],
+                name='ikitai_geohash_expires_idx',
+                opclasses=['varchar_pattern_ops', 'timestamptz_ops'],
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'latitude', 'longitude'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.username} - Ikitai until {self.expires_at.strftime('%Y-%m-%d %H:%M')}"
+
+
+class FollowRecommendation(models.Model):
+    """
+    「知り合いかも」のおすすめユーザー (ユーザーごとに上位 RECOMMENDATION_TOP_K 件)。
+    recommendations.refresh() がフォローの関係全体から計算して書き込み、一覧APIは rank 順に読むだけ。
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    recommended = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # 1 から始まる順位
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    # user がフォローしていて、recommended をフォローしているユーザーの数
+    mutual_count = models.PositiveIntegerField()
+    # user と recommended の両方が訪れた店の数
+    shared_shop_count = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # (user, rank) のインデックスを兼ね、一覧APIはこの範囲スキャンになる
+            models.UniqueConstraint(fields=['user', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+
+class StaleRecommendation(models.Model):
+    """
+    フォローの関係が変わり、おすすめの再計算が必要なユーザー。
+    recommendations.mark_stale() が記録し、refresh_recommendations コマンド (差分更新) が処理して削除する。
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    marked_at = models.DateTimeField(auto_now_add=True)
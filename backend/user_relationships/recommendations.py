@@ -0,0 +1,163 @@
+# relationships/recommendations.py
+"""
+「知り合いかも」のおすすめユーザー (FollowRecommendation) の計算。
+
+承認済みのフォローの関係を疎行列 (CSR) F (F[u, v] = 1: u が v をフォローしている) として読み込み、
+- 共通のフォロー数: F @ F の (u, c) 成分 (u がフォローしている人のうち、c をフォローしている人の数)
+- 共通の店の数: 訪れた店の行列 V (V[u, s] = 1: u が店 s のログを書いた) の u 行と c 行の内積
+を、ユーザーを batch_size 人ずつまとめた行列の演算で求め、スコアの上位 RECOMMENDATION_TOP_K 件を保存する。
+候補は友達の友達 (共通のフォローが1人以上いる人) で、自分自身と、フォローの関係がすでにある人
+(申請中・拒否済みを含む) は除く。行列の添字にはユーザーIDをそのまま使う。
+
+計算は refresh_recommendations コマンドから定期的に行う (全件と、フォローの関係が変わったユーザーだけの差分更新)。
+フォローの関係が変わったときは mark_stale() で再計算の対象に記録する。
+"""
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+from scipy import sparse
+
+from ramen_log.models import RamenLog, Shop
+
+from .models import FollowRecommendation, StaleRecommendation, UserRelationship
+
+User = get_user_model()
+
+# 関係の読み込みで、一度に DB から受け取る行数
+_FETCH_CHUNK = 10000
+
+
+def mark_stale(user_ids):
+    """
+    user_ids のフォローの関係 (フォローする側) が変わったときに呼ぶ。
+    本人と、本人を承認済みでフォローしているユーザー (本人経由の共通のフォロー数が変わる) を再計算の対象にする。
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    with connection.cursor() as cursor:
+        # 計算中に記録されたユーザーを取りこぼさないよう、既にあれば記録した日時を更新する
+        cursor.execute(
+            f"""
+            INSERT INTO {StaleRecommendation._meta.db_table} (user_id, marked_at)
+            SELECT user_id, %s FROM (
+                SELECT unnest(%s::bigint[]) AS user_id
+                UNION
+                SELECT follower_id FROM {UserRelationship._meta.db_table}
+                WHERE followed_id = ANY(%s::bigint[]) AND status = %s
+            ) AS t
+            ON CONFLICT (user_id) DO UPDATE SET marked_at = EXCLUDED.marked_at
+            """,
+            [timezone.now(), user_ids, user_ids, UserRelationship.STATUS_APPROVED],
+        )
+
+
+def _matrix(queryset, shape):
+    """2列 (行, 列) の values_list() を読み込み、値が1の CSR 行列にする (重複した組も1)"""
+    pairs = np.fromiter(
+        (value for pair in queryset.iterator(chunk_size=_FETCH_CHUNK) for value in pair),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (pairs[:, 0], pairs[:, 1])),
+        shape=shape,
+    )
+    matrix.data[:] = 1
+    return matrix
+
+
+class Graph:
+    """計算に使う行列 (フォローの関係全体と、訪れた店) をまとめて読み込んだもの"""
+
+    def __init__(self):
+        size = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        relationships = UserRelationship.objects.order_by().values_list('follower_id', 'followed_id')
+        # 承認済みのフォロー
+        self.follows = _matrix(relationships.filter(status=UserRelationship.STATUS_APPROVED), (size, size))
+        # 候補から除く組 (フォローの関係がある人と自分自身)
+        self.excluded = (_matrix(relationships, (size, size)) + sparse.identity(size, dtype=np.int32, format='csr')).tocsr()
+        self.excluded.data[:] = 1
+        visits = RamenLog.objects.filter(shop__isnull=False).order_by().values_list('user_id', 'shop_id')
+        shop_count = (Shop.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        self.visits = _matrix(visits, (size, shop_count))
+        self.size = size
+
+
+def compute(graph, user_ids, top_k, shared_shop_weight):
+    """
+    user_ids のおすすめを計算する。
+    (user_id, recommended_id, rank, score, mutual_count, shared_shop_count) の配列を、user_id と rank の順で返す。
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    user_ids = user_ids[user_ids < graph.size]
+    # 友達の友達と、共通のフォロー数 (行は user_ids の並び順)
+    mutual = graph.follows[user_ids] @ graph.follows
+    # 自分自身と、フォローの関係がすでにある人を除く
+    mutual = (mutual - mutual.multiply(graph.excluded[user_ids])).tocsr()
+    mutual.eliminate_zeros()
+    mutual.sort_indices()
+    mutual = mutual.tocoo()
+    users = user_ids[mutual.row]
+    candidates = mutual.col.astype(np.int64)
+    mutual_counts = mutual.data.astype(np.int64)
+
+    # 候補ごとの共通の店の数 (訪れた店の行どうしの内積)
+    shared_shops = np.asarray(graph.visits[users].multiply(graph.visits[candidates]).sum(axis=1)).ravel().astype(np.int64)
+    scores = mutual_counts + shared_shop_weight * shared_shops
+
+    # ユーザーごとにスコアの高い順 (同点は ID の小さい順) に並べ、上位 top_k 件を残す。
+    # 候補は行ごとに ID の順に並んでいるため、安定ソートをスコア、行の順に行えばよい (lexsort より速い)
+    order = np.argsort(-scores, kind='stable')
+    order = order[np.argsort(mutual.row[order], kind='stable')]
+    users, candidates, scores = users[order], candidates[order], scores[order]
+    mutual_counts, shared_shops = mutual_counts[order], shared_shops[order]
+    counts = np.bincount(mutual.row, minlength=len(user_ids))
+    ranks = np.arange(len(users)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    keep = ranks <= top_k
+    return users[keep], candidates[keep], ranks[keep], scores[keep], mutual_counts[keep], shared_shops[keep]
+
+
+def _save(user_ids, result, computed_at):
+    """user_ids のおすすめを result で置き換える (行数が多いため、配列を渡す1回の INSERT で書き込む)"""
+    FollowRecommendation.objects.filter(user_id__in=user_ids).delete()
+    if not len(result[0]):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {FollowRecommendation._meta.db_table}
+                (user_id, recommended_id, rank, score, mutual_count, shared_shop_count, computed_at)
+            SELECT *, %s FROM unnest(%s::bigint[], %s::bigint[], %s::smallint[], %s::float8[], %s::integer[], %s::integer[])
+            """,
+            [computed_at, *(column.tolist() for column in result)],
+        )
+
+
+def refresh(user_ids=None, batch_size=1000, graph=None):
+    """
+    user_ids (省略時は全ユーザー) のおすすめを計算し直して保存する。計算したユーザー数を返す。
+    計算したユーザーの StaleRecommendation は、計算を始める前に記録されたものだけ削除する。
+    """
+    started = timezone.now()
+    if graph is None:
+        graph = Graph()
+    if user_ids is None:
+        user_ids = User.objects.order_by('id').values_list('id', flat=True)
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        result = compute(graph, batch, settings.RECOMMENDATION_TOP_K, settings.RECOMMENDATION_SHARED_SHOP_WEIGHT)
+        with transaction.atomic():
+            _save(batch, result, started)
+            StaleRecommendation.objects.filter(user_id__in=batch, marked_at__lte=started).delete()
+    return len(user_ids)
+
+
+def refresh_stale(batch_size=1000):
+    """mark_stale() で記録されたユーザーのおすすめだけを計算し直す (差分更新)。計算したユーザー数を返す"""
+    user_ids = list(StaleRecommendation.objects.order_by('user_id').values_list('user_id', flat=True))
+    if not user_ids:
+        return 0
+    return refresh(user_ids, batch_size=batch_size)
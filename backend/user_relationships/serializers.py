@@ -1,7 +1,8 @@
 # relationships/serializers.py
 from rest_framework import serializers
-from .models import UserRelationship, IkitaiStatus
-from users.serializers import UserSerializer # usersアプリからUserSerializerをインポート
+from ramen_project.metrics import timed_serialization
+from .models import UserRelationship, IkitaiStatus, FollowRecommendation
+from users.serializers import UserSerializer, serialize_user_row, user_values # usersアプリからUserSerializerをインポート
 
 class UserRelationshipSerializer(serializers.ModelSerializer):
     # followerとfollowedの情報をネストして表示
@@ -21,6 +22,19 @@ class FollowApprovalSerializer(serializers.Serializer):
     """フォロー承認/拒否用のシリアライザ"""
     action = serializers.ChoiceField(choices=[('approve', '承認'), ('deny', '拒否')], help_text="アクション: 'approve' または 'deny'")
 
+class FollowBatchApprovalSerializer(FollowApprovalSerializer):
+    """フォローリクエストの一括承認/拒否用のシリアライザ (user_ids か all_pending のどちらか一方を指定する)"""
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=1000,
+        help_text="フォローリクエストを送ってきたユーザーのIDの一覧",
+    )
+    all_pending = serializers.BooleanField(required=False, default=False, help_text="保留中のリクエストをすべて対象にする")
+
+    def validate(self, attrs):
+        if attrs['all_pending'] == ('user_ids' in attrs):
+            raise serializers.ValidationError("user_ids か all_pending のどちらか一方を指定してください。")
+        return attrs
+
 
 # --- 「ラーメンイキタイ」機能のシリアライザ ---
 
@@ -36,4 +50,78 @@ class IkitaiStatusCreateSerializer(serializers.Serializer):
     """「ラーメンイキタイ」状態を作成するためのシリアライザ"""
     latitude = serializers.FloatField(write_only=True, min_value=-90.0, max_value=90.0)
     longitude = serializers.FloatField(write_only=True, min_value=-180.0, max_value=180.0)
-    duration_type = serializers.ChoiceField(choices=['now', 'lunch', 'dinner'], write_only=True, help_text="期間タイプ: 'now'(1時間), 'lunch'(14時まで), 'dinner'(22時まで)")
\ No newline at end of file
+    duration_type = serializers.ChoiceField(choices=['now', 'lunch', 'dinner'], write_only=True, help_text="期間タイプ: 'now'(1時間), 'lunch'(14時まで), 'dinner'(22時まで)")
+
+class IkitaiNearbyQuerySerializer(serializers.Serializer):
+    """近くの「ラーメンイキタイ」ユーザー検索のクエリパラメータ用シリアライザ"""
+    latitude = serializers.FloatField(min_value=-90.0, max_value=90.0)
+    longitude = serializers.FloatField(min_value=-180.0, max_value=180.0)
+    radius = serializers.FloatField(min_value=1.0, max_value=20000.0, default=3000.0, help_text="検索半径 (メートル)")
+    limit = serializers.IntegerField(min_value=1, max_value=200, default=50, help_text="最大件数")
+
+
+class IkitaiNearbySerializer(IkitaiStatusSerializer):
+    """近くの「ラーメンイキタイ」ユーザーを距離付きで表示するためのシリアライザ"""
+    distance = serializers.FloatField(read_only=True, help_text="検索地点からの距離 (メートル)")
+
+    class Meta(IkitaiStatusSerializer.Meta):
+        fields = IkitaiStatusSerializer.Meta.fields + ['distance']
+
+
+class FollowRecommendationSerializer(serializers.ModelSerializer):
+    """おすすめユーザーのシリアライザ"""
+    recommended = UserSerializer(read_only=True)
+
+    class Meta:
+        model = FollowRecommendation
+        fields = ['recommended', 'rank', 'score', 'mutual_count', 'shared_shop_count', 'computed_at']
+
+
+# --- 一覧用の軽量な読み取り専用パス ---
+# follower / followed の両方を values() の1クエリで取得し、
+# UserRelationshipSerializer と同じ形の辞書を直接組み立てる。
+
+RELATIONSHIP_LIST_VALUES = (
+    ('id', 'status', 'created_at', 'updated_at')
+    + user_values('follower')
+    + user_values('followed')
+)
+
+_datetime_field = serializers.DateTimeField()
+
+
+@timed_serialization
+def serialize_relationship_rows(rows):
+    """RELATIONSHIP_LIST_VALUES の行を UserRelationshipSerializer と同じ出力に変換する"""
+    to_datetime = _datetime_field.to_representation
+    return [
+        {
+            'id': row['id'],
+            'follower': serialize_user_row(row, 'follower'),
+            'followed': serialize_user_row(row, 'followed'),
+            'status': row['status'],
+            'created_at': to_datetime(row['created_at']),
+            'updated_at': to_datetime(row['updated_at']),
+        }
+        for row in rows
+    ]
+
+
+RECOMMENDATION_LIST_VALUES = ('rank', 'score', 'mutual_count', 'shared_shop_count', 'computed_at') + user_values('recommended')
+
+
+@timed_serialization
+def serialize_recommendation_rows(rows):
+    """RECOMMENDATION_LIST_VALUES の行を FollowRecommendationSerializer と同じ出力に変換する"""
+    to_datetime = _datetime_field.to_representation
+    return [
+        {
+            'recommended': serialize_user_row(row, 'recommended'),
+            'rank': row['rank'],
+            'score': row['score'],
+            'mutual_count': row['mutual_count'],
+            'shared_shop_count': row['shared_shop_count'],
+            'computed_at': to_datetime(row['computed_at']),
+        }
+        for row in rows
+    ]
@@ -1,5 +1,16 @@
-from django.test import TestCase
-from .models import UserRelationship
+import io
+import json
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from . import geo
+from .models import UserRelationship, IkitaiStatus
+from .serializers import UserRelationshipSerializer
 from django.contrib.auth import get_user_model
 
 class UserRelationshipModelTest(TestCase):
@@ -27,3 +38,388 @@ class UserRelationshipModelTest(TestCase):
         self.assertIn('user1', str(rel))
         self.assertIn('user2', str(rel))
         self.assertIn('承認済み', str(rel))
+
+
+class GeohashTest(TestCase):
+    def test_encode_known_value(self):
+        # 既知の geohash (https://en.wikipedia.org/wiki/Geohash の例)
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_covering_cells_contain_points_within_radius(self):
+        lat, lon = 35.681236, 139.767125
+        cells = geo.covering_cells(lat, lon, 1000)
+        for dlat, dlon in [(0.0089, 0), (-0.0089, 0), (0, 0.011), (0, -0.011), (0.006, 0.007)]:
+            point_hash = geo.encode(lat + dlat, lon + dlon)
+            self.assertTrue(any(point_hash.startswith(c) for c in cells))
+
+    def test_saving_status_sets_geohash(self):
+        user = get_user_model().objects.create_user(username='geo', password='pass')
+        status = IkitaiStatus.objects.create(
+            user=user, latitude=35.0, longitude=139.0,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.assertEqual(status.geohash, geo.encode(35.0, 139.0))
+
+
+class IkitaiNearbyViewTest(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.me = User.objects.create_user(username='me', password='pass')
+        self.near = User.objects.create_user(username='near', password='pass')
+        self.far = User.objects.create_user(username='far', password='pass')
+        self.stranger = User.objects.create_user(username='stranger', password='pass')
+        self.expired = User.objects.create_user(username='expired', password='pass')
+        for user in (self.near, self.far, self.expired):
+            UserRelationship.objects.create(follower=self.me, followed=user, status=UserRelationship.STATUS_APPROVED)
+        later = timezone.now() + timedelta(hours=1)
+        IkitaiStatus.objects.create(user=self.near, latitude=35.6820, longitude=139.7680, expires_at=later)
+        IkitaiStatus.objects.create(user=self.far, latitude=35.7300, longitude=139.7680, expires_at=later)
+        IkitaiStatus.objects.create(user=self.stranger, latitude=35.6815, longitude=139.7675, expires_at=later)
+        IkitaiStatus.objects.create(user=self.expired, latitude=35.6815, longitude=139.7675,
+                                    expires_at=timezone.now() - timedelta(minutes=1))
+        self.client.force_authenticate(user=self.me)
+        self.url = reverse('ikitai-nearby')
+
+    def test_returns_only_approved_active_followees_within_radius(self):
+        response = self.client.get(self.url, {'latitude': 35.681236, 'longitude': 139.767125, 'radius': 1000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['user']['username'] for row in response.data], ['near'])
+        self.assertLess(response.data[0]['distance'], 1000)
+
+    def test_orders_by_distance_and_applies_limit(self):
+        params = {'latitude': 35.681236, 'longitude': 139.767125, 'radius': 10000}
+        response = self.client.get(self.url, params)
+        self.assertEqual([row['user']['username'] for row in response.data], ['near', 'far'])
+        response = self.client.get(self.url, dict(params, limit=1))
+        self.assertEqual([row['user']['username'] for row in response.data], ['near'])
+
+    def test_requires_coordinates(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 400)
+
+
+class IkitaiExpiryTest(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(5)]
+        now = timezone.now()
+        # 3人は期限切れ、2人は有効
+        for i, user in enumerate(self.users):
+            IkitaiStatus.objects.create(user=user, latitude=35.0, longitude=139.0, expires_at=now + timedelta(minutes=i - 2.5))
+        self.client.force_authenticate(user=self.users[0])
+
+    def test_expired_status_is_absent_without_extra_query(self):
+        url = reverse('ikitai-status')
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.client.force_authenticate(user=self.users[4])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_sweep_deletes_expired_rows_in_batches(self):
+        from django.core.management import call_command
+        self.assertEqual(IkitaiStatus.objects.delete_expired(batch_size=2, max_batches=1), 2)
+        out = io.StringIO()
+        call_command('sweep_ikitai', '--batch-size', '2', stdout=out)
+        self.assertIn('1 件削除しました', out.getvalue())
+        self.assertEqual(
+            sorted(IkitaiStatus.objects.values_list('user__username', flat=True)), ['user3', 'user4'],
+        )
+
+
+class RelationshipListViewTest(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.me = User.objects.create_user(username='me', password='pass', email='me@example.com')
+        for i in range(5):
+            follower = User.objects.create_user(username=f'follower{i}', password='pass')
+            UserRelationship.objects.create(follower=follower, followed=self.me, status=UserRelationship.STATUS_APPROVED)
+            followee = User.objects.create_user(username=f'followee{i}', password='pass')
+            UserRelationship.objects.create(follower=self.me, followed=followee, status=UserRelationship.STATUS_APPROVED)
+        self.client.force_authenticate(user=self.me)
+
+    def test_lists_run_single_query_and_match_model_serializer(self):
+        for url_name, queryset in [
+            ('follower-list', UserRelationship.objects.filter(followed=self.me)),
+            ('following-list', UserRelationship.objects.filter(follower=self.me)),
+        ]:
+            # ETag 用の番号の読み込みと、一覧の1クエリ
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse(url_name))
+            expected = UserRelationshipSerializer(queryset, many=True).data
+            self.assertEqual(response.data, [dict(row) for row in expected])
+
+
+class FollowBatchApprovalViewTest(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.me = User.objects.create_user(username='me', password='pass')
+        self.requesters = [User.objects.create_user(username=f'requester{i}', password='pass') for i in range(6)]
+        for requester in self.requesters:
+            UserRelationship.objects.create(follower=requester, followed=self.me)
+        self.approved = User.objects.create_user(username='approved', password='pass')
+        UserRelationship.objects.create(follower=self.approved, followed=self.me, status=UserRelationship.STATUS_APPROVED)
+        self.client.force_authenticate(user=self.me)
+        self.url = reverse('follow-approve-batch')
+
+    def _statuses(self):
+        return dict(UserRelationship.objects.filter(followed=self.me).values_list('follower_id', 'status'))
+
+    def test_approve_returns_outcome_per_id(self):
+        from ramen_log.models import RamenLog, TimelineEntry
+        from users.models import ResourceVersion
+        RamenLog.objects.create(user=self.me, shop_name='一蘭', ordered_item='ラーメン')
+        ids = [self.requesters[0].id, self.requesters[1].id, self.approved.id, 999999]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'action': 'approve', 'user_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(response.data['results'], [
+            {'user_id': self.requesters[0].id, 'result': 'approved'},
+            {'user_id': self.requesters[1].id, 'result': 'approved'},
+            {'user_id': self.approved.id, 'result': 'not_pending'},
+            {'user_id': 999999, 'result': 'not_pending'},
+        ])
+        statuses = self._statuses()
+        self.assertEqual(statuses[self.requesters[0].id], UserRelationship.STATUS_APPROVED)
+        self.assertEqual(statuses[self.requesters[2].id], UserRelationship.STATUS_PENDING)
+        # 承認されたフォロワーのタイムラインと一覧の番号もまとめて更新される
+        self.assertEqual(set(TimelineEntry.objects.values_list('owner_id', flat=True)), {self.requesters[0].id, self.requesters[1].id})
+        self.assertEqual(
+            set(ResourceVersion.objects.filter(resource='following').values_list('user_id', flat=True)),
+            {self.requesters[0].id, self.requesters[1].id},
+        )
+
+    def test_deny_all_pending(self):
+        response = self.client.patch(self.url, {'action': 'deny', 'all_pending': True}, format='json')
+        self.assertEqual(response.data['updated'], 6)
+        self.assertEqual({row['result'] for row in response.data['results']}, {'denied'})
+        statuses = self._statuses()
+        self.assertEqual(statuses.pop(self.approved.id), UserRelationship.STATUS_APPROVED)
+        self.assertEqual(set(statuses.values()), {UserRelationship.STATUS_DENIED})
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        from ramen_log.models import RamenLog
+        RamenLog.objects.create(user=self.me, shop_name='一蘭', ordered_item='ラーメン')
+        # セーブポイントの作成と解放、ロックとID取得、UPDATE、タイムライン (プル配信の確認、ログの取得、一括INSERT)、
+        # おすすめの再計算の記録
+        with self.assertNumQueries(8):
+            self.client.patch(self.url, {'action': 'approve', 'all_pending': True}, format='json')
+
+    def test_requires_exactly_one_target(self):
+        for data in ({'action': 'approve'}, {'action': 'approve', 'user_ids': [1], 'all_pending': True}):
+            response = self.client.patch(self.url, data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class FollowRecommendationTest(APITestCase):
+    def setUp(self):
+        from ramen_log.models import RamenLog
+        from ramen_log.shops import resolve_shop_id
+        User = get_user_model()
+        self.me, self.b, self.c, self.d, self.e, self.g = (
+            User.objects.create_user(username=name, password='pass') for name in ('me', 'b', 'c', 'd', 'e', 'g')
+        )
+        approved = UserRelationship.STATUS_APPROVED
+        for follower, followed in [
+            (self.me, self.b), (self.me, self.c),
+            (self.b, self.d), (self.c, self.d), (self.b, self.e), (self.b, self.g), (self.b, self.me),
+        ]:
+            UserRelationship.objects.create(follower=follower, followed=followed, status=approved)
+        # 申請中の相手はおすすめに出さない
+        UserRelationship.objects.create(follower=self.me, followed=self.e)
+        for shop_name in ('一蘭', '天下一品', '蒙古タンメン中本'):
+            for user in (self.me, self.g):
+                RamenLog.objects.create(user=user, shop_name=shop_name, shop_id=resolve_shop_id(shop_name), ordered_item='ラーメン')
+        self.client.force_authenticate(user=self.me)
+
+    def test_ranks_friends_of_friends_by_mutual_follows_and_shared_shops(self):
+        from .recommendations import refresh
+        self.assertEqual(refresh(), 6)
+        response = self.client.get(reverse('follow-recommendations'))
+        self.assertEqual(response.status_code, 200)
+        # g: 共通のフォロー1人 + 0.5 x 共通の店3軒、d: 共通のフォロー2人
+        self.assertEqual(
+            [(row['recommended']['username'], row['rank'], row['score'], row['mutual_count'], row['shared_shop_count'])
+             for row in response.data],
+            [('g', 1, 2.5, 1, 3), ('d', 2, 2.0, 2, 0)],
+        )
+        # 計算後にフォローした相手は、次の計算を待たずに除かれる
+        UserRelationship.objects.create(follower=self.me, followed=self.g)
+        response = self.client.get(reverse('follow-recommendations'))
+        self.assertEqual([row['recommended']['username'] for row in response.data], ['d'])
+
+    def test_unfollow_marks_user_and_followers_for_incremental_refresh(self):
+        from .models import StaleRecommendation
+        from .recommendations import refresh, refresh_stale
+        refresh()
+        self.client.delete(reverse('unfollow', args=[self.c.id]))
+        # 本人と、本人をフォローしている b
+        self.assertEqual(set(StaleRecommendation.objects.values_list('user_id', flat=True)), {self.me.id, self.b.id})
+        self.assertEqual(refresh_stale(), 2)
+        self.assertFalse(StaleRecommendation.objects.exists())
+        response = self.client.get(reverse('follow-recommendations'))
+        self.assertEqual([(row['recommended']['username'], row['mutual_count']) for row in response.data], [('g', 1), ('d', 1)])
+
+
+@override_settings(IKITAI_EVENT_BROKER='user_relationships.ikitai_events.LocalBroker')
+class IkitaiEventStreamTest(APITransactionTestCase):
+    """「ラーメンイキタイ」の通知の SSE (接続時の読み込みを別スレッドで行うため、TransactionTestCase を使う)"""
+
+    def setUp(self):
+        from users.authentication import user_cache
+        from . import ikitai_events
+        user_cache.clear()
+        # Hub はテストごとのイベントループで作り直す
+        ikitai_events._hub = ikitai_events._broker = None
+        User = get_user_model()
+        self.me, self.friend, self.stranger = (
+            User.objects.create_user(username=name, password='pass') for name in ('me', 'friend', 'stranger')
+        )
+        UserRelationship.objects.create(follower=self.me, followed=self.friend, status=UserRelationship.STATUS_APPROVED)
+        UserRelationship.objects.create(follower=self.me, followed=self.stranger)
+        self.app = ikitai_events.EventStreamMiddleware(None)
+
+    def _connect(self, user=None, method='GET', token=None):
+        from asgiref.testing import ApplicationCommunicator
+        from rest_framework_simplejwt.tokens import AccessToken
+        token = token or (AccessToken.for_user(user) if user else None)
+        headers = [(b'authorization', f'Bearer {token}'.encode())] if token else []
+        return ApplicationCommunicator(self.app, {
+            'type': 'http', 'method': method, 'path': '/api/relationships/ikitai/events/',
+            'query_string': b'', 'headers': headers,
+        })
+
+    async def _events(self, communicator, count):
+        events = []
+        while len(events) < count:
+            message = await communicator.receive_output(timeout=5)
+            lines = message.get('body', b'').decode().splitlines()
+            if lines and lines[0].startswith('event: '):
+                events.append((lines[0][len('event: '):], json.loads(lines[1][len('data: '):])))
+        return events
+
+    def _post_ikitai(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            reverse('ikitai-status'), {'latitude': 35.0, 'longitude': 139.0, 'duration_type': 'now'},
+            content_type='application/json',
+        )
+        self.assertIn(response.status_code, (200, 201))
+
+    async def test_followers_receive_snapshot_and_changes(self):
+        await IkitaiStatus.objects.acreate(
+            user=self.friend, latitude=35.0, longitude=139.0, expires_at=timezone.now() + timedelta(hours=1),
+        )
+        communicator = self._connect(self.me)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(timeout=5)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), start['headers'])
+        [(name, snapshot)] = await self._events(communicator, 1)
+        self.assertEqual((name, [status['user']['username'] for status in snapshot]), ('snapshot', ['friend']))
+
+        # 承認されていない相手 (stranger) の変化は届かない
+        await sync_to_async(self._post_ikitai)(self.stranger)
+        await sync_to_async(self.client.delete)(reverse('ikitai-status'))
+        await sync_to_async(self._post_ikitai)(self.friend)
+        await sync_to_async(self.client.delete)(reverse('ikitai-status'))
+        (on, on_data), (off, off_data) = await self._events(communicator, 2)
+        self.assertEqual((on, on_data['user_id'], on_data['status']['user']['username']), ('ikitai', self.friend.id, 'friend'))
+        self.assertEqual((off, off_data), ('ikitai_off', {'user_id': self.friend.id}))
+
+        # 切断すると、配信先から外れる
+        from . import ikitai_events
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(timeout=5)
+        self.assertEqual(dict(ikitai_events.get_hub().subscribers), {})
+
+    async def test_changes_during_snapshot_are_sent_after_it(self):
+        # snapshot を読み込む直前にコミットされた変化も、snapshot の後に届く
+        snapshot = self.app._snapshot
+
+        def post_then_snapshot(author_ids):
+            self._post_ikitai(self.friend)
+            return snapshot(author_ids)
+
+        with mock.patch.object(self.app, '_snapshot', post_then_snapshot):
+            communicator = self._connect(self.me)
+            (name, data), (on, on_data) = await self._events(communicator, 2)
+        self.assertEqual((name, [status['user']['username'] for status in data]), ('snapshot', ['friend']))
+        self.assertEqual((on, on_data['user_id']), ('ikitai', self.friend.id))
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(timeout=5)
+
+    async def test_expiry_is_pushed_without_polling(self):
+        await IkitaiStatus.objects.acreate(
+            user=self.friend, latitude=35.0, longitude=139.0, expires_at=timezone.now() + timedelta(seconds=0.5),
+        )
+        communicator = self._connect(self.me)
+        (_, snapshot), (name, data) = await self._events(communicator, 2)
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual((name, data), ('ikitai_expired', {'user_id': self.friend.id}))
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(timeout=5)
+
+    async def _closed(self, communicator):
+        """最後のメッセージ (more_body が False) まで読み、それまでに届いたイベントの名前を返す"""
+        names = []
+        while True:
+            message = await communicator.receive_output(timeout=5)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                return names
+            if message.get('body', b'').startswith(b'event: '):
+                names.append(message['body'].decode().split('\n')[0][len('event: '):])
+
+    async def test_stream_ends_when_token_expires(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        token = AccessToken.for_user(self.me)
+        token.set_exp(lifetime=timedelta(seconds=1))
+        communicator = self._connect(token=token)
+        self.assertEqual((await communicator.receive_output(timeout=5))['status'], 200)
+        self.assertEqual(await self._closed(communicator), ['snapshot'])
+        await communicator.wait(timeout=5)
+
+    async def test_unfollow_and_account_deletion_close_streams(self):
+        from users import account_deletion
+        for close in (
+            lambda: self.client.delete(reverse('unfollow', args=[self.friend.id])),
+            lambda: account_deletion.request_deletion(self.me),
+        ):
+            communicator = self._connect(self.me)
+            self.assertEqual((await communicator.receive_output(timeout=5))['status'], 200)
+            await self._events(communicator, 1)
+            self.client.force_authenticate(user=self.me)
+            await sync_to_async(close)()
+            self.assertEqual(await self._closed(communicator), [])
+            await communicator.wait(timeout=5)
+        from . import ikitai_events
+        self.assertEqual(dict(ikitai_events.get_hub().connections), {})
+
+    async def test_follow_approval_closes_follower_streams(self):
+        # 承認されたフォロワーは、つなぎ直すと承認したユーザーの通知も受け取る
+        for approve in (
+            lambda: self.client.patch(reverse('follow-approve', args=[self.me.id]), {'action': 'approve'}),
+            lambda: self.client.patch(reverse('follow-approve-batch'), {'action': 'approve', 'user_ids': [self.me.id]}, format='json'),
+        ):
+            communicator = self._connect(self.me)
+            self.assertEqual((await communicator.receive_output(timeout=5))['status'], 200)
+            await self._events(communicator, 1)
+            self.client.force_authenticate(user=self.stranger)
+            await sync_to_async(approve)()
+            self.assertEqual(await self._closed(communicator), [])
+            await communicator.wait(timeout=5)
+            await UserRelationship.objects.filter(follower=self.me, followed=self.stranger).aupdate(
+                status=UserRelationship.STATUS_PENDING,
+            )
+        from . import ikitai_events
+        self.assertEqual(dict(ikitai_events.get_hub().connections), {})
+
+    async def test_requires_authentication(self):
+        communicator = self._connect()
+        start = await communicator.receive_output(timeout=5)
+        body = await communicator.receive_output(timeout=5)
+        self.assertEqual((start['status'], json.loads(body['body'])['detail']), (401, 'Authentication credentials were not provided.'))
+        self.assertIn((b'www-authenticate', b'Bearer realm="api"'), start['headers'])
+        communicator = self._connect(self.me, method='POST')
+        self.assertEqual((await communicator.receive_output(timeout=5))['status'], 405)
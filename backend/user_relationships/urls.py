@@ -3,11 +3,14 @@ from django.urls import path
 from .views import (
     FollowRequestView,
     FollowApprovalView,
+    FollowBatchApprovalView,
     UnfollowView,
     FollowingListView,
     FollowerListView,
     PendingFollowRequestListView,
     IkitaiStatusView,
+    IkitaiNearbyView,
+    FollowRecommendationListView,
 )
 
 urlpatterns = [
@@ -18,6 +21,10 @@ urlpatterns = [
     # user_id は、フォローリクエストを送ってきたユーザーのID
     path('approve/<int:user_id>/', FollowApprovalView.as_view(), name='follow-approve'),
 
+    # フォローリクエストの一括承認/拒否 (PATCH /api/relationships/approve/batch/)
+    # ボディは {"action": "approve" | "deny", "user_ids": [...]} または {"action": ..., "all_pending": true}
+    path('approve/batch/', FollowBatchApprovalView.as_view(), name='follow-approve-batch'),
+
     # フォローの解除 (DELETE /api/relationships/unfollow/<int:user_id>/)
     # user_id は、アンフォローしたいユーザーのID
     path('unfollow/<int:user_id>/', UnfollowView.as_view(), name='unfollow'),
@@ -33,4 +40,10 @@ urlpatterns = [
 
     # 「ラーメンイキタイ」状態の取得(GET)/ON(POST)/OFF(DELETE)
     path('ikitai/', IkitaiStatusView.as_view(), name='ikitai-status'),
+
+    # 近くで「ラーメンイキタイ」状態のフォロー中ユーザーの一覧 (GET /api/relationships/ikitai/nearby/)
+    path('ikitai/nearby/', IkitaiNearbyView.as_view(), name='ikitai-nearby'),
+
+    # おすすめユーザー (知り合いかも) の一覧 (GET /api/relationships/recommendations/)
+    path('recommendations/', FollowRecommendationListView.as_view(), name='follow-recommendations'),
 ]
\ No newline at end of file
@@ -1,13 +1,21 @@
 # relationships/views.py
+import operator
+from functools import reduce
+
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
 
-from .models import UserRelationship, IkitaiStatus
-from .serializers import UserRelationshipSerializer, UserSerializer, FollowRequestSerializer, FollowApprovalSerializer, IkitaiStatusSerializer, IkitaiStatusCreateSerializer
+from ramen_log import timeline
+from users import versions
+
+from . import geo, ikitai_events, recommendations
+from .models import UserRelationship, IkitaiStatus, FollowRecommendation
+from .serializers import UserRelationshipSerializer, RELATIONSHIP_LIST_VALUES, serialize_relationship_rows, UserSerializer, FollowRequestSerializer, FollowApprovalSerializer, FollowBatchApprovalSerializer, IkitaiStatusSerializer, IkitaiStatusCreateSerializer, IkitaiNearbyQuerySerializer, IkitaiNearbySerializer, FollowRecommendationSerializer, RECOMMENDATION_LIST_VALUES, serialize_recommendation_rows
 
 User = get_user_model()
 
@@ -41,6 +49,7 @@ class FollowRequestView(generics.CreateAPIView):
                 followed=followed_user,
                 status=UserRelationship.STATUS_PENDING # 初期ステータスは保留中
             )
+            versions.bump(followed_user.id, versions.Resource.PENDING_REQUESTS)
             response_serializer = UserRelationshipSerializer(relationship)
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
         except IntegrityError:
@@ -98,10 +107,75 @@ class FollowApprovalView(generics.UpdateAPIView):
             return Response({'detail': '無効なアクションです。'}, status=status.HTTP_400_BAD_REQUEST)
 
         relationship.save()
+        versions.bump(request.user.id, versions.Resource.PENDING_REQUESTS)
+        if relationship.status == UserRelationship.STATUS_APPROVED:
+            versions.bump(request.user.id, versions.Resource.FOLLOWERS)
+            versions.bump(relationship.follower_id, versions.Resource.FOLLOWING)
+            # 承認したユーザーの最近のログを、フォロワーのタイムラインに追加する
+            timeline.backfill_author(owner=relationship.follower, author=request.user)
+            recommendations.mark_stale([relationship.follower_id])
+            # フォロワーの SSE の接続は承認前のフォロー先で購読しているため、閉じてつなぎ直させる
+            ikitai_events.publish(ikitai_events.REVOKE, relationship.follower_id)
         response_serializer = UserRelationshipSerializer(relationship)
         return Response({'detail': message, 'relationship': response_serializer.data}, status=status_code)
 
 
+# --- フォロー一括承認機能 ---
+class FollowBatchApprovalView(generics.GenericAPIView):
+    """
+    受信したフォローリクエストをまとめて承認または拒否するAPI。
+    user_ids で指定したユーザー (または all_pending で保留中のすべて) からのリクエストを、
+    1回の UPDATE で更新し、ユーザーごとの結果を返す。
+    保留中のリクエストがないユーザーの結果は 'not_pending' になる。
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = FollowBatchApprovalSerializer
+    http_method_names = ['patch'] # PATCHメソッドのみを許可
+
+    def patch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        action = serializer.validated_data['action'] # 'approve' or 'deny'
+        requested_ids = list(dict.fromkeys(serializer.validated_data.get('user_ids', [])))
+        if action == 'approve':
+            new_status, outcome = UserRelationship.STATUS_APPROVED, 'approved'
+        else:
+            new_status, outcome = UserRelationship.STATUS_DENIED, 'denied'
+
+        pending = UserRelationship.objects.filter(followed=request.user, status=UserRelationship.STATUS_PENDING)
+        if requested_ids:
+            pending = pending.filter(follower_id__in=requested_ids)
+        with transaction.atomic():
+            # 更新する行をロックしてIDを取得し、保留中のものだけを1回の UPDATE で更新する
+            updated_ids = list(pending.order_by().select_for_update().values_list('follower_id', flat=True))
+            if updated_ids:
+                UserRelationship.objects.filter(
+                    followed=request.user,
+                    follower_id__in=updated_ids,
+                    status=UserRelationship.STATUS_PENDING,
+                ).update(status=new_status, updated_at=timezone.now())
+                # 一覧の番号とタイムラインも、ユーザーごとではなくまとめて更新する
+                if new_status == UserRelationship.STATUS_APPROVED:
+                    versions.bump(request.user.id, versions.Resource.PENDING_REQUESTS, versions.Resource.FOLLOWERS)
+                    versions.bump_many(updated_ids, versions.Resource.FOLLOWING)
+                    # 承認したユーザーの最近のログを、フォロワー全員のタイムラインにまとめて追加する
+                    timeline.backfill_author_for_owners(updated_ids, author=request.user)
+                    recommendations.mark_stale(updated_ids)
+                    # フォロワーの SSE の接続を閉じて、承認したユーザーも含めて購読し直させる
+                    for follower_id in updated_ids:
+                        ikitai_events.publish(ikitai_events.REVOKE, follower_id)
+                else:
+                    versions.bump(request.user.id, versions.Resource.PENDING_REQUESTS)
+
+        updated = set(updated_ids)
+        results = [
+            {'user_id': user_id, 'result': outcome if user_id in updated else 'not_pending'}
+            for user_id in (requested_ids or updated_ids)
+        ]
+        message = 'フォローリクエストを承認しました。' if outcome == 'approved' else 'フォローリクエストを拒否しました。'
+        return Response({'detail': message, 'updated': len(updated_ids), 'results': results}, status=status.HTTP_200_OK)
+
+
 # --- フォロー削除機能 (アンフォロー) ---
 class UnfollowView(generics.DestroyAPIView):
     """
@@ -130,57 +204,96 @@ class UnfollowView(generics.DestroyAPIView):
                 status=UserRelationship.STATUS_APPROVED # 承認済みのフォローのみ削除対象
             )
             relationship.delete()
+            versions.bump(request.user.id, versions.Resource.FOLLOWING)
+            versions.bump(followed_user.id, versions.Resource.FOLLOWERS)
+            # アンフォローしたユーザーのログを自分のタイムラインから取り除く
+            timeline.retract_author(owner=request.user, author=followed_user)
+            recommendations.mark_stale([request.user.id])
+            # SSE の接続はフォローしているユーザーを接続時に決めるため、閉じてつなぎ直させる
+            ikitai_events.publish(ikitai_events.REVOKE, request.user.id)
             return Response(status=status.HTTP_204_NO_CONTENT) # 成功時はコンテンツなし
         except UserRelationship.DoesNotExist:
             return Response({'detail': 'このユーザーをフォローしていません。または保留中のリクエストです。'}, status=status.HTTP_404_NOT_FOUND)
 
 
-# --- 一覧表示機能 (自分がフォローしているユーザー一覧) ---
-class FollowingListView(generics.ListAPIView):
+# --- おすすめユーザー (知り合いかも) ---
+class FollowRecommendationListView(generics.ListAPIView):
     """
-    ログイン中のユーザーがフォローしている（承認済み）ユーザーの一覧を表示するAPI。
+    ログイン中のユーザーへのおすすめユーザー (友達の友達) をスコアの高い順に表示するAPI。
+    おすすめは refresh_recommendations コマンドで事前に計算したものを (user, rank) のインデックスで読むだけ。
+    計算後にフォローの関係ができた相手は、読み込み時に除く。
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = FollowRecommendationSerializer
+
+    def get_queryset(self):
+        related = UserRelationship.objects.filter(follower=self.request.user, followed=OuterRef('recommended'))
+        return FollowRecommendation.objects.filter(user=self.request.user).exclude(Exists(related)).order_by('rank')
+
+    def list(self, request, *args, **kwargs):
+        rows = self.get_queryset().values(*RECOMMENDATION_LIST_VALUES)
+        return Response(serialize_recommendation_rows(rows))
+
+
+# --- 一覧表示機能の共通部分 ---
+class RelationshipListView(versions.ConditionalListMixin, generics.ListAPIView):
+    """
+    フォロー関係の一覧APIの基底クラス。
+    follower / followed の両方を values() の1クエリで取得し、
+    UserRelationshipSerializer と同じ形のレスポンスを直接組み立てる。
+    サブクラスは version_resource を指定し、ETag による条件付き GET に対応する。
     """
     permission_classes = [IsAuthenticated]
     serializer_class = UserRelationshipSerializer
 
+    def list(self, request, *args, **kwargs):
+        rows = self.filter_queryset(self.get_queryset()).values(*RELATIONSHIP_LIST_VALUES)
+        return Response(serialize_relationship_rows(rows))
+
+
+# --- 一覧表示機能 (自分がフォローしているユーザー一覧) ---
+class FollowingListView(RelationshipListView):
+    """
+    ログイン中のユーザーがフォローしている（承認済み）ユーザーの一覧を表示するAPI。
+    """
+    version_resource = versions.Resource.FOLLOWING
+
     def get_queryset(self):
         # ログインしているユーザーがフォローしている、かつ承認済みの関係のみを返す
         return UserRelationship.objects.filter(
             follower=self.request.user,
             status=UserRelationship.STATUS_APPROVED
-        ).select_related('followed') # followedユーザーの情報を効率的に取得
+        ).select_related('follower', 'followed') # 両側のユーザー情報を効率的に取得
 
 
 # --- 一覧表示機能 (自分をフォローしているユーザー一覧) ---
-class FollowerListView(generics.ListAPIView):
+class FollowerListView(RelationshipListView):
     """
     ログイン中のユーザーをフォローしている（承認済み）ユーザーの一覧を表示するAPI。
     """
-    permission_classes = [IsAuthenticated]
-    serializer_class = UserRelationshipSerializer
+    version_resource = versions.Resource.FOLLOWERS
 
     def get_queryset(self):
         # ログインしているユーザーをフォローしている、かつ承認済みの関係のみを返す
         return UserRelationship.objects.filter(
             followed=self.request.user,
             status=UserRelationship.STATUS_APPROVED
-        ).select_related('follower') # followerユーザーの情報を効率的に取得
+        ).select_related('follower', 'followed') # 両側のユーザー情報を効率的に取得
 
 
 # --- フォローリクエスト一覧表示機能 ---
-class PendingFollowRequestListView(generics.ListAPIView):
+class PendingFollowRequestListView(RelationshipListView):
     """
     ログイン中のユーザーへの保留中のフォローリクエスト一覧を表示するAPI。
     """
-    permission_classes = [IsAuthenticated]
-    serializer_class = UserRelationshipSerializer
+    version_resource = versions.Resource.PENDING_REQUESTS
 
     def get_queryset(self):
         # ログインしているユーザーへの保留中のフォローリクエストを返す
         return UserRelationship.objects.filter(
             followed=self.request.user,
             status=UserRelationship.STATUS_PENDING
-        ).select_related('follower')
+        ).select_related('follower', 'followed')
 
 
 # --- 「ラーメンイキタイ」機能 ---
@@ -199,8 +312,8 @@ class IkitaiStatusView(generics.GenericAPIView):
 
     def get_object(self):
         try:
-            # ログインユーザーのIkitaiStatusオブジェクトを取得
-            return IkitaiStatus.objects.get(user=self.request.user)
+            # ログインユーザーのIkitaiStatusオブジェクトを取得 (期限切れなら「状態なし」)
+            return IkitaiStatus.objects.active().get(user=self.request.user)
         except IkitaiStatus.DoesNotExist:
             return None
 
@@ -236,6 +349,8 @@ class IkitaiStatusView(generics.GenericAPIView):
             user=request.user,
             defaults={'latitude': data['latitude'], 'longitude': data['longitude'], 'expires_at': expires_at}
         )
+        # フォロワーの SSE の接続に通知する (ikitai_events.py)
+        ikitai_events.publish(ikitai_events.ON, request.user.id, ikitai_status)
 
         response_serializer = IkitaiStatusSerializer(ikitai_status)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
@@ -245,4 +360,47 @@ class IkitaiStatusView(generics.GenericAPIView):
         instance = self.get_object()
         if instance:
             instance.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+            ikitai_events.publish(ikitai_events.OFF, request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class IkitaiNearbyView(generics.ListAPIView):
+    """
+    指定地点の近くで「ラーメンイキタイ」状態になっている、承認済みフォロー中ユーザーの一覧を返すAPI。
+    エンドポイント: GET /api/relationships/ikitai/nearby/?latitude=..&longitude=..&radius=..&limit=..
+
+    geohash セルの前方一致で SQL 側の粗い絞り込みを行い (インデックス使用)、
+    正確な距離は絞り込んだ候補にだけ計算して近い順に返す。
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = IkitaiNearbySerializer
+
+    def list(self, request, *args, **kwargs):
+        query = IkitaiNearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        latitude = params['latitude']
+        longitude = params['longitude']
+        radius = params['radius']
+
+        cells = geo.covering_cells(latitude, longitude, radius)
+        in_cells = reduce(operator.or_, (Q(geohash__startswith=cell) for cell in cells))
+        followees = UserRelationship.objects.filter(
+            follower=request.user,
+            status=UserRelationship.STATUS_APPROVED
+        ).values('followed_id')
+        candidates = IkitaiStatus.objects.active().filter(
+            in_cells,
+            user_id__in=followees,
+        ).select_related('user')
+
+        nearby = []
+        for candidate in candidates:
+            distance = geo.haversine_m(latitude, longitude, candidate.latitude, candidate.longitude)
+            if distance <= radius:
+                candidate.distance = round(distance, 1)
+                nearby.append(candidate)
+        nearby.sort(key=lambda s: s.distance)
+
+        serializer = self.get_serializer(nearby[:params['limit']], many=True)
+        return Response(serializer.data)
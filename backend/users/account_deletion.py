@@ -0,0 +1,204 @@
+# users/account_deletion.py
+"""
+退会 (アカウントの削除)。
+
+ユーザーを CASCADE でそのまま削除すると、ログやフォロー関係などの関連する行をすべて1つのトランザクションで
+集めて削除するため、ログの多いユーザーではロックを長く持ち、リクエストもタイムアウトする。
+そのため退会のリクエストではユーザーを無効にして (ログインできなくなる) AccountDeletion を作成するだけにし、
+purge_accounts コマンド (cron などで数分ごとに実行する) が STEPS の順に batch_size 件ずつ削除する。
+
+- 1回の削除と進み具合 (AccountDeletion.step / deleted) の記録は同じトランザクションで行い、途中で止まっても続きから再開できる
+- ワーカーは locked_until まで1件のジョブを占有し、1回削除するごとに延長する (止まったワーカーのジョブは期限後に引き継がれる)
+- フォロー関係を最初に削除し、相手の一覧の ETag やおすすめもその場で更新する
+- 最後に残った行 (STEPS にないもの) は、ユーザーの削除の CASCADE で削除される
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ramen_log import shops
+from ramen_log.models import (
+    RamenCalendarMonth, RamenLog, RamenLogSyncCounter, RamenLogTombstone, RamenStats, RamenStatsCounter,
+    TimelineEntry, TimelinePullAuthor,
+)
+from user_relationships import ikitai_events, recommendations
+from user_relationships.models import FollowRecommendation, IkitaiStatus, StaleRecommendation, UserRelationship
+
+from . import versions
+from .models import AccountDeletion, ResourceVersion, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+# ワーカーがジョブを占有する期間 (1回の削除ごとに延長する)
+LEASE = timedelta(minutes=5)
+# これだけ失敗したジョブは自動では再試行しない (last_error を確認して attempts を戻す)
+MAX_ATTEMPTS = 5
+# STEPS をすべて終え、ユーザーの削除だけが残っている
+USER_STEP = 'user'
+
+
+def _bump_counterparts(user_ids):
+    """フォロー関係を削除した相手の一覧の番号を増やす"""
+    versions.bump_many(set(user_ids), versions.Resource.FOLLOWING, versions.Resource.FOLLOWERS, versions.Resource.PENDING_REQUESTS)
+
+
+def _followers_removed(rows):
+    _bump_counterparts(rows)
+    # フォローしていたユーザーの共通のフォロー数が変わる
+    recommendations.mark_stale(set(rows))
+
+
+def _logs_removed(rows):
+    shops.record_visits(rows, sign=-1)
+
+
+class Step:
+    """
+    model の field がユーザーである行を削除するステップ。
+    before_delete を指定すると、削除する行の related の値の一覧を渡して、削除と同じトランザクションで呼ぶ。
+    """
+
+    def __init__(self, name, model, field, related=None, before_delete=None):
+        self.name = name
+        self.model = model
+        self.field = field
+        self.related = related
+        self.before_delete = before_delete
+
+    def delete_batch(self, user_id, batch_size):
+        """batch_size 件まで削除し、削除した件数を返す (トランザクションの中で呼ぶ)"""
+        # 並び順は指定しない (field のインデックスを先頭から読み、LIMIT で止める)
+        queryset = self.model.objects.filter(**{self.field: user_id})
+        if self.related is None:
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        else:
+            rows = list(queryset.values_list('pk', self.related)[:batch_size])
+            pks = [pk for pk, _ in rows]
+            if rows:
+                self.before_delete([value for _, value in rows])
+        if not pks:
+            return 0
+        self.model.objects.filter(pk__in=pks).delete()
+        return len(pks)
+
+
+STEPS = (
+    Step('ikitai', IkitaiStatus, 'user'),
+    Step('following', UserRelationship, 'follower', 'followed_id', _bump_counterparts),
+    Step('followers', UserRelationship, 'followed', 'follower_id', _followers_removed),
+    Step('recommended', FollowRecommendation, 'recommended'),
+    Step('recommendations', FollowRecommendation, 'user'),
+    Step('stale_recommendation', StaleRecommendation, 'user'),
+    # フォロワーのタイムラインから先に取り除く
+    Step('timeline_authored', TimelineEntry, 'author'),
+    Step('timeline', TimelineEntry, 'owner'),
+    Step('timeline_pull', TimelinePullAuthor, 'user'),
+    Step('ramen_logs', RamenLog, 'user', 'shop_id', _logs_removed),
+    Step('ramen_stats_counters', RamenStatsCounter, 'user'),
+    Step('ramen_stats', RamenStats, 'user'),
+    Step('ramen_calendar', RamenCalendarMonth, 'user'),
+    Step('ramen_log_tombstones', RamenLogTombstone, 'user'),
+    Step('ramen_log_sync', RamenLogSyncCounter, 'user'),
+    Step('resource_versions', ResourceVersion, 'user'),
+)
+
+
+def request_deletion(user):
+    """
+    退会を受け付ける。ユーザーをその場で無効にし (認証のキャッシュも post_save で消える)、
+    「ラーメンイキタイ」状態を OFF にして、削除ジョブを作成する。
+    接続中の「ラーメンイキタイ」の通知 (SSE) も閉じる (トークンの期限まで残さない)。
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        if IkitaiStatus.objects.filter(user_id=user.id).delete()[0]:
+            ikitai_events.publish(ikitai_events.OFF, user.id)
+        ikitai_events.publish(ikitai_events.REVOKE, user.id)
+        job, _ = AccountDeletion.objects.get_or_create(user_id=user.id)
+    return job
+
+
+def claim(exclude=()):
+    """未完了のジョブを1件占有して返す (なければ None)。別のワーカーが占有中のジョブと exclude のジョブは飛ばす"""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            AccountDeletion.objects.select_for_update(skip_locked=True)
+            .filter(finished_at__isnull=True, attempts__lt=MAX_ATTEMPTS)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .exclude(pk__in=exclude)
+            .order_by('requested_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.locked_until = now + LEASE
+        job.save(update_fields=['locked_until', 'updated_at'])
+    return job
+
+
+def run(job, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    job の続きから削除する。最後まで削除したら True、max_batches 回削除して止めたら False を返す
+    (止めたジョブは占有を外し、次の実行で続きから処理される)。
+    """
+    names = [step.name for step in STEPS]
+    index = names.index(job.step) if job.step in names else (len(STEPS) if job.step == USER_STEP else 0)
+    batches = 0
+    while index < len(STEPS):
+        if max_batches is not None and batches >= max_batches:
+            _release(job)
+            return False
+        step = STEPS[index]
+        with transaction.atomic():
+            count = step.delete_batch(job.user_id, batch_size)
+            job.deleted[step.name] = job.deleted.get(step.name, 0) + count
+            if count < batch_size:
+                # このステップは終わったため、次のステップから再開させる
+                index += 1
+            job.step = names[index] if index < len(STEPS) else USER_STEP
+            job.locked_until = timezone.now() + LEASE
+            job.save(update_fields=['step', 'deleted', 'locked_until', 'updated_at'])
+        batches += 1
+    with transaction.atomic():
+        User.objects.filter(id=job.user_id).delete()
+        job.finished_at = timezone.now()
+        job.locked_until = None
+        job.save(update_fields=['finished_at', 'locked_until', 'updated_at'])
+    return True
+
+
+def _release(job, error=None):
+    """占有を外す。error を渡すと失敗として記録する"""
+    job.locked_until = None
+    fields = ['locked_until', 'updated_at']
+    if error is not None:
+        job.attempts += 1
+        job.last_error = error
+        fields += ['attempts', 'last_error']
+    job.save(update_fields=fields)
+
+
+def purge(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """
+    未完了のジョブを順に処理し、最後まで削除したジョブの数を返す。
+    max_batches はジョブごとの1回の実行での削除の回数の上限 (多くのジョブを少しずつ進めたいときに指定する)。
+    """
+    finished = 0
+    seen = []
+    while True:
+        job = claim(exclude=seen)
+        if job is None:
+            return finished
+        seen.append(job.pk)
+        try:
+            finished += run(job, batch_size, max_batches)
+        except Exception as exc:
+            # このジョブは次の実行で続きから再試行する (他のジョブは続けて処理する)
+            logger.exception('account deletion %s failed', job.pk)
+            _release(job, error=repr(exc))
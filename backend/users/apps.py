@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        # ユーザーの変更時に、認証キャッシュから取り除くシグナルを登録する
+        from . import authentication  # noqa: F401
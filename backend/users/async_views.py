@@ -0,0 +1,109 @@
+# users/async_views.py
+"""
+ASGI で動かすときの、よく呼ばれる読み取りAPIの非同期版の基底クラス。
+
+DRF のビューは同期のため、ASGI ではリクエストごとにスレッドで実行され、DBの待ち時間の間もスレッドを占有する。
+AsyncAPIView は対応する DRF のビュー (sync_view) と同じレスポンスを、非同期 ORM と
+CachedJWTAuthentication.aauthenticate() で返す。非同期版を用意していないメソッド (書き込みや OPTIONS) は
+sync_view にそのまま渡すため、URL ごと差し替えられる (ramen_project/asgi_urls.py)。
+
+レスポンスは JSON と MessagePack (Accept で選ぶ。ramen_project/renderers.py) に対応する
+(Browsable API は同期版の URL で使う)。
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.generic import View
+from rest_framework import exceptions
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from ramen_project.renderers import JSONRenderer, MessagePackRenderer
+
+from . import versions
+from .authentication import CachedJWTAuthentication
+
+
+class AsyncAPIView(View):
+    """
+    sync_view (DRF のビュー) の一部のメソッドを非同期で処理するビュー。
+    サブクラスは async def get(self, request, view, *args, **kwargs) を定義し、DRF の Response を返す。
+    request は DRF の Request、view は request を設定した sync_view のインスタンスで、
+    get_queryset() やページネーションをそのまま使える (DBを読むのは非同期 ORM で行うこと)。
+    sync_view に version_resource があれば、ConditionalListMixin と同じ条件付き GET を行う。
+    ログインが必要なAPI (IsAuthenticated) のみを対象とする。
+    """
+    sync_view = None
+    sync_handler = None
+    authenticator = CachedJWTAuthentication()
+    renderers = [JSONRenderer(), MessagePackRenderer()]
+    negotiator = DefaultContentNegotiation()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(sync_handler=sync_to_async(cls.sync_view.as_view()), **initkwargs)
+        # DRF のビューと同じく CSRF の検証を行わない (csrf_exempt() は Django 4.2 では非同期のビューに使えない)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if not iscoroutinefunction(handler):
+            # 非同期版のないメソッドは、DRF のビューをスレッドで実行する
+            return await self.sync_handler(request, *args, **kwargs)
+
+        try:
+            request = await self.authenticate(request)
+            view = self.sync_view(request=request, args=args, kwargs=kwargs, format_kwarg=None)
+            resource = getattr(self.sync_view, 'version_resource', None)
+            if resource is None:
+                return self.render(request, await handler(request, view, *args, **kwargs))
+
+            version, _ = await versions.acurrent(request.user.pk, resource)
+            etag = versions.make_etag(request, resource, version)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = self.render(request, await handler(request, view, *args, **kwargs))
+            return versions.patch_response(response, etag)
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+    async def authenticate(self, django_request):
+        """認証して、ユーザーを設定した DRF の Request を返す。認証情報がなければ NotAuthenticated"""
+        result = await self.authenticator.aauthenticate(django_request)
+        if result is None:
+            raise exceptions.NotAuthenticated()
+        request = Request(django_request)
+        request.user, request.auth = result
+        return request
+
+    def render(self, request, response):
+        """DRF の Response を、Accept で選んだ形式 (選べなければ JSON) の HttpResponse にする"""
+        try:
+            renderer, media_type = self.negotiator.select_renderer(request, self.renderers)
+        except exceptions.NotAcceptable:
+            renderer, media_type = self.renderers[0], self.renderers[0].media_type
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        rendered = HttpResponse(
+            renderer.render(response.data, media_type, {'request': request, 'response': response}),
+            status=response.status_code,
+            content_type=content_type,
+        )
+        patch_vary_headers(rendered, ['Accept'])
+        return rendered
+
+    def handle_exception(self, request, exc):
+        """DRF の exception_handler と同じ形のエラーレスポンスを返す"""
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {'detail': exc.detail}
+        # 認証前のエラーでは request は Django の HttpRequest のまま
+        drf_request = request if isinstance(request, Request) else Request(request)
+        response = self.render(drf_request, Response(data, status=exc.status_code))
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response['WWW-Authenticate'] = self.authenticator.authenticate_header(request)
+        return response
@@ -0,0 +1,169 @@
+# users/authentication.py
+"""
+ユーザーをプロセス内にキャッシュする JWT 認証。
+
+simplejwt の JWTAuthentication はリクエストごとに users.User を1件読み込むが、
+ほとんどのAPIは request.user.id しか使わない。CachedJWTAuthentication は
+user_id ごとに認証の判定に必要な値 (is_active と password) だけをキャッシュし、
+キャッシュにあればDBを読まずに CachedUser (id 以外は遅延読み込み) を返す。
+
+キャッシュは件数の上限 (AUTH_USER_CACHE_SIZE) を超えると古いものから捨て、
+AUTH_USER_CACHE_TTL 秒で期限切れになる。ユーザーが保存・削除されると
+(無効化やパスワード変更を含む) そのプロセスのキャッシュからはすぐに取り除く。
+他のプロセス (gunicorn の別ワーカー) には伝わらないため、そちらでは TTL の間だけ古い状態が残る。
+QuerySet.update() などシグナルを送らない変更では evict() を呼ぶこと。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from ramen_project import db_router
+
+from .models import CachedUser
+
+# キャッシュする (認証の判定に必要な) フィールド。Model.from_db() に渡すため、モデルのフィールド順に並べる
+CACHED_FIELDS = ('id', 'password', 'is_active')
+
+
+class UserCache:
+    """
+    user_id ごとに CACHED_FIELDS の値を保持する、件数の上限と TTL のある LRU キャッシュ。
+    トークンの user_id は文字列、モデルの pk は整数のため、キーは文字列にそろえる。
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at <= self._clock():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return values
+
+    def set(self, user_id, values):
+        user_id = str(user_id)
+        with self._lock:
+            self._entries[user_id] = (self._clock() + settings.AUTH_USER_CACHE_TTL, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > settings.AUTH_USER_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache()
+
+
+def evict(user_id):
+    """user_id をキャッシュから取り除く。トランザクション中であれば、コミット後にもう一度取り除く"""
+    user_cache.evict(user_id)
+    # コミット前の古い値が、別のリクエストによって読み込まれてキャッシュされることがあるため
+    transaction.on_commit(lambda: user_cache.evict(user_id))
+
+
+# プロキシモデル (CachedUser) として保存された場合は、sender が CachedUser になる
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=CachedUser)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=CachedUser)
+def _evict_changed_user(sender, instance, **kwargs):
+    evict(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication と同じ判定 (ユーザーの存在、is_active、パスワード変更によるトークンの失効) を、
+    キャッシュした値で行う認証クラス。
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            # 書き込みの直後のユーザーであれば、読み込みをリードレプリカから primary に戻す
+            db_router.bind_user(result[0].pk)
+        return result
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        values = user_cache.get(user_id)
+        if values is None:
+            values = self._user_values(user_id).first()
+            self._cache_values(user_id, values)
+        return self._check_user(validated_token, values)
+
+    async def aauthenticate(self, request):
+        """authenticate() の非同期版。キャッシュにない場合だけ、非同期 ORM でユーザーを読み込む"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        user_id = self._user_id(validated_token)
+        values = user_cache.get(user_id)
+        if values is None:
+            values = await self._user_values(user_id).afirst()
+            self._cache_values(user_id, values)
+        user = self._check_user(validated_token, values)
+        db_router.bind_user(user.pk)
+        return user, validated_token
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+    def _user_values(self, user_id):
+        # bind_user() より前に読むため、GET でもリードレプリカに振り分けられてしまう。
+        # 遅れているレプリカから無効化やパスワード変更の前の値を読んでキャッシュすると、
+        # 失効したトークンが TTL の間使えてしまうため、常に primary から読む
+        return CachedUser.objects.using(DEFAULT_DB_ALIAS).filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*CACHED_FIELDS)
+
+    def _cache_values(self, user_id, values):
+        if values is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        user_cache.set(user_id, values)
+
+    def _check_user(self, validated_token, values):
+        user = CachedUser.from_db(None, CACHED_FIELDS, values)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ramen_log.models import RamenLog
+from user_relationships.models import UserRelationship
+from users import account_deletion
+from users.models import AccountDeletion, User
+
+PREFIX = 'bench_account_purge'
+
+
+class Command(BaseCommand):
+    help = (
+        'ログの多いユーザーの退会の削除 (purge_accounts) を計測する。1回の削除 (1トランザクション) の時間と全体の時間を表示する。'
+        '--compare-cascade で、同じデータのユーザーを CASCADE で1回で削除した時間も計測する (データは最後に削除される)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logs', type=int, default=1_000_000, help='ユーザーのログの件数')
+        parser.add_argument('--followers', type=int, default=1000, help='フォロワーの人数')
+        parser.add_argument('--batch-size', type=int, default=account_deletion.DEFAULT_BATCH_SIZE, help='1回の DELETE で削除する件数')
+        parser.add_argument('--compare-cascade', action='store_true', help='CASCADE での削除も計測する')
+
+    def handle(self, *args, **options):
+        User.objects.filter(username__startswith=PREFIX).delete()
+        user = self._seed(f'{PREFIX}_user', options)
+        job = account_deletion.request_deletion(user)
+
+        durations = []
+        start = time.perf_counter()
+        while True:
+            job = account_deletion.claim()
+            batch_start = time.perf_counter()
+            finished = account_deletion.run(job, options['batch_size'], max_batches=1)
+            durations.append(time.perf_counter() - batch_start)
+            if finished:
+                break
+        total = time.perf_counter() - start
+        job.refresh_from_db()
+        self.stdout.write('purge: %d batches, %.1f s total, median %.1f ms, max %.1f ms per transaction' % (
+            len(durations), total, statistics.median(durations) * 1000, max(durations) * 1000))
+        self.stdout.write('deleted: %s' % {name: count for name, count in job.deleted.items() if count})
+        AccountDeletion.objects.filter(pk=job.pk).delete()
+
+        if options['compare_cascade']:
+            user = self._seed(f'{PREFIX}_cascade', options)
+            start = time.perf_counter()
+            with transaction.atomic():
+                user.delete()
+            self.stdout.write('cascade: 1 transaction, %.1f s' % (time.perf_counter() - start))
+        User.objects.filter(username__startswith=PREFIX).delete()
+
+    def _seed(self, username, options):
+        user = User.objects.create_user(username=username)
+        now = timezone.now()
+        # 件数が多いため、generate_series の1文で書き込む
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {RamenLog._meta.db_table}
+                    (user_id, shop_name, ordered_item, noodle_hardness, toppings, topping_tags, rating,
+                     visited_at, updated_at, sync_version)
+                SELECT %s, 'shop' || (i %% 300), '醤油ラーメン', 'かため', '味玉', ARRAY['味玉'], (i %% 5) + 1,
+                       %s - make_interval(hours => i), %s, i
+                FROM generate_series(1, %s) AS i
+                """,
+                [user.id, now, now, options['logs']],
+            )
+        followers = User.objects.bulk_create(
+            [User(username=f'{username}_{i}') for i in range(options['followers'])], batch_size=5000)
+        UserRelationship.objects.bulk_create([
+            UserRelationship(follower=follower, followed=user, status=UserRelationship.STATUS_APPROVED)
+            for follower in followers
+        ], batch_size=5000)
+        return user
@@ -0,0 +1,241 @@
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ramen_log.models import RamenLog
+from user_relationships.models import IkitaiStatus, UserRelationship
+from users.management.loadtest import keeps_alive, read_response
+from users.models import User
+
+PREFIX = 'bench_asgi_'
+
+# 非同期版を用意したAPI (ASGI ではこれらが非同期のビューで処理される)
+PATHS = (
+    '/api/ramen/ramenlog/',
+    '/api/relationships/following/',
+    '/api/relationships/followers/',
+    '/api/relationships/pending-requests/',
+    '/api/relationships/ikitai/',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        '同じデータに対して WSGI (gunicorn) と ASGI (uvicorn) のサーバーを起動し、多数のクライアントから同時に'
+        'リクエストしたときのスループットとレイテンシ、DB接続数を比較する (作成したデータは最後に削除する)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='同時に接続するクライアントの数')
+        parser.add_argument('--duration', type=float, default=20.0, help='1サーバーあたりの計測時間 (秒)')
+        parser.add_argument('--warmup', type=float, default=3.0, help='計測前のウォームアップの時間 (秒)')
+        parser.add_argument('--workers', type=int, default=2, help='サーバーのプロセス数')
+        parser.add_argument('--threads', type=int, default=settings.ASGI_MAX_CONCURRENT_REQUESTS,
+                            help='WSGI (gunicorn gthread) の1プロセスあたりのスレッド数。既定では ASGI と同じDB接続数の上限になる')
+        parser.add_argument('--users', type=int, default=200, help='作成するユーザーの数 (クライアントはユーザーを共有する)')
+        parser.add_argument('--logs', type=int, default=30, help='ユーザーごとのラーメンログの件数')
+        parser.add_argument('--servers', default='wsgi,asgi', help='計測するサーバー (カンマ区切り)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f'{PREFIX} で始まるユーザーが残っています。前回の計測のデータを削除してください。')
+        if options['users'] < 24:
+            raise CommandError('--users は 24 以上を指定してください。')
+        rng = random.Random(options['seed'])
+        # サーバーの別プロセスから読めるように、データはコミットする
+        with transaction.atomic():
+            tokens = self._seed(options, rng)
+        try:
+            self.stdout.write(
+                f"clients={options['clients']} workers={options['workers']} "
+                f"db_slots/worker={settings.ASGI_MAX_CONCURRENT_REQUESTS} threads/worker(wsgi)={options['threads']}"
+            )
+            self.stdout.write('server\trequests\terrors\treq/s\tms(p50)\tms(p95)\tms(p99)\tdb_conns(max)')
+            for server in options['servers'].split(','):
+                self._report(server, self._run(server, tokens, options, rng))
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    def _seed(self, options, rng):
+        n = options['users']
+        users = User.objects.bulk_create([User(username=f'{PREFIX}{i}') for i in range(n)], batch_size=5000)
+        RamenLog.objects.bulk_create(
+            [
+                RamenLog(user=user, shop_name=f'shop{rng.randrange(100)}', ordered_item='醤油ラーメン')
+                for user in users for _ in range(options['logs'])
+            ],
+            batch_size=5000,
+        )
+        relationships = []
+        for i, user in enumerate(users):
+            # 10人をフォローし (承認済み)、3人からフォローリクエストを受けている。全員が「ラーメンイキタイ」状態
+            relationships += [
+                UserRelationship(follower=user, followed=users[(i + k) % n], status=UserRelationship.STATUS_APPROVED)
+                for k in range(1, 11)
+            ]
+            relationships += [
+                UserRelationship(follower=users[(i + k) % n], followed=user, status=UserRelationship.STATUS_PENDING)
+                for k in range(11, 14)
+            ]
+        UserRelationship.objects.bulk_create(relationships, batch_size=5000)
+        for user in users:
+            IkitaiStatus.objects.create(user=user, latitude=35.68, longitude=139.76, expires_at=user.created_at)
+        return [str(AccessToken.for_user(user)) for user in users]
+
+    def _report(self, server, result):
+        timings, errors, elapsed, max_connections = result
+        timings.sort()
+        if not timings:
+            self.stdout.write(f'{server}\t0\t{errors}\t-\t-\t-\t-\t{max_connections}')
+            return
+        self.stdout.write('%s\t%d\t%d\t%.1f\t%.1f\t%.1f\t%.1f\t%d' % (
+            server, len(timings), errors, len(timings) / elapsed,
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+            timings[int(len(timings) * 0.99) - 1],
+            max_connections,
+        ))
+
+    def _run(self, server, tokens, options, rng):
+        port = _free_port()
+        if server == 'wsgi':
+            command = [
+                sys.executable, '-m', 'gunicorn', 'ramen_project.wsgi:application',
+                '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']),
+                '--worker-class', 'gthread', '--threads', str(options['threads']),
+                '--worker-connections', str(options['clients'] + 100), '--backlog', str(options['clients'] + 100),
+                '--keep-alive', '30', '--log-level', 'warning',
+            ]
+        elif server == 'asgi':
+            # docker-compose.yml の backend-asgi と同じ起動方法 (gunicorn が uvicorn のワーカーを管理する)
+            command = [
+                sys.executable, '-m', 'gunicorn', 'ramen_project.asgi:application',
+                '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']),
+                '--worker-class', 'uvicorn.workers.UvicornWorker',
+                '--backlog', str(options['clients'] + 100), '--keep-alive', '30', '--log-level', 'warning',
+            ]
+        else:
+            raise CommandError(f'不明なサーバーです: {server}')
+
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=os.environ.copy())
+        try:
+            _wait_for_port(port, process)
+            sampler = _ConnectionSampler()
+            sampler.start()
+            try:
+                return (*asyncio.run(_drive(port, tokens, options, rng)), sampler.stop())
+            finally:
+                sampler.stop()
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('サーバーが起動できませんでした。')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                # ワーカーが揃うまで少し待つ
+                time.sleep(2)
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError('サーバーの起動がタイムアウトしました。')
+
+
+class _ConnectionSampler(threading.Thread):
+    """計測中に、このDBへのクライアント接続数 (pg_stat_activity) を定期的に数えて最大値を記録する"""
+
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.maximum = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            with connection.cursor() as cursor:
+                while not self._stopped.wait(self.interval):
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE datname = current_database() AND backend_type = 'client backend' AND pid <> pg_backend_pid()"
+                    )
+                    self.maximum = max(self.maximum, cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+    def stop(self):
+        if self.is_alive():
+            self._stopped.set()
+            self.join()
+        return self.maximum
+
+
+async def _drive(port, tokens, options, rng):
+    """clients 個の接続から、keep-alive でリクエストを送り続ける。(レイテンシの一覧, エラー数, 計測時間) を返す"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    measure_from = start + options['warmup']
+    end = measure_from + options['duration']
+    timings = []
+    errors = 0
+
+    async def client(token, seed):
+        nonlocal errors
+        local_rng = random.Random(seed)
+        reader = writer = None
+        while loop.time() < end:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                path = local_rng.choice(PATHS)
+                sent = loop.time()
+                writer.write(
+                    f'GET {path} HTTP/1.1\r\nHost: localhost\r\nAuthorization: Bearer {token}\r\n\r\n'.encode()
+                )
+                status, headers, _ = await read_response(reader)
+                received = loop.time()
+                # 計測時間内に返ってきたレスポンスを数える (待ち時間が長いと、送信はウォームアップ中のこともある)
+                if measure_from <= received <= end:
+                    if status in (200, 404):
+                        timings.append((received - sent) * 1000)
+                    else:
+                        errors += 1
+                if not keeps_alive(headers):
+                    writer.close()
+                    writer = None
+            except (OSError, asyncio.IncompleteReadError):
+                if loop.time() >= measure_from:
+                    errors += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+                await asyncio.sleep(0.05)
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(
+        client(tokens[i % len(tokens)], rng.random()) for i in range(options['clients'])
+    ))
+    return timings, errors, options['duration']
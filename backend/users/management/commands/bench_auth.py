@@ -0,0 +1,75 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.authentication import CachedJWTAuthentication, user_cache
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'JWT 認証 (simplejwt の JWTAuthentication とキャッシュ付きの CachedJWTAuthentication) のコストを比較する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='計測の回数')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user(username='bench_auth')
+            token = str(AccessToken.for_user(user))
+            user_cache.clear()
+            self.stdout.write('path\tus(p50)\tus(p95)\tqueries/request')
+            for name, auth in (('JWTAuthentication', JWTAuthentication()), ('CachedJWTAuthentication', CachedJWTAuthentication())):
+                self._report(name, self._measure_authenticate(auth, token, options['iterations']))
+            # 実際のAPI (ETag が一致して 304 を返す一覧) でのリクエスト全体の時間
+            self._report('GET ramenlog/ (304)', self._measure_request(token, options['iterations']))
+            transaction.set_rollback(True)
+
+    def _report(self, name, result):
+        timings, queries = result
+        self.stdout.write('%s\t%.1f\t%.1f\t%.2f' % (
+            name, statistics.median(timings), timings[int(len(timings) * 0.95) - 1], queries,
+        ))
+
+    def _timed(self, run, iterations):
+        timings = []
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        for i in range(iterations + 10):
+            if i == 10:  # 最初の数回はウォームアップとして捨てる
+                queries = 0
+            start = time.perf_counter()
+            with connection.execute_wrapper(count):
+                run()
+            if i >= 10:
+                timings.append((time.perf_counter() - start) * 1_000_000)
+        timings.sort()
+        return timings, queries / iterations
+
+    def _measure_authenticate(self, auth, token, iterations):
+        request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+
+        def run():
+            assert auth.authenticate(request) is not None
+        return self._timed(run, iterations)
+
+    def _measure_request(self, token, iterations):
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        url = reverse('ramenlog-list-create')
+        etag = client.get(url)['ETag']
+
+        def run():
+            assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+        return self._timed(run, iterations)
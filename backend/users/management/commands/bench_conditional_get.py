@@ -0,0 +1,83 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from ramen_log.models import RamenLog
+from user_relationships.models import UserRelationship
+from users.models import User
+
+ENDPOINTS = ('ramenlog-list-create', 'following-list', 'follower-list', 'pending-follow-requests')
+
+
+class Command(BaseCommand):
+    help = '一覧APIの通常のレスポンスと、ETag が一致したときの 304 のコストを比較する (データはロールバックされる)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logs', type=int, default=1000, help='計測ユーザーのラーメンログの件数')
+        parser.add_argument('--relationships', type=int, default=300, help='フォロー中・フォロワー・保留中それぞれの人数')
+        parser.add_argument('--iterations', type=int, default=200, help='エンドポイントごとのリクエスト回数')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self._seed(options)
+            client = APIClient(SERVER_NAME='localhost')
+            # 実際のアプリと同じく JWT で認証する
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+            self.stdout.write('endpoint\tstatus\tms(p50)\tms(p95)\tqueries\tbytes')
+            for name in ENDPOINTS:
+                url = reverse(name)
+                etag = client.get(url)['ETag']
+                for label, headers in (('200', {}), ('304', {'HTTP_IF_NONE_MATCH': etag})):
+                    timings, queries, size = self._measure(client, url, headers, options['iterations'])
+                    self.stdout.write('%s\t%s\t%.2f\t%.2f\t%d\t%d' % (
+                        name, label, statistics.median(timings),
+                        timings[int(len(timings) * 0.95) - 1], queries, size,
+                    ))
+            transaction.set_rollback(True)
+
+    def _seed(self, options):
+        user = User.objects.create_user(username='bench_conditional_get')
+        RamenLog.objects.bulk_create(
+            [RamenLog(user=user, shop_name=f'shop{i % 100}', ordered_item='醤油ラーメン') for i in range(options['logs'])],
+            batch_size=5000,
+        )
+        n = options['relationships']
+        others = User.objects.bulk_create(
+            [User(username=f'bench_conditional_get_{i}') for i in range(n * 3)], batch_size=5000,
+        )
+        approved = UserRelationship.STATUS_APPROVED
+        UserRelationship.objects.bulk_create(
+            [UserRelationship(follower=user, followed=u, status=approved) for u in others[:n]]
+            + [UserRelationship(follower=u, followed=user, status=approved) for u in others[n:n * 2]]
+            + [UserRelationship(follower=u, followed=user, status=UserRelationship.STATUS_PENDING) for u in others[n * 2:]],
+            batch_size=5000,
+        )
+        return user
+
+    def _measure(self, client, url, headers, iterations):
+        timings = []
+        queries = 0
+        size = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        for i in range(iterations + 10):
+            queries = 0
+            start = time.perf_counter()
+            with connection.execute_wrapper(count):
+                response = client.get(url, **headers)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert response.status_code in (200, 304), response.status_code
+            size = len(response.content)
+            if i >= 10:  # 最初の数回はウォームアップとして捨てる
+                timings.append(elapsed)
+        timings.sort()
+        return timings, queries, size
@@ -0,0 +1,185 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ramen_log import shops, sync
+from ramen_log.models import RamenLog, Shop
+from user_relationships import geo
+from user_relationships.models import IkitaiStatus, UserRelationship
+from users.models import User
+
+ORDERED_ITEMS = ('醤油ラーメン', '味噌ラーメン', '塩ラーメン', '豚骨ラーメン', 'つけ麺', '担々麺', '家系ラーメン', '二郎系')
+NOODLE_HARDNESS = ('バリカタ', 'カタめ', '普通', 'やわめ')
+TOPPINGS = ('チャーシュー', '味玉', 'メンマ', 'ネギ', 'のり', 'もやし', 'コーン', 'バター')
+# 「ラーメンイキタイ」の位置 (東京駅の周辺)
+CENTER = (35.681, 139.767)
+
+
+class Command(BaseCommand):
+    help = (
+        '負荷試験 (load_test) 用の大きなデータを bulk_create で作る。'
+        'フォローの関係は人気の偏ったべき分布、ログの件数もユーザーごとに偏りを持たせる。'
+        'ユーザー名は --prefix で始まり、パスワードは全員 --password になる (--delete で削除する)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='ユーザーの数')
+        parser.add_argument('--logs', type=float, default=100, help='ユーザーあたりの平均のラーメンログの件数')
+        parser.add_argument('--follows', type=float, default=30, help='ユーザーあたりの平均のフォロー数')
+        parser.add_argument('--alpha', type=float, default=1.0,
+                            help='人気の偏り (フォローされる確率が人気の順位の -alpha 乗に比例する)')
+        parser.add_argument('--pending-ratio', type=float, default=0.05, help='フォローのうち保留中にする割合')
+        parser.add_argument('--ikitai-ratio', type=float, default=0.2, help='「ラーメンイキタイ」状態にするユーザーの割合')
+        parser.add_argument('--shops', type=int, default=5000, help='店の数')
+        parser.add_argument('--prefix', default='load_', help='作成するユーザー名・店名の接頭辞')
+        parser.add_argument('--password', default='load-test-password', help='作成するユーザーのパスワード')
+        parser.add_argument('--batch-size', type=int, default=10000, help='bulk_create の1回あたりの件数')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--delete', action='store_true', help='作成せずに、--prefix で始まるデータを削除する')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['delete']:
+            return self._delete(prefix, options['batch_size'])
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'{prefix} で始まるユーザーが既にいます。--delete で削除してから実行してください。')
+        if options['users'] < 2:
+            raise CommandError('--users は 2 以上を指定してください。')
+
+        rng = np.random.default_rng(options['seed'])
+        user_ids = self._step('users', self._create_users, options)
+        self._step('follows', self._create_follows, user_ids, rng, options)
+        shop_ids = self._step('shops', self._create_shops, options)
+        self._step('ramen logs', self._create_logs, user_ids, shop_ids, rng, options)
+        self._step('ikitai', self._create_ikitai, user_ids, rng, options)
+        self.stdout.write(
+            'ラーメン統計やおすすめユーザーも使う場合は、rebuild_ramen_stats と refresh_recommendations --full を実行してください。'
+        )
+
+    def _step(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        count = result if isinstance(result, int) else len(result)
+        self.stdout.write(f'{name}: {count} 件 ({time.perf_counter() - start:.1f} 秒)')
+        return result
+
+    def _create_users(self, options):
+        # パスワードのハッシュ化は遅いため、1回だけ計算して全員に使う
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        user_ids = []
+        for start in range(0, options['users'], options['batch_size']):
+            users = User.objects.bulk_create([
+                User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password)
+                for i in range(start, min(start + options['batch_size'], options['users']))
+            ])
+            user_ids += [user.id for user in users]
+        return np.array(user_ids, dtype=np.int64)
+
+    def _create_follows(self, user_ids, rng, options):
+        n = len(user_ids)
+        # フォロー数はユーザーごとに幾何分布、フォローされる相手は人気の順位のべき分布で選ぶ
+        out_degrees = np.minimum(rng.geometric(1 / (options['follows'] + 1), size=n) - 1, n - 1)
+        popularity = 1 / np.arange(1, n + 1) ** options['alpha']
+        popularity = rng.permutation(popularity / popularity.sum())
+        followers = np.repeat(np.arange(n), out_degrees)
+        followed = rng.choice(n, size=len(followers), p=popularity)
+        # 自分自身へのフォローと、同じ組の重複を除く
+        pairs = np.unique(followers[followers != followed] * n + followed[followers != followed])
+        followers, followed = pairs // n, pairs % n
+        pending = rng.random(len(pairs)) < options['pending_ratio']
+
+        approved, waiting = UserRelationship.STATUS_APPROVED, UserRelationship.STATUS_PENDING
+        for start in range(0, len(pairs), options['batch_size']):
+            end = start + options['batch_size']
+            UserRelationship.objects.bulk_create([
+                UserRelationship(follower_id=follower, followed_id=target, status=waiting if is_pending else approved)
+                for follower, target, is_pending in zip(
+                    user_ids[followers[start:end]].tolist(), user_ids[followed[start:end]].tolist(), pending[start:end].tolist()
+                )
+            ])
+        return len(pairs)
+
+    def _create_shops(self, options):
+        names = [f"{options['prefix']}ラーメン{i}" for i in range(options['shops'])]
+        shop_ids = shops.resolve_shop_ids(names)
+        return np.array([shop_ids[name] for name in names], dtype=np.int64)
+
+    def _create_logs(self, user_ids, shop_ids, rng, options):
+        # ログの件数はユーザーごとに偏らせる (平均が --logs のガンマ分布を平均とするポアソン分布)
+        counts = rng.poisson(rng.gamma(0.7, options['logs'] / 0.7, size=len(user_ids)))
+        shop_popularity = 1 / np.arange(1, len(shop_ids) + 1)
+        shop_popularity /= shop_popularity.sum()
+        owners = np.repeat(user_ids, counts)
+        now = timezone.now()
+        created = 0
+        for start in range(0, len(owners), options['batch_size']):
+            chunk = owners[start:start + options['batch_size']].tolist()
+            size = len(chunk)
+            chunk_shops = rng.choice(len(shop_ids), size=size, p=shop_popularity)
+            chunk_shop_ids = shop_ids[chunk_shops].tolist()
+            # 直近2年のどこか (1割は訪問日なし)
+            visited_seconds = rng.integers(0, 2 * 365 * 86400, size=size).tolist()
+            no_visit_date = (rng.random(size) < 0.1).tolist()
+            ratings = (rng.integers(2, 11, size=size) / 2).tolist()
+            items = rng.integers(0, len(ORDERED_ITEMS), size=size).tolist()
+            hardness = rng.integers(0, len(NOODLE_HARDNESS), size=size).tolist()
+            topping_masks = rng.integers(0, 2 ** len(TOPPINGS), size=size).tolist()
+            chunk_toppings = [[name for bit, name in enumerate(TOPPINGS) if mask >> bit & 1] for mask in topping_masks]
+            logs = [
+                RamenLog(
+                    user_id=chunk[i],
+                    shop_id=chunk_shop_ids[i],
+                    shop_name=f"{options['prefix']}ラーメン{chunk_shops[i]}",
+                    ordered_item=ORDERED_ITEMS[items[i]],
+                    noodle_hardness=NOODLE_HARDNESS[hardness[i]],
+                    toppings=','.join(chunk_toppings[i]) or None,
+                    # bulk_create では save() が呼ばれないため、topping_tags もここで設定する
+                    topping_tags=chunk_toppings[i],
+                    rating=Decimal(str(ratings[i])),
+                    visited_at=None if no_visit_date[i] else now - timedelta(seconds=visited_seconds[i]),
+                )
+                for i in range(size)
+            ]
+            with transaction.atomic():
+                sync.assign_versions(logs)
+                RamenLog.objects.bulk_create(logs)
+            shops.record_visits(chunk_shop_ids)
+            created += size
+        return created
+
+    def _create_ikitai(self, user_ids, rng, options):
+        chosen = user_ids[rng.random(len(user_ids)) < options['ikitai_ratio']].tolist()
+        now = timezone.now()
+        statuses = []
+        for user_id in chosen:
+            # 中心から 0.1 度 (約10km) 以内、有効期限は 1〜3 時間後
+            latitude = CENTER[0] + rng.uniform(-0.1, 0.1)
+            longitude = CENTER[1] + rng.uniform(-0.1, 0.1)
+            statuses.append(IkitaiStatus(
+                user_id=user_id, latitude=latitude, longitude=longitude,
+                # bulk_create では save() が呼ばれないため、geohash はここで計算する
+                geohash=geo.encode(latitude, longitude),
+                expires_at=now + timedelta(minutes=int(rng.integers(60, 180))),
+            ))
+        IkitaiStatus.objects.bulk_create(statuses, batch_size=options['batch_size'])
+        return len(statuses)
+
+    def _delete(self, prefix, batch_size):
+        users = User.objects.filter(username__startswith=prefix).order_by('id')
+        deleted = 0
+        while True:
+            # ログなどの関連データも CASCADE で削除されるため、少しずつ削除する
+            ids = list(users.values_list('id', flat=True)[:max(1, batch_size // 100)])
+            if not ids:
+                break
+            User.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+        Shop.objects.filter(name__startswith=prefix).delete()
+        self.stdout.write(self.style.SUCCESS(f'{prefix} で始まるユーザー {deleted} 人と関連データを削除しました'))
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import random
+import subprocess
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from users.management.loadtest import HttpConnection, summarize
+
+# 操作ごとの既定の割合 (--mix で変更できる)
+DEFAULT_MIX = {
+    'ramenlog_list': 30,
+    'ramenlog_retrieve': 15,
+    'ramenlog_create': 10,
+    'ramenlog_delete': 5,
+    'follow': 5,
+    'approve': 5,
+    'ikitai_get': 10,
+    'ikitai_post': 5,
+    'ikitai_nearby': 10,
+    'token': 3,
+    'register': 2,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        '起動しているサーバーに、generate_dataset で作ったユーザーとしてAPI (登録・トークン・ラーメンログ・'
+        'フォローと承認・ラーメンイキタイ) のリクエストを同時に送り、操作ごとのスループットと '
+        'p50/p95/p99 のレイテンシを表示する。--output を指定すると、結果を JSON Lines で追記する'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='サーバーの URL')
+        parser.add_argument('--concurrency', type=int, default=50, help='同時に接続するクライアントの数')
+        parser.add_argument('--duration', type=float, default=30.0, help='計測時間 (秒)')
+        parser.add_argument('--warmup', type=float, default=5.0, help='計測前のウォームアップの時間 (秒)')
+        parser.add_argument('--users', type=int, default=50, help='ログインする (generate_dataset で作った) ユーザーの数')
+        parser.add_argument('--prefix', default='load_', help='generate_dataset の --prefix')
+        parser.add_argument('--password', default='load-test-password', help='generate_dataset の --password')
+        parser.add_argument('--mix', help='操作の割合 (例: ramenlog_list=50,ramenlog_create=10)。指定しない操作は行わない')
+        parser.add_argument('--output', help='結果を1行の JSON として追記するファイル')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url には http:// で始まる URL を指定してください。')
+        mix = _parse_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        runner = LoadRunner(url.hostname, url.port or 80, mix, options)
+        started_at = timezone.now()
+        results, elapsed = asyncio.run(runner.run())
+
+        report = {
+            'started_at': started_at.isoformat(),
+            'git_commit': _git_commit(),
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'duration': round(elapsed, 2),
+            'users': options['users'],
+            'mix': mix,
+            'endpoints': {
+                name: dict(summarize(result.timings, result.errors, elapsed), statuses=dict(sorted(result.statuses.items())))
+                for name, result in sorted(results.items())
+            },
+            'total': summarize(
+                [timing for result in results.values() for timing in result.timings],
+                sum(result.errors for result in results.values()),
+                elapsed,
+            ),
+        }
+        self._print(report)
+        if options['output']:
+            with open(options['output'], 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+
+    def _print(self, report):
+        self.stdout.write('endpoint\trequests\terrors\treq/s\tms(p50)\tms(p95)\tms(p99)')
+        rows = list(report['endpoints'].items()) + [('total', report['total'])]
+        for name, result in rows:
+            self.stdout.write('\t'.join(str(value) for value in (
+                name, result['requests'], result['errors'], result['rps'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            )))
+
+
+def _parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise CommandError(f'不明な操作です: {name} (使える操作: {", ".join(DEFAULT_MIX)})')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f'割合は数値で指定してください: {item}')
+    return mix
+
+
+def _git_commit():
+    """結果を比較できるよう、計測したコードのコミットを記録する (git がなければ None)"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Session:
+    """ログインしたユーザーと、そのユーザーとして作ったデータ"""
+
+    def __init__(self, username, token):
+        self.username = username
+        self.token = token
+        self.user_id = jwt.decode(token, options={'verify_signature': False})[settings.SIMPLE_JWT['USER_ID_CLAIM']]
+        # 一覧や作成で分かった、このユーザーのログの id
+        self.log_ids = []
+        # 作成したログ (削除の対象)
+        self.created_log_ids = []
+        # このユーザーへのフォローリクエストを送ったユーザーの id (承認の対象)
+        self.pending_follower_ids = []
+
+
+class EndpointResult:
+    """操作ごとの計測結果"""
+
+    def __init__(self):
+        self.timings = []
+        self.errors = 0
+        self.statuses = Counter()
+
+
+class LoadRunner:
+    # 操作ごとの、正常とみなすステータス (既にフォローしている 409 や、承認済みの 404 などは想定内)
+    EXPECTED = {
+        'register': {201},
+        'token': {200},
+        'ramenlog_list': {200},
+        'ramenlog_retrieve': {200},
+        'ramenlog_create': {201},
+        'ramenlog_delete': {204},
+        'follow': {201, 409},
+        'approve': {200, 404},
+        'ikitai_get': {200, 404},
+        'ikitai_post': {200, 201},
+        'ikitai_nearby': {200},
+    }
+
+    def __init__(self, host, port, mix, options):
+        self.host = host
+        self.port = port
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.options = options
+        self.sessions = []
+        self.results = {}
+        self.measuring = False
+
+    async def run(self):
+        """ウォームアップの後 duration 秒の間に返ってきたレスポンスを計測し、(操作ごとの結果, 計測時間) を返す"""
+        await self._login()
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self.options['warmup'] + self.options['duration']
+
+        async def measure():
+            await asyncio.sleep(self.options['warmup'])
+            self.measuring = True
+            await asyncio.sleep(self.options['duration'])
+            self.measuring = False
+        await asyncio.gather(measure(), *(self._client(i, end) for i in range(self.options['concurrency'])))
+        return self.results, self.options['duration']
+
+    async def _login(self):
+        """計測の前に、各ユーザーのトークンを取得する"""
+        usernames = [f"{self.options['prefix']}{i}" for i in range(self.options['users'])]
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+
+        async def login(username):
+            async with semaphore:
+                connection = HttpConnection(self.host, self.port)
+                try:
+                    status, data = await connection.request(
+                        'POST', '/api/token/', {'username': username, 'password': self.options['password']}
+                    )
+                finally:
+                    connection.close()
+            if status != 200:
+                raise CommandError(
+                    f'{username} でログインできません (status={status})。generate_dataset で作ったデータと '
+                    '--prefix / --password が一致しているか確認してください。'
+                )
+            return Session(username, data['access'])
+        self.sessions = await asyncio.gather(*(login(username) for username in usernames))
+
+    async def _client(self, index, end):
+        loop = asyncio.get_running_loop()
+        rng = random.Random(self.options['seed'] * 100003 + index)
+        session = self.sessions[index % len(self.sessions)]
+        connection = HttpConnection(self.host, self.port)
+        try:
+            while loop.time() < end:
+                name = rng.choices(self.operations, self.weights)[0]
+                try:
+                    await getattr(self, name)(connection, session, rng)
+                except (OSError, asyncio.IncompleteReadError):
+                    self._record(name, None, 0)
+                    await asyncio.sleep(0.05)
+        finally:
+            connection.close()
+
+    async def _request(self, name, connection, method, path, data=None, token=None):
+        start = time.perf_counter()
+        status, body = await connection.request(method, path, data, token)
+        self._record(name, status, (time.perf_counter() - start) * 1000)
+        return status, body
+
+    def _record(self, name, status, elapsed_ms):
+        if not self.measuring:
+            return
+        result = self.results.setdefault(name, EndpointResult())
+        result.statuses[str(status) if status is not None else 'connection_error'] += 1
+        if status in self.EXPECTED[name]:
+            result.timings.append(elapsed_ms)
+        else:
+            result.errors += 1
+
+    # --- 操作 ---
+
+    async def register(self, connection, session, rng):
+        username = f"{self.options['prefix']}reg_{uuid.uuid4().hex[:12]}"
+        await self._request('register', connection, 'POST', '/api/users/register/', {
+            'username': username, 'email': f'{username}@example.com', 'password': self.options['password'],
+        })
+
+    async def token(self, connection, session, rng):
+        await self._request('token', connection, 'POST', '/api/token/', {
+            'username': session.username, 'password': self.options['password'],
+        })
+
+    async def ramenlog_list(self, connection, session, rng):
+        status, data = await self._request('ramenlog_list', connection, 'GET', '/api/ramen/ramenlog/', token=session.token)
+        if status == 200:
+            session.log_ids = [log['id'] for log in data['results']]
+
+    async def ramenlog_retrieve(self, connection, session, rng):
+        if not session.log_ids:
+            return await self.ramenlog_list(connection, session, rng)
+        log_id = rng.choice(session.log_ids)
+        status, _ = await self._request(
+            'ramenlog_retrieve', connection, 'GET', f'/api/ramen/ramenlog/{log_id}/', token=session.token
+        )
+        if status == 404:
+            # 他のクライアントが削除した
+            session.log_ids.remove(log_id)
+
+    async def ramenlog_create(self, connection, session, rng):
+        status, data = await self._request('ramenlog_create', connection, 'POST', '/api/ramen/ramenlog/', {
+            'shop_name': f"{self.options['prefix']}ラーメン{rng.randrange(100)}",
+            'ordered_item': '醤油ラーメン',
+            'rating': rng.randrange(2, 11) / 2,
+            'visited_at': timezone.now().isoformat(),
+        }, token=session.token)
+        if status == 201:
+            session.created_log_ids.append(data['id'])
+            session.log_ids.append(data['id'])
+
+    async def ramenlog_delete(self, connection, session, rng):
+        if not session.created_log_ids:
+            return await self.ramenlog_create(connection, session, rng)
+        log_id = session.created_log_ids.pop()
+        if log_id in session.log_ids:
+            session.log_ids.remove(log_id)
+        await self._request(
+            'ramenlog_delete', connection, 'DELETE', f'/api/ramen/ramenlog/{log_id}/delete/', token=session.token
+        )
+
+    async def follow(self, connection, session, rng):
+        target = rng.choice(self.sessions)
+        if target is session:
+            return
+        status, _ = await self._request(
+            'follow', connection, 'POST', '/api/relationships/follow/', {'user_id': target.user_id}, token=session.token
+        )
+        if status == 201:
+            target.pending_follower_ids.append(session.user_id)
+
+    async def approve(self, connection, session, rng):
+        if not session.pending_follower_ids:
+            return await self.follow(connection, session, rng)
+        follower_id = session.pending_follower_ids.pop()
+        await self._request(
+            'approve', connection, 'PATCH', f'/api/relationships/approve/{follower_id}/', {'action': 'approve'},
+            token=session.token,
+        )
+
+    async def ikitai_get(self, connection, session, rng):
+        await self._request('ikitai_get', connection, 'GET', '/api/relationships/ikitai/', token=session.token)
+
+    async def ikitai_post(self, connection, session, rng):
+        await self._request('ikitai_post', connection, 'POST', '/api/relationships/ikitai/', {
+            'latitude': 35.681 + rng.uniform(-0.1, 0.1),
+            'longitude': 139.767 + rng.uniform(-0.1, 0.1),
+            'duration_type': 'now',
+        }, token=session.token)
+
+    async def ikitai_nearby(self, connection, session, rng):
+        latitude = 35.681 + rng.uniform(-0.1, 0.1)
+        longitude = 139.767 + rng.uniform(-0.1, 0.1)
+        await self._request(
+            'ikitai_nearby', connection, 'GET',
+            f'/api/relationships/ikitai/nearby/?latitude={latitude:.5f}&longitude={longitude:.5f}',
+            token=session.token,
+        )
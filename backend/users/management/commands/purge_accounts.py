@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users import account_deletion
+
+
+class Command(BaseCommand):
+    help = (
+        '退会したユーザーのデータを少しずつ削除し、最後にユーザーを削除する (cron などで数分ごとに実行する。'
+        '途中で止まっても、次の実行で続きから削除する)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=account_deletion.DEFAULT_BATCH_SIZE, help='1回の DELETE で削除する件数')
+        parser.add_argument('--max-batches', type=int, help='1人あたりこの回数だけ削除したら次のユーザーに進む (指定しなければ最後まで削除する)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        finished = account_deletion.purge(options['batch_size'], options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{finished} 人の退会の削除を完了しました ({time.perf_counter() - start:.1f} 秒)'
+        ))
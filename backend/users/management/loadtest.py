@@ -0,0 +1,92 @@
+"""
+ベンチマーク用のコマンド (bench_asgi, load_test) で共通に使う、最小限の HTTP/1.1 クライアントと集計。
+
+外部のライブラリを使わず asyncio の接続で keep-alive のリクエストを送るため、
+1プロセスから数千の同時接続を作ってもクライアント側の負荷がほとんど計測に影響しない。
+"""
+import asyncio
+import json
+import statistics
+
+
+async def read_response(reader):
+    """HTTP/1.1 のレスポンスを1件読み、(ステータス, ヘッダーの辞書 (名前は小文字), 本文) を返す"""
+    status_line = await reader.readuntil(b'\r\n')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return status, headers, body
+
+
+def keeps_alive(headers):
+    """レスポンスの後も接続を使い続けられるか"""
+    return headers.get('connection', '').lower() != 'close'
+
+
+class HttpConnection:
+    """1本の keep-alive の接続で、リクエストを1件ずつ順に送る。接続が切れていれば次のリクエストでつなぎ直す"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = self._writer = None
+
+    async def request(self, method, path, data=None, token=None):
+        """JSON の data を送り、(ステータス, JSON の本文 (なければ None)) を返す"""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = b'' if data is None else json.dumps(data).encode()
+        head = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', 'Accept: application/json']
+        if token is not None:
+            head.append(f'Authorization: Bearer {token}')
+        if data is not None:
+            head += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        try:
+            self._writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+            status, headers, payload = await read_response(self._reader)
+        except (OSError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+        if not keeps_alive(headers):
+            self.close()
+        if payload and headers.get('content-type', '').startswith('application/json'):
+            return status, json.loads(payload)
+        return status, None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+def percentile(sorted_values, q):
+    """昇順に並んだ値の q パーセンタイル (最近傍法)"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, int(round(len(sorted_values) * q / 100)) - 1)]
+
+
+def summarize(timings, errors, elapsed):
+    """レイテンシ (ミリ秒) の一覧から、スループットとパーセンタイルの辞書を作る"""
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'rps': round(len(timings) / elapsed, 1) if elapsed else None,
+        'p50_ms': _round(percentile(timings, 50)),
+        'p95_ms': _round(percentile(timings, 95)),
+        'p99_ms': _round(percentile(timings, 99)),
+        'mean_ms': _round(statistics.fmean(timings)) if timings else None,
+        'max_ms': _round(timings[-1]) if timings else None,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
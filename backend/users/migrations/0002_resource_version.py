@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(choices=[('ramenlog', 'ラーメンログ'), ('following', 'フォロー中'), ('followers', 'フォロワー'), ('pending', '保留中のフォローリクエスト')], max_length=20)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='resourceversion',
+            constraint=models.UniqueConstraint(fields=('user', 'resource'), name='unique_resource_version'),
+        ),
+    ]
@@ -1,8 +1,80 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     # AbstractUserがDjangoに必要なフィールド（username, groups, user_permissionsなど）を
     # すべて提供しているため、ここではカスタムフィールドのみを定義します。
     # 必要に応じて、追加のフィールドをここに定義できます。
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class CachedUser(User):
+    """
+    JWT 認証のキャッシュ (authentication.CachedJWTAuthentication) から作るユーザー。
+    id・is_active・password だけを持ち、それ以外の属性に初めて触れたときに
+    残りのフィールドをまとめて1クエリで読み込む。
+    """
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            # 遅延読み込みのフィールドごとにクエリを発行しないよう、まとめて読み込む
+            fields = deferred
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+
+
+class ResourceVersion(models.Model):
+    """
+    ユーザーごと・一覧ごとの更新番号。一覧の内容が変わる書き込みのたびに1つ増やし、
+    一覧APIの条件付き GET (ETag) の判定に使う。更新は versions.bump() から行う。
+    """
+    class Resource(models.TextChoices):
+        RAMEN_LOGS = 'ramenlog', 'ラーメンログ'
+        FOLLOWING = 'following', 'フォロー中'
+        FOLLOWERS = 'followers', 'フォロワー'
+        PENDING_REQUESTS = 'pending', '保留中のフォローリクエスト'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    resource = models.CharField(max_length=20, choices=Resource.choices)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'resource'], name='unique_resource_version'),
+        ]
+
+
+
+class AccountDeletion(models.Model):
+    """
+    退会したユーザーの関連データの削除ジョブ。退会時に作成し (ユーザーはその場で無効にする)、
+    purge_accounts コマンドが account_deletion.STEPS の順に少しずつ削除して、最後にユーザーを削除する。
+    進み具合は1回の削除と同じトランザクションで記録するため、途中で止まっても続きから再開できる。
+    """
+    # ユーザーは最後に削除するため、外部キーにはしない
+    user_id = models.BigIntegerField(unique=True)
+    # 次に削除するステップ (account_deletion.STEPS の name。すべて終えたら 'user')。空なら未着手
+    step = models.CharField(max_length=50, blank=True)
+    # ステップごとの削除した行数
+    deleted = models.JSONField(default=dict)
+    # 処理中のワーカーの期限 (これを過ぎたら、止まったものとして別のワーカーが引き継ぐ)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # 未完了のジョブを古い順に取り出すため
+            models.Index(
+                fields=['requested_at'], name='account_deletion_pending_idx',
+                condition=models.Q(finished_at__isnull=True),
+            ),
+        ]
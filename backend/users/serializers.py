@@ -27,4 +27,37 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         バリデーション済みデータからユーザーを作成し、パスワードをハッシュ化する
         """
         user = User.objects.create_user(**validated_data)
-        return user
\ No newline at end of file
+        return user
+
+# --- 一覧用の軽量な読み取り専用パス ---
+
+# UserSerializer と同じ出力を values() の行から組み立てるためのフィールド
+USER_VALUES = ('id', 'username', 'email', 'created_at')
+
+_datetime_field = serializers.DateTimeField()
+
+
+def user_values(prefix):
+    """関連先ユーザーを values() で取得するためのフィールド名 (例: 'follower__id') を返す"""
+    return tuple(f'{prefix}__{name}' for name in USER_VALUES)
+
+
+def serialize_user_row(row, prefix):
+    """values() の行から UserSerializer と同じ形の辞書を組み立てる"""
+    created_at = row[f'{prefix}__created_at']
+    return {
+        'id': row[f'{prefix}__id'],
+        'username': row[f'{prefix}__username'],
+        'email': row[f'{prefix}__email'],
+        'created_at': None if created_at is None else _datetime_field.to_representation(created_at),
+    }
+
+
+class AccountDeleteSerializer(serializers.Serializer):
+    """退会用のシリアライザ (確認のためパスワードを受け取る)"""
+    password = serializers.CharField(write_only=True, trim_whitespace=False)
+
+    def validate_password(self, value):
+        if not self.context['request'].user.check_password(value):
+            raise serializers.ValidationError('パスワードが正しくありません。')
+        return value
@@ -1,3 +1,414 @@
+import io
+import time
+from unittest import mock
+
+import msgpack
+import psycopg2
+from asgiref.sync import sync_to_async
+
+from django.core.management import call_command
+from django.db import connection, models
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ramen_log import importers
+from ramen_log.models import RamenLog, RamenStats, Shop, TimelineEntry
+from ramen_project.postgresql_pool.base import ConnectionPool
+from user_relationships.models import IkitaiStatus, UserRelationship
+from .async_views import AsyncAPIView
+from .authentication import UserCache, user_cache
+from .models import AccountDeletion, CachedUser, ResourceVersion, User
+from . import account_deletion, versions
+
+
+class ResourceVersionTest(TestCase):
+    def test_bump_creates_and_increments_after_commit(self):
+        user = User.objects.create_user(username='counter', password='pass')
+        self.assertEqual(versions.current(user.id, versions.Resource.RAMEN_LOGS), (0, None))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            versions.bump(user.id, versions.Resource.RAMEN_LOGS, versions.Resource.FOLLOWERS)
+            # コミットされるまでは増えない
+            self.assertFalse(ResourceVersion.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump(user.id, versions.Resource.RAMEN_LOGS)
+        self.assertEqual(versions.current(user.id, versions.Resource.RAMEN_LOGS)[0], 2)
+        self.assertEqual(versions.current(user.id, versions.Resource.FOLLOWERS)[0], 1)
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mobile', password='pass')
+        self.other = User.objects.create_user(username='friend', password='pass')
+        RamenLog.objects.create(user=self.user, shop_name='一蘭')
+        self.client.force_authenticate(user=self.user)
+
+    def get(self, name, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse(name), params, **headers)
+
+    def test_unchanged_list_is_answered_with_304_without_list_query(self):
+        first = self.get('ramenlog-list-create')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('private', first['Cache-Control'])
+        # 番号を読む1クエリだけで、一覧のクエリは実行しない
+        with self.assertNumQueries(1):
+            second = self.get('ramenlog-list-create', etag=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        # ページやクエリパラメータが違えば別の ETag になる
+        self.assertNotEqual(self.get('ramenlog-list-create', page_size=1)['ETag'], first['ETag'])
+
+    def test_writes_invalidate_ramenlog_etag(self):
+        etag = self.get('ramenlog-list-create')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post(reverse('ramenlog-list-create'), {'shop_name': '二郎'})
+        response = self.get('ramenlog-list-create', etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('ramenlog-delete', args=[created.data['id']]))
+        self.assertEqual(self.get('ramenlog-list-create', etag=etag).status_code, 200)
+
+    def test_if_modified_since_is_not_used(self):
+        # Last-Modified は秒単位で、同じ秒の中の書き込みを区別できないため返さない (ETag だけで判定する)
+        response = self.get('ramenlog-list-create')
+        self.assertNotIn('Last-Modified', response)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('ramenlog-list-create'), {'shop_name': '二郎'})
+        response = self.client.get(reverse('ramenlog-list-create'), HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+
+    def test_follow_flow_invalidates_relationship_lists(self):
+        self.client.force_authenticate(user=self.other)
+        pending = self.get('pending-follow-requests')['ETag']
+        followers = self.get('follower-list')['ETag']
+
+        self.client.force_authenticate(user=self.user)
+        following = self.get('following-list')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('follow-request'), {'user_id': self.other.id})
+        # 承認されるまでフォロー中の一覧は変わらない
+        self.assertEqual(self.get('following-list', etag=following).status_code, 304)
+
+        self.client.force_authenticate(user=self.other)
+        response = self.get('pending-follow-requests', etag=pending)
+        self.assertEqual((response.status_code, len(response.data)), (200, 1))
+        pending = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('follow-approve', args=[self.user.id]), {'action': 'approve'})
+        self.assertEqual(self.get('pending-follow-requests', etag=pending).status_code, 200)
+        response = self.get('follower-list', etag=followers)
+        self.assertEqual((response.status_code, len(response.data)), (200, 1))
+        followers = response['ETag']
+
+        self.client.force_authenticate(user=self.user)
+        response = self.get('following-list', etag=following)
+        self.assertEqual((response.status_code, len(response.data)), (200, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('unfollow', args=[self.other.id]))
+        self.assertEqual(self.get('following-list', etag=response['ETag']).status_code, 200)
+        self.assertFalse(UserRelationship.objects.exists())
+
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.get('follower-list', etag=followers).status_code, 200)
+
+
+class CachedJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='jwt', email='jwt@example.com', password='pass')
+        self.authorize(self.user)
+
+    def authorize(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def user_queries(self):
+        """ramenlog 一覧を取得し、users_user を読んだクエリの数を返す"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('ramenlog-list-create'))
+        self.assertEqual(response.status_code, 200)
+        return sum('FROM "users_user"' in q['sql'] for q in ctx.captured_queries)
+
+    def test_cached_user_skips_user_query(self):
+        self.assertEqual(self.user_queries(), 1)
+        self.assertEqual(self.user_queries(), 0)
+        self.assertEqual(len(user_cache), 1)
+
+    def test_cached_user_hydrates_remaining_fields_at_once(self):
+        self.user_queries()
+        response = self.client.get(reverse('ramenlog-list-create'))
+        user = response.wsgi_request.user
+        self.assertIsInstance(user, CachedUser)
+        with self.assertNumQueries(0):
+            self.assertEqual((user.pk, user.is_active), (self.user.pk, True))
+        with self.assertNumQueries(1):
+            self.assertEqual((user.username, user.email, user.created_at), ('jwt', 'jwt@example.com', self.user.created_at))
+        self.assertEqual(user, self.user)
+
+    def test_deactivation_evicts_cached_user(self):
+        self.user_queries()
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('ramenlog-list-create'))
+        self.assertEqual((response.status_code, response.data['code']), (401, 'user_inactive'))
+
+    def test_password_change_evicts_cached_user(self):
+        # simplejwt の api_settings は import 時に束縛されるため、override_settings ではなく属性を差し替える
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.authorize(self.user)
+            self.user_queries()
+            self.user.set_password('changed')
+            self.user.save()
+            response = self.client.get(reverse('ramenlog-list-create'))
+        self.assertEqual((response.status_code, response.data['code']), (401, 'password_changed'))
+
+    def test_cache_is_bounded_and_expires(self):
+        now = [0.0]
+        cache = UserCache(clock=lambda: now[0])
+        with self.settings(AUTH_USER_CACHE_SIZE=2, AUTH_USER_CACHE_TTL=10):
+            cache.set(1, 'a')
+            cache.set(2, 'b')
+            cache.get(1)
+            cache.set(3, 'c')
+            # 最も長く使われていない 2 が捨てられる
+            self.assertEqual((cache.get(1), cache.get(2), cache.get(3)), ('a', None, 'c'))
+            now[0] = 10
+            self.assertIsNone(cache.get(1))
+
+
+class ResponseFormatTest(APITestCase):
+    """Accept による JSON / MessagePack の選択と、users=ref でのユーザーの重複の除去"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='format', password='pass')
+        self.others = [User.objects.create_user(username=f'format_follower{i}', password='pass') for i in range(3)]
+        UserRelationship.objects.bulk_create([
+            UserRelationship(follower=other, followed=self.user, status=UserRelationship.STATUS_APPROVED)
+            for other in self.others
+        ])
+        RamenLog.objects.create(user=self.user, shop_name='一蘭', rating='4.5')
+        self.client.force_authenticate(user=self.user)
+
+    def test_msgpack_matches_json(self):
+        for name in ('ramenlog-list-create', 'follower-list'):
+            expected = self.client.get(reverse(name))
+            response = self.client.get(reverse(name), HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertIn('Accept', response['Vary'])
+            self.assertEqual(msgpack.unpackb(response.content), expected.json())
+            # 形式ごとに別の ETag になる
+            self.assertNotEqual(response['ETag'], expected['ETag'])
+            response = self.client.get(reverse(name), HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_user_references(self):
+        expected = self.client.get(reverse('follower-list')).json()
+        for accept, decode in (('application/json; users=ref', lambda r: r.json()),
+                               ('application/msgpack; users=ref', lambda r: msgpack.unpackb(r.content))):
+            body = decode(self.client.get(reverse('follower-list'), HTTP_ACCEPT=accept))
+            # 自分は3行すべてに出てくるが、users には1回だけ入る
+            self.assertEqual(sorted(user['id'] for user in body['users']), sorted([self.user.id] + [u.id for u in self.others]))
+            users = {user['id']: user for user in body['users']}
+            self.assertEqual([{**row, 'follower': users[row['follower']], 'followed': users[row['followed']]}
+                              for row in body['data']], expected)
+
+    def test_msgpack_request_body(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('ramenlog-list-create'), msgpack.packb({'shop_name': '二郎', 'rating': '3.5'}),
+                content_type='application/msgpack', HTTP_ACCEPT='application/msgpack',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(msgpack.unpackb(response.content)['shop_name'], '二郎')
+        for body in (b'\xc1', msgpack.packb({(1, 2): 3})):
+            response = self.client.post(reverse('ramenlog-list-create'), body, content_type='application/msgpack')
+            self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTest(APITestCase):
+    """ASGI (AsyncClient) では非同期版のビューが、同期版と同じレスポンスを返す"""
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='async', password='pass')
+        self.other = User.objects.create_user(username='async_friend', password='pass')
+        RamenLog.objects.bulk_create([RamenLog(user=self.user, shop_name=f'shop{i}') for i in range(3)])
+        UserRelationship.objects.create(follower=self.user, followed=self.other, status=UserRelationship.STATUS_APPROVED)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_lists_match_sync_views(self):
+        for name in ('ramenlog-list-create', 'following-list', 'follower-list', 'pending-follow-requests'):
+            url = reverse(name)
+            expected = await sync_to_async(self.client.get)(url, {'page_size': 2}, headers=self.headers)
+            response = await self.async_client.get(url, {'page_size': 2}, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(issubclass(response.resolver_match.func.view_class, AsyncAPIView))
+            self.assertEqual(response.json(), expected.json())
+            self.assertEqual(response['ETag'], expected['ETag'])
+            response = await self.async_client.get(url, {'page_size': 2}, headers={**self.headers, 'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, 304)
+
+    async def test_msgpack(self):
+        url = reverse('following-list')
+        expected = await sync_to_async(self.client.get)(url, headers={**self.headers, 'Accept': 'application/msgpack; users=ref'})
+        response = await self.async_client.get(url, headers={**self.headers, 'Accept': 'application/msgpack; users=ref'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        self.assertEqual(msgpack.unpackb(response.content)['data'][0]['followed'], self.other.id)
+
+    async def test_ikitai_status(self):
+        url = reverse('ikitai-status')
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        # 非同期版のないメソッド (POST) は同期版のビューで処理される
+        response = await self.async_client.post(
+            url, {'latitude': 35.0, 'longitude': 139.0, 'duration_type': 'now'}, content_type='application/json', headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual((response.status_code, response.json()['user']['username']), (200, 'async'))
+        self.assertTrue(await IkitaiStatus.objects.filter(user=self.user).aexists())
+
+    async def test_authentication_errors(self):
+        url = reverse('following-list')
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = await self.async_client.get(url, headers={'Authorization': 'Bearer broken'})
+        self.assertEqual((response.status_code, response.json()['code']), (401, 'token_not_valid'))
+
+
+class ConnectionPoolTest(TestCase):
+    def test_idle_connections_are_reset_and_reused(self):
+        params = connection.get_connection_params()
+        pool = ConnectionPool(size=1)
+        first = pool.get(lambda: psycopg2.connect(**params))
+        first.cursor().execute('SELECT 1')  # トランザクションが始まった状態で戻す
+        pool.put(first)
+        self.assertEqual(first.info.transaction_status, psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.assertIs(pool.get(lambda: None), first)
+
+        # size を超えた分は閉じる
+        second = psycopg2.connect(**params)
+        pool.put(first)
+        pool.put(second)
+        self.assertTrue(second.closed)
+        pool.clear()
+        self.assertTrue(first.closed)
+
+    def test_broken_connections_are_discarded(self):
+        params = connection.get_connection_params()
+        pool = ConnectionPool(size=2)
+        idle = psycopg2.connect(**params)
+        busy = psycopg2.connect(**params)
+        busy.cursor().execute('SELECT 1')
+        pool.put(idle)
+        # Postgres の再起動やアイドル接続のタイムアウトで、サーバー側から切られた
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s), pg_terminate_backend(%s)', [idle.get_backend_pid(), busy.get_backend_pid()])
+        # 戻すときのロールバックの失敗はエラーにせず、接続を閉じる
+        pool.put(busy)
+        self.assertTrue(busy.closed)
+        # 取り出すときに切れた接続は捨て、新しく接続する
+        fresh = pool.get(lambda: psycopg2.connect(**params))
+        self.assertIsNot(fresh, idle)
+        self.assertTrue(idle.closed)
+        fresh.close()
+
+
+class AccountDeletionTest(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='leaving', password='pass')
+        self.friend = User.objects.create_user(username='staying', password='pass')
+        UserRelationship.objects.create(follower=self.user, followed=self.friend, status=UserRelationship.STATUS_APPROVED)
+        UserRelationship.objects.create(follower=self.friend, followed=self.user, status=UserRelationship.STATUS_APPROVED)
+        importers.create_logs(self.user, [{'shop_name': '一蘭'} for _ in range(5)])
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(owner=self.friend, log=log, author=self.user) for log in RamenLog.objects.filter(user=self.user)
+        ])
+        RamenLog.objects.create(user=self.friend, shop_name='一蘭')
+        IkitaiStatus.objects.create(user=self.user, latitude=35.0, longitude=139.0, expires_at='2999-01-01T00:00:00Z')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_request_deactivates_immediately(self):
+        url = reverse('account-delete')
+        response = self.client.delete(url, {'password': 'wrong'}, format='json', **self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.delete(url, {'password': 'pass'}, format='json', **self.headers)
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(User.objects.get(id=self.user.id).is_active)
+        self.assertFalse(IkitaiStatus.objects.filter(user=self.user).exists())
+        self.assertTrue(AccountDeletion.objects.filter(user_id=self.user.id, finished_at__isnull=True).exists())
+        # 同じトークンはすぐに使えなくなる
+        self.assertEqual(self.client.get(reverse('ramenlog-list-create'), **self.headers).status_code, 401)
+
+    def test_purge_in_batches_resumes_where_it_stopped(self):
+        account_deletion.request_deletion(self.user)
+        # 1人あたり2回ずつしか削除させず、何度かに分けて進める
+        runs = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            while not account_deletion.purge(batch_size=2, max_batches=2):
+                runs += 1
+                job = AccountDeletion.objects.get(user_id=self.user.id)
+                self.assertIsNone(job.locked_until)
+                self.assertLess(runs, 30)
+        self.assertGreater(runs, 3)
+
+        job = AccountDeletion.objects.get(user_id=self.user.id)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual((job.deleted['ramen_logs'], job.deleted['timeline_authored'], job.step), (5, 5, 'user'))
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(UserRelationship.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertFalse(RamenStats.objects.filter(user_id=self.user.id).exists())
+        self.assertEqual(Shop.objects.get(name='一蘭').visit_count, 0)
+        self.assertEqual(RamenLog.objects.filter(user=self.friend).count(), 1)
+        # 相手のフォロー・フォロワーの一覧の ETag も変わる
+        self.assertTrue(ResourceVersion.objects.filter(user=self.friend, resource=versions.Resource.FOLLOWERS).exists())
+        self.assertEqual(account_deletion.purge(), 0)
+
+    def test_failed_job_is_released_and_retried(self):
+        account_deletion.request_deletion(self.user)
+        with mock.patch.object(account_deletion.Step, 'delete_batch', side_effect=RuntimeError('boom')), \
+                self.assertLogs('users.account_deletion', 'ERROR'):
+            self.assertEqual(account_deletion.purge(), 0)
+        job = AccountDeletion.objects.get(user_id=self.user.id)
+        self.assertEqual((job.attempts, job.locked_until), (1, None))
+        self.assertIn('boom', job.last_error)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(account_deletion.purge(), 1)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+
+
+class GenerateDatasetTest(TestCase):
+    def test_generates_and_deletes_dataset(self):
+        call_command('generate_dataset', '--users', '50', '--logs', '5', '--follows', '5', '--shops', '20',
+                     '--ikitai-ratio', '0.5', '--batch-size', '37', '--prefix', 'gen_', stdout=io.StringIO())
+        users = User.objects.filter(username__startswith='gen_')
+        self.assertEqual(users.count(), 50)
+        self.assertTrue(users.first().check_password('load-test-password'))
+        relationships = UserRelationship.objects.filter(follower__username__startswith='gen_')
+        self.assertTrue(relationships.exists())
+        self.assertFalse(relationships.filter(follower_id=models.F('followed_id')).exists())
+        logs = RamenLog.objects.filter(user__username__startswith='gen_')
+        self.assertTrue(logs.exists())
+        self.assertFalse(logs.filter(shop__isnull=True).exists())
+        # 店の訪問数はログの件数と一致する
+        self.assertEqual(sum(Shop.objects.filter(name__startswith='gen_').values_list('visit_count', flat=True)), logs.count())
+        # bulk_create でも近隣検索用の geohash が設定される
+        self.assertTrue(IkitaiStatus.objects.exists())
+        self.assertFalse(IkitaiStatus.objects.filter(geohash='').exists())
 
-# Create your tests here.
+        call_command('generate_dataset', '--delete', '--prefix', 'gen_', stdout=io.StringIO())
+        self.assertFalse(users.exists())
+        self.assertFalse(Shop.objects.filter(name__startswith='gen_').exists())
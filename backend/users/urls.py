@@ -1,9 +1,10 @@
 # ramen-app/backend/users/urls.py
 
 from django.urls import path
-from .views import UserRegisterView
+from .views import UserRegisterView, AccountDeleteView
 
 urlpatterns = [
     path('register/', UserRegisterView.as_view(), name='register'),
+    path('me/', AccountDeleteView.as_view(), name='account-delete'),
     # 他のユーザー関連APIもここに追加していく
 ]
\ No newline at end of file
@@ -0,0 +1,119 @@
+# users/versions.py
+"""
+一覧APIの条件付き GET (ETag / If-None-Match)。
+
+一覧の内容が変わる書き込み (ログの作成・削除、フォロー・承認・アンフォローなど) のたびに
+ResourceVersion の番号を bump() で1つ増やしておき、一覧APIは番号から ETag を作る。
+クライアントの ETag が一致すれば、一覧のクエリもシリアライズも行わずに 304 を返す。
+Last-Modified は返さない (秒単位のため、同じ秒の中の書き込みの後に If-Modified-Since だけで確認されると
+古い一覧に 304 を返してしまう)。
+"""
+import hashlib
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .models import ResourceVersion
+
+Resource = ResourceVersion.Resource
+
+
+def _increment(user_id, resource, now):
+    versions = ResourceVersion.objects.filter(user_id=user_id, resource=resource)
+    if versions.update(version=F('version') + 1, updated_at=now):
+        return
+    try:
+        with transaction.atomic():
+            ResourceVersion.objects.create(user_id=user_id, resource=resource, version=1, updated_at=now)
+    except IntegrityError:
+        # 同時に作成された場合は、作成された行を増やす
+        versions.update(version=F('version') + 1, updated_at=now)
+
+
+def bump(user_id, *resources):
+    """
+    user_id の一覧 resources の番号を1つ増やす。
+    書き込みがコミットされる前に増やすと、古い内容を新しい ETag で返してしまうことがあるため、
+    トランザクション中であればコミット後に増やす。
+    """
+    def run():
+        now = timezone.now()
+        for resource in resources:
+            _increment(user_id, resource, now)
+    transaction.on_commit(run)
+
+
+def bump_many(user_ids, *resources):
+    """
+    bump() の一括版。user_ids 全員の一覧 resources の番号を、コミット後に1文の UPSERT でまとめて増やす。
+    (フォローリクエストの一括承認など、多くのユーザーの一覧が同時に変わる場合に使う)
+    """
+    user_ids = list(user_ids)
+    if not user_ids or not resources:
+        return
+    table = ResourceVersion._meta.db_table
+
+    def run():
+        pairs = [(user_id, resource) for user_id in user_ids for resource in resources]
+        with connections[router.db_for_write(ResourceVersion)].cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, resource, version, updated_at)
+                SELECT user_id, resource, 1, %s FROM unnest(%s::bigint[], %s::text[]) AS t(user_id, resource)
+                ON CONFLICT (user_id, resource)
+                DO UPDATE SET version = {table}.version + 1, updated_at = EXCLUDED.updated_at
+                """,
+                [timezone.now(), [user_id for user_id, _ in pairs], [str(resource) for _, resource in pairs]],
+            )
+    transaction.on_commit(run)
+
+
+def current(user_id, resource):
+    """(番号, 最終更新日時) を返す。一度も更新されていない一覧は (0, None)"""
+    row = _version_row(user_id, resource).first()
+    return row or (0, None)
+
+
+async def acurrent(user_id, resource):
+    """current() の非同期版"""
+    row = await _version_row(user_id, resource).afirst()
+    return row or (0, None)
+
+
+def _version_row(user_id, resource):
+    return ResourceVersion.objects.filter(user_id=user_id, resource=resource).values_list('version', 'updated_at')
+
+
+def make_etag(request, resource, version):
+    """番号と、ユーザー・URL (ページやクエリパラメータ)・Accept (レスポンスの形式) ごとに異なる ETag を作る"""
+    key = f'{request.user.pk}:{resource}:{request.get_full_path()}:{request.META.get("HTTP_ACCEPT", "")}'
+    digest = hashlib.md5(key.encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def patch_response(response, etag):
+    """一覧のレスポンスに ETag とキャッシュの指定を付ける"""
+    response['ETag'] = etag
+    # 共有キャッシュには保存させず、毎回サーバーに確認させる
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization', 'Accept'])
+    return response
+
+
+class ConditionalListMixin:
+    """
+    一覧APIで条件付き GET に対応する mixin。version_resource に一覧の種類 (Resource) を指定する。
+    番号は一覧のクエリより先に読む (間に書き込みがあっても、新しい内容に古い ETag が付くだけで、
+    次のリクエストで取り直される)。
+    """
+    version_resource = None
+
+    def get(self, request, *args, **kwargs):
+        version, _ = current(request.user.pk, self.version_resource)
+        etag = make_etag(request, self.version_resource, version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return patch_response(response, etag)
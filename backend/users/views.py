@@ -1,8 +1,9 @@
-from rest_framework import generics, status
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from .serializers import UserSerializer, UserRegisterSerializer # 作成したシリアライザーをインポート
+from .serializers import UserSerializer, UserRegisterSerializer, AccountDeleteSerializer # 作成したシリアライザーをインポート
 from rest_framework_simplejwt.tokens import RefreshToken # トークン発行のためにインポート
 from .models import User
+from . import account_deletion
 
 class UserRegisterView(generics.CreateAPIView):
     queryset = User.objects.all() # Userモデル全体を対象とする
@@ -23,4 +24,18 @@ class UserRegisterView(generics.CreateAPIView):
             # レスポンスにトークンを追加
             "refresh": str(refresh),
             "access": str(refresh.access_token),
-        }, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        }, status=status.HTTP_201_CREATED)
+
+class AccountDeleteView(generics.GenericAPIView):
+    """
+    退会API (DELETE /api/users/me/、本文に確認用の password)。
+    ユーザーはその場で無効になり、ログやフォロー関係などのデータは purge_accounts コマンドが少しずつ削除する。
+    """
+    serializer_class = AccountDeleteSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def delete(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        account_deletion.request_deletion(request.user)
+        return Response({"message": "退会を受け付けました。データは順次削除されます。"}, status=status.HTTP_202_ACCEPTED)